@@ -0,0 +1,146 @@
+"""
+Cache warm-up for high-traffic regions.
+
+    python aquecimento.py sao-paulo rio-de-janeiro
+    python aquecimento.py --bbox=-23.70,-46.80,-23.40,-46.40 --precisao 5,4
+    python aquecimento.py --regioes regioes.json --intervalo 3600    # keeps running
+    python aquecimento.py sao-paulo --snapshot overpass_cache.snap   # then exports the snapshot
+
+Every tile of a region is looked up in the Overpass tile cache and fetched
+when missing or older than RENOVAR_FRACAO of the TTL, so it is renewed
+before a search could find it expired. Fetches reuse busca_lote's grouped
+bbox queries, with at most max_workers in flight and a token bucket holding
+upstream queries to qps per second. Precision 5 tiles serve searches up to
+15 km (new_buscar_clinicas._WIDE_RADIUS_M), precision 4 the wider ones.
+With --snapshot the warmed cache is exported after every round for workers
+that read it through new_buscar_clinicas.CACHE_SNAPSHOT (cache_snapshot.py).
+"""
+import json
+import threading
+import time
+from typing import Dict, Iterable, Sequence, Tuple
+
+import new_buscar_clinicas as _busca
+from busca_lote import aquecer_geohashes
+from cache_snapshot import exportar_snapshot
+from geo import bbox_geohashes
+from geocoding import TokenBucket
+
+# (south, west, north, east) of the metro areas with most searches
+REGIOES: Dict[str, Tuple[float, float, float, float]] = {
+    "sao-paulo": (-23.80, -46.83, -23.35, -46.36),
+    "rio-de-janeiro": (-23.08, -43.80, -22.75, -43.10),
+    "belo-horizonte": (-20.06, -44.07, -19.78, -43.85),
+    "brasilia": (-15.95, -48.12, -15.65, -47.75),
+    "curitiba": (-25.60, -49.39, -25.35, -49.18),
+    "porto-alegre": (-30.27, -51.27, -29.93, -51.05),
+}
+
+RENOVAR_FRACAO = 0.8
+# public mirrors ask for restraint; a private instance can take more
+AQUECER_QPS = 0.5
+AQUECER_WORKERS = 2
+
+def carregar_regioes(path: str) -> Dict[str, Tuple[float, float, float, float]]:
+    """{nome: [south, west, north, east]} from a JSON file."""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return {nome: tuple(float(v) for v in bbox) for nome, bbox in data.items()}
+
+def _parse_bbox(texto: str) -> Tuple[float, float, float, float]:
+    s, w, n, e = (float(v) for v in texto.split(","))
+    if s >= n or w >= e:
+        raise ValueError(f"bbox inválida: {texto}")
+    return s, w, n, e
+
+def aquecer_regioes(regioes: Dict[str, Sequence[float]], precisoes: Iterable[int] = (_busca.TILE_PRECISION,),
+                    overpass_url=None, cache_ttl_hours=12, max_workers=AQUECER_WORKERS, qps=AQUECER_QPS,
+                    renovar_fracao=RENOVAR_FRACAO) -> Dict[str, Dict]:
+    """
+    Warms every region's tiles at each precision; returns per-region counts
+    (tiles, renovados, consultas, falhas) and elapsed seconds.
+    """
+    max_age_s = cache_ttl_hours * 3600 * renovar_fracao
+    limiter = TokenBucket(rate=qps, capacity=1.0) if qps else None
+    report = {}
+    for nome, bbox in regioes.items():
+        t0 = time.perf_counter()
+        totals = {"tiles": 0, "renovados": 0, "consultas": 0, "falhas": 0}
+        for precision in precisoes:
+            r = aquecer_geohashes(bbox_geohashes(*bbox, precision=precision), overpass_url, max_age_s,
+                                  max_workers=max_workers, limiter=limiter)
+            for k in totals:
+                totals[k] += r[k]
+        totals["segundos"] = time.perf_counter() - t0
+        report[nome] = totals
+    return report
+
+def iniciar_aquecimento(regioes: Dict[str, Sequence[float]], intervalo_s: float = 3600,
+                        **kwargs) -> threading.Event:
+    """
+    Re-runs aquecer_regioes every intervalo_s in a daemon thread, for use inside
+    a long-running process. Returns an Event; set() it to stop the loop.
+    """
+    stop = threading.Event()
+
+    def run():
+        while not stop.is_set():
+            try:
+                aquecer_regioes(regioes, **kwargs)
+            except Exception as e:
+                print("Aviso aquecimento:", e)
+            stop.wait(intervalo_s)
+
+    threading.Thread(target=run, name="aquecimento-cache", daemon=True).start()
+    return stop
+
+def _print(report):
+    for nome, r in report.items():
+        print(f"{nome:18} {r['tiles']:5d} tiles  {r['renovados']:5d} renovados  {r['consultas']:4d} consultas"
+              f"  {r['falhas']:3d} falhas  {r['segundos']:7.1f} s")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pré-carrega o cache de tiles do Overpass para regiões movimentadas")
+    parser.add_argument("regioes", nargs="*", help=f"regiões conhecidas: {', '.join(REGIOES)}")
+    parser.add_argument("--bbox", action="append", default=[], help="--bbox=sul,oeste,norte,leste (pode repetir)")
+    parser.add_argument("--regioes", dest="arquivo", help="JSON {nome: [sul, oeste, norte, leste]}")
+    parser.add_argument("--precisao", default=str(_busca.TILE_PRECISION),
+                        help="precisões de geohash dos tiles, ex. 5,4")
+    parser.add_argument("--overpass-url")
+    parser.add_argument("--cache-db", help=f"arquivo do cache (padrão {_busca.CACHE_DB})")
+    parser.add_argument("--ttl-horas", type=float, default=12)
+    parser.add_argument("--renovar", type=float, default=RENOVAR_FRACAO,
+                        help="renova tiles com idade acima desta fração do TTL")
+    parser.add_argument("--workers", type=int, default=AQUECER_WORKERS)
+    parser.add_argument("--qps", type=float, default=AQUECER_QPS, help="consultas por segundo ao Overpass")
+    parser.add_argument("--intervalo", type=float, help="repete a cada N segundos em vez de rodar uma vez")
+    parser.add_argument("--snapshot", help="exporta o cache para este snapshot após cada rodada")
+    args = parser.parse_args()
+
+    alvo = {}
+    for nome in args.regioes:
+        if nome not in REGIOES:
+            parser.error(f"região desconhecida: {nome}")
+        alvo[nome] = REGIOES[nome]
+    for texto in args.bbox:
+        alvo[texto] = _parse_bbox(texto)
+    if args.arquivo:
+        alvo.update(carregar_regioes(args.arquivo))
+    if not alvo:
+        alvo = dict(REGIOES)
+    if args.cache_db:
+        _busca.CACHE_DB = args.cache_db
+
+    opcoes = dict(precisoes=[int(p) for p in args.precisao.split(",") if p], overpass_url=args.overpass_url,
+                  cache_ttl_hours=args.ttl_horas, max_workers=args.workers, qps=args.qps,
+                  renovar_fracao=args.renovar)
+    while True:
+        _print(aquecer_regioes(alvo, **opcoes))
+        if args.snapshot:
+            r = exportar_snapshot(_busca.CACHE_DB, args.snapshot)
+            print(f"snapshot {args.snapshot}: {r['entradas']} entradas, {r['bytes'] / 1024:.0f} KiB")
+        if not args.intervalo:
+            break
+        time.sleep(args.intervalo)
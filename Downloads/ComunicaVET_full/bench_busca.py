@@ -0,0 +1,265 @@
+"""
+Benchmark of the clinic search pipeline against a local Overpass stub.
+
+    python bench_busca.py [--sizes 10,1000,10000,50000] [--requests 200] [--out bench.json]
+    python bench_busca.py --fixture gravado.json        # replay a recorded response
+    python bench_busca.py --compare bench_anterior.json
+
+Every size gets a synthetic fixture (overpass_stub.fixture_sintetica) unless
+--fixture is given; the stub answers each query with the elements inside its
+bbox/around filters, so tile and per-query caching behave as against the real
+server. Workloads, each on a fresh cache file:
+
+    cold   a new, empty cache file for every request, each at a new place
+    warm   the same places again after a warm-up pass
+    mixed  80% warm places, 20% new ones
+
+Reported per workload: latency percentiles, sequential throughput, upstream
+queries, and peak traced memory (tracemalloc, measured in a separate pass so
+it does not skew the timings). Micro-benchmarks cover haversine_m,
+distances_m, specialty matching and _filter_pois. Results are written as JSON
+so runs on different commits can be compared with --compare.
+"""
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import new_buscar_clinicas as busca
+import overpass_stub
+from especialidade import TextIndex, compilar_especialidade
+from geo import _numpy, distances_m, haversine_m
+from overpass_stream import pois_from_json
+
+CENTRO = (-23.55, -46.63)
+RAIOS = (1000, 3000, 5000, 10000)
+ESPECIALIDADES = ("felino", "ortopedia", "exoticos", "dermatologia", "gatos")
+
+def _percentiles(samples_s):
+    xs = sorted(samples_s)
+    if not xs:
+        return {}
+
+    def pct(p):
+        return xs[min(len(xs) - 1, int(round(p / 100.0 * (len(xs) - 1))))] * 1e3
+
+    return {"p50_ms": pct(50), "p90_ms": pct(90), "p99_ms": pct(99), "max_ms": xs[-1] * 1e3,
+            "mean_ms": statistics.fmean(xs) * 1e3}
+
+def _area(fixture):
+    """(lat, lon, half_width_deg) of the box holding the fixture's elements."""
+    pts = [overpass_stub._element_pos(el) for el in fixture.get("elements", [])]
+    pts = [p for p in pts if p[0] is not None and p[1] is not None]
+    if not pts:
+        return CENTRO[0], CENTRO[1], 0.05
+    s, n = min(p[0] for p in pts), max(p[0] for p in pts)
+    w, e = min(p[1] for p in pts), max(p[1] for p in pts)
+    return (s + n) / 2, (w + e) / 2, max(n - s, e - w, 0.01) / 2
+
+def _requests(n, area, seed):
+    clat, clon, spread_deg = area
+    rnd = random.Random(seed)
+    out = []
+    for _ in range(n):
+        lat = clat + rnd.uniform(-spread_deg, spread_deg) * 0.8
+        lon = clon + rnd.uniform(-spread_deg, spread_deg) * 0.8
+        esp = rnd.choice(ESPECIALIDADES) if rnd.random() < 0.3 else None
+        out.append((lat, lon, rnd.choice(RAIOS), esp))
+    return out
+
+def _search(url, req):
+    lat, lon, raio, esp = req
+    return busca.buscar_clinicas_veterinarias(lat, lon, raio=raio, especialidade=esp, overpass_url=url)
+
+class _Env:
+    """Fresh cache file and module state for one workload."""
+
+    def __init__(self, workdir, name):
+        self.path = os.path.join(workdir, f"{name}.db")
+
+    def __enter__(self):
+        self.saved = (busca.CACHE_DB, list(busca._DEFAULT_OVERPASS_ENDPOINTS), busca._local_index)
+        busca.CACHE_DB = self.path
+        # never fall through to the public endpoints
+        busca._DEFAULT_OVERPASS_ENDPOINTS[:] = []
+        busca._local_index = None
+        return self
+
+    def __exit__(self, *exc):
+        busca._get_cache().close()
+        busca.CACHE_DB, endpoints, busca._local_index = self.saved
+        busca._DEFAULT_OVERPASS_ENDPOINTS[:] = endpoints
+
+def _cache_vazio(workdir, name, i):
+    """Points the search at a new cache file, opened before the request is timed."""
+    path = os.path.join(workdir, f"{name}-{i}.db")
+    # the same names come back for every fixture size
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    busca.CACHE_DB = path
+    busca._get_cache().memory.clear()
+    busca._init_cache()
+
+def _workload(kind, url, server, workdir, reqs, fresh, trace_memory=False):
+    """Runs one workload; returns its stats (timings are skipped when tracing memory)."""
+    name = f"{kind}{'-mem' if trace_memory else ''}"
+    cold = kind == "cold"
+    with _Env(workdir, name):
+        if kind == "warm":
+            plan = reqs
+            for r in reqs:
+                _search(url, r)
+        elif kind == "mixed":
+            for r in reqs:
+                _search(url, r)
+            rnd = random.Random(7)
+            plan = [fresh[i] if rnd.random() < 0.2 else reqs[i] for i in range(len(reqs))]
+        else:
+            plan = fresh
+        q0 = len(server.queries)
+        if trace_memory:
+            tracemalloc.start()
+            tracemalloc.reset_peak()
+            for i, r in enumerate(plan):
+                if cold:
+                    _cache_vazio(workdir, name, i)
+                _search(url, r)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            return {"peak_traced_kib": peak / 1024.0}
+        lat = []
+        total = 0.0
+        for i, r in enumerate(plan):
+            if cold:
+                _cache_vazio(workdir, name, i)
+            t = time.perf_counter()
+            _search(url, r)
+            lat.append(time.perf_counter() - t)
+            total += time.perf_counter() - t
+        stats = _percentiles(lat)
+        stats.update({"requests": len(plan), "throughput_rps": len(plan) / total if total else 0.0,
+                      "upstream_queries": len(server.queries) - q0})
+        if cold and stats["upstream_queries"] != len(plan):
+            # a request answered from cache would make the cold numbers warm ones
+            raise RuntimeError(f"cold: {stats['upstream_queries']} consultas ao Overpass para {len(plan)} buscas")
+        if not cold:
+            stats.update({k: v for k, v in busca.cache_stats().items() if k in ("hit_ratio", "mem_hits", "db_hits")})
+        return stats
+
+def _timeit(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t)
+    return best
+
+def _micro(fixture, area):
+    pois = pois_from_json(fixture)
+    lats = [p.lat for p in pois]
+    lons = [p.lon for p in pois]
+    lat, lon, _ = area
+    n = len(pois)
+    out = {"pois": n}
+    out["haversine_m_ns"] = _timeit(lambda: [haversine_m(lat, lon, a, b) for a, b in zip(lats, lons)]) / max(n, 1) * 1e9
+    out["distances_m_ms"] = _timeit(lambda: distances_m(lat, lon, lats, lons)) * 1e3
+    out["distances_m_fast_ms"] = _timeit(lambda: distances_m(lat, lon, lats, lons, fast=True)) * 1e3
+    out["text_index_ms"] = _timeit(lambda: TextIndex(pois)) * 1e3
+    texto = TextIndex(pois)
+    for esp in ("felino", "ortopedia", "cardiologia"):
+        out[f"especialidade_{esp}_ms"] = _timeit(lambda: compilar_especialidade(esp, 70).filtrar(texto)) * 1e3
+    out["filter_pois_ms"] = _timeit(lambda: busca._filter_pois(pois, lat, lon, 5000, None, 50)) * 1e3
+    out["filter_pois_especialidade_ms"] = _timeit(
+        lambda: busca._filter_pois(pois, lat, lon, 5000, "felino", 50)) * 1e3
+    return out
+
+def _spread_for(n):
+    # keeps density between a city centre and a metro area
+    return min(0.5, max(0.05, (n / 5000.0) ** 0.5 * 0.15))
+
+def _git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except Exception:
+        return None
+
+def run(sizes=(10, 1000, 10000, 50000), n_requests=200, fixture_path=None, delay_s=0.0, memory=True):
+    report = {"commit": _git_rev(), "python": platform.python_version(), "numpy": _numpy.available,
+              "requests": n_requests, "delay_s": delay_s, "sizes": {}}
+    if fixture_path:
+        with open(fixture_path, "r", encoding="utf-8") as f:
+            fixtures = {os.path.basename(fixture_path): json.load(f)}
+    else:
+        fixtures = {str(n): overpass_stub.fixture_sintetica(n, *CENTRO, spread_deg=_spread_for(n)) for n in sizes}
+
+    workdir = tempfile.mkdtemp(prefix="bench_busca_")
+    try:
+        for name, fixture in fixtures.items():
+            elements = fixture.get("elements", [])
+            area = _area(fixture)
+            server, url = overpass_stub.serve(overpass_stub.replay(fixture), delay_s=delay_s)
+            try:
+                reqs = _requests(n_requests, area, seed=11)
+                fresh = _requests(n_requests, area, seed=12)
+                entry = {"elements": len(elements), "workloads": {}}
+                for kind in ("cold", "warm", "mixed"):
+                    stats = _workload(kind, url, server, workdir, reqs, fresh)
+                    if memory:
+                        stats.update(_workload(kind, url, server, workdir, reqs[:50], fresh[:50], trace_memory=True))
+                    entry["workloads"][kind] = stats
+                entry["micro"] = _micro(fixture, area)
+                report["sizes"][name] = entry
+            finally:
+                server.shutdown()
+                server.server_close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+def _print(report, baseline=None):
+    print(f"commit {report['commit']}  python {report['python']}  numpy {report['numpy']}")
+    for name, entry in report["sizes"].items():
+        print(f"\n{name} POIs ({entry['elements']} elementos)")
+        for kind, st in entry["workloads"].items():
+            line = (f"  {kind:6} p50 {st['p50_ms']:8.2f} ms  p90 {st['p90_ms']:8.2f}  p99 {st['p99_ms']:8.2f}"
+                    f"  {st['throughput_rps']:8.1f} req/s  upstream {st['upstream_queries']:4d}")
+            if "peak_traced_kib" in st:
+                line += f"  pico {st['peak_traced_kib']:9.0f} KiB"
+            old = (baseline or {}).get("sizes", {}).get(name, {}).get("workloads", {}).get(kind)
+            if old:
+                line += f"  (p50 x{st['p50_ms'] / old['p50_ms']:.2f} vs {baseline.get('commit')})"
+            print(line)
+        micro = entry["micro"]
+        print("  micro " + "  ".join(f"{k}={v:.2f}" for k, v in micro.items() if k != "pois"))
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark da busca de clínicas com Overpass local")
+    parser.add_argument("--sizes", default="10,1000,10000,50000")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--fixture", help="resposta Overpass gravada ([out:json]) em vez das sintéticas")
+    parser.add_argument("--delay", type=float, default=0.0, help="atraso do stub por consulta, em segundos")
+    parser.add_argument("--no-memory", action="store_true")
+    parser.add_argument("--out", help="grava os resultados em JSON")
+    parser.add_argument("--compare", help="JSON de uma execução anterior")
+    args = parser.parse_args()
+
+    result = run([int(s) for s in args.sizes.split(",") if s], args.requests, args.fixture, args.delay,
+                 memory=not args.no_memory)
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    _print(result, baseline)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
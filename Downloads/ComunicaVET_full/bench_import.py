@@ -0,0 +1,89 @@
+"""
+Cold-start benchmark for short-lived workers.
+
+    python bench_import.py [--runs 15] [--json]
+
+Each run is a fresh interpreter that imports a module and, for the search
+entry points, makes one offline search (no network, no cache). Reports the
+median/min wall time of the import, of the first call and of later calls,
+plus the heaviest modules from python -X importtime.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+_PROBE = r"""
+import time, json
+t0 = time.perf_counter()
+import {module} as m
+t1 = time.perf_counter()
+out = {{"import_ms": (t1 - t0) * 1e3}}
+if hasattr(m, "buscar_clinicas_veterinarias"):
+    m.buscar_clinicas_veterinarias(-23.55, -46.63, use_overpass=False)
+    t2 = time.perf_counter()
+    for _ in range(200):
+        m.buscar_clinicas_veterinarias(-23.55, -46.63, use_overpass=False)
+    t3 = time.perf_counter()
+    out["first_call_ms"] = (t2 - t1) * 1e3
+    out["call_us"] = (t3 - t2) / 200 * 1e6
+print(json.dumps(out))
+"""
+
+MODULES = ("ai_actions", "new_buscar_clinicas", "busca_async", "geocoding")
+
+def _probe(module: str) -> dict:
+    res = subprocess.run([sys.executable, "-c", _PROBE.format(module=module)], cwd=HERE,
+                         capture_output=True, text=True, check=True)
+    return json.loads(res.stdout.strip().splitlines()[-1])
+
+def _importtime(module: str, top: int):
+    """(self_us, cumulative_us, name) of the most expensive imports."""
+    res = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=HERE,
+                         capture_output=True, text=True, check=True)
+    rows = []
+    for line in res.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cum_us, name = (p.strip() for p in line[len("import time:"):].split("|"))
+        rows.append((int(self_us), int(cum_us), name.strip()))
+    rows.sort(key=lambda r: r[1], reverse=True)
+    return rows[:top]
+
+def bench(modules=MODULES, runs: int = 15, top: int = 8) -> dict:
+    report = {}
+    for module in modules:
+        samples = [_probe(module) for _ in range(runs)]
+        stats = {}
+        for key in samples[0]:
+            vals = [s[key] for s in samples]
+            stats[key] = {"median": statistics.median(vals), "min": min(vals)}
+        stats["heaviest_imports"] = [{"module": n, "cumulative_ms": c / 1e3, "self_ms": s / 1e3}
+                                     for s, c, n in _importtime(module, top)]
+        report[module] = stats
+    return report
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Mede o tempo de import e da primeira busca em processo novo")
+    parser.add_argument("modules", nargs="*", default=list(MODULES))
+    parser.add_argument("--runs", type=int, default=15)
+    parser.add_argument("--top", type=int, default=8)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    report = bench(args.modules, args.runs, args.top)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for module, stats in report.items():
+            line = f"{module:22} import {stats['import_ms']['median']:7.1f} ms (min {stats['import_ms']['min']:.1f})"
+            if "first_call_ms" in stats:
+                line += (f" | 1a busca {stats['first_call_ms']['median']:6.2f} ms"
+                         f" | busca {stats['call_us']['median']:6.1f} us")
+            print(line)
+            for imp in stats["heaviest_imports"]:
+                print(f"    {imp['cumulative_ms']:7.1f} ms  {imp['module']}")
@@ -0,0 +1,242 @@
+"""
+asyncio variant of buscar_clinicas_veterinarias.
+Missing tiles are requested from every Overpass endpoint at once (optionally
+staggered by hedge_delay_s); the first good answer wins, the other requests
+are cancelled and the whole search respects deadline_s. Mirrors are raced in
+the order of the shared scheduler (endpoints.py), which also keeps mirrors with
+an open circuit breaker or a pending Retry-After out of the race. All races on
+an event loop share one aiohttp session, closed when asyncio.run() shuts the
+loop down (or by fechar_sessao()).
+aiter_clinicas is the async iterator counterpart of iter_clinicas.
+"""
+import asyncio
+import atexit
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+
+import new_buscar_clinicas as _busca
+from clinic_record import ClinicRecord
+from endpoints import EndpointRecusou, scheduler
+from geo import covering_geohashes
+from new_buscar_clinicas import (_DEFAULT_OVERPASS_ENDPOINTS, _Progressao, _absorb_tiles, _filter_pois,
+                                 _lookup_tiles, _merge_results, _offline_hits, _rank, _split_by_tile,
+                                 _tile_precision, _tiles_query, _tiles_to_fetch)
+from optional_deps import OptionalModule
+from overpass_stream import OVERPASS_DEFAULT_URL, USER_AGENT, iter_pois, open_overpass, pois_from_json
+from ranking import RANK_BUDGET_MS, RANK_POOL_FACTOR
+import search_log
+import telemetry
+
+# aiohttp — optional, falls back to urllib in worker threads; imported on the first race
+_aiohttp = OptionalModule("aiohttp")
+
+# own pool instead of the loop's default executor, so asyncio.run() does not
+# wait for the losing requests on shutdown
+_HTTP_EXECUTOR = ThreadPoolExecutor(max_workers=16, thread_name_prefix="overpass-http")
+
+# one aiohttp session (and connection pool) per event loop: loop -> (session, keeper task)
+_sessions = {}
+
+async def _keep_session(loop, session):
+    """Holds the loop's session open; asyncio.run() cancels it on shutdown, which closes the session."""
+    try:
+        await loop.create_future()
+    finally:
+        _sessions.pop(loop, None)
+        await session.close()
+
+def _session():
+    """The running loop's shared ClientSession, created on first use; None without aiohttp."""
+    aiohttp = _aiohttp.get()
+    if aiohttp is None:
+        return None
+    loop = asyncio.get_running_loop()
+    entry = _sessions.get(loop)
+    if entry is None or entry[0].closed:
+        session = aiohttp.ClientSession(headers={"User-Agent": USER_AGENT})
+        # the task is only weakly referenced by the loop, so the entry keeps it alive
+        entry = _sessions[loop] = (session, loop.create_task(_keep_session(loop, session)))
+    return entry[0]
+
+async def fechar_sessao():
+    """Closes the running loop's session now (for loops not driven by asyncio.run)."""
+    entry = _sessions.pop(asyncio.get_running_loop(), None)
+    if entry is not None:
+        # a keeper cancelled before its first step never reaches its finally
+        entry[1].cancel()
+        await entry[0].close()
+
+def _fechar_sessoes():
+    for loop, (session, keeper) in list(_sessions.items()):
+        if not loop.is_closed() and not loop.is_running():
+            keeper.cancel()
+            loop.run_until_complete(session.close())
+
+atexit.register(_fechar_sessoes)
+
+def _endpoint_urls(overpass_urls=None) -> List[str]:
+    if isinstance(overpass_urls, str):
+        overpass_urls = [overpass_urls]
+    urls = []
+    for u in (overpass_urls or _DEFAULT_OVERPASS_ENDPOINTS):
+        u = u or OVERPASS_DEFAULT_URL
+        if u not in urls:
+            urls.append(u)
+    return urls
+
+def _post_sync(url, q, timeout) -> Tuple[List[ClinicRecord], float]:
+    t0 = time.perf_counter()
+    with open_overpass(url, q, timeout) as fp:
+        latency_s = time.perf_counter() - t0
+        return list(iter_pois(fp)), latency_s
+
+async def _post_overpass(session, url, q, timeout) -> Tuple[List[ClinicRecord], float]:
+    """Raw POIs of one endpoint's answer, and the time to its response headers."""
+    if session is None:
+        # the worker thread cannot be interrupted; a cancelled race just stops waiting for it
+        return await asyncio.get_running_loop().run_in_executor(_HTTP_EXECUTOR, _post_sync, url, q, timeout)
+    t0 = time.perf_counter()
+    async with session.post(url, data={"data": q}, timeout=_aiohttp.get().ClientTimeout(total=timeout)) as resp:
+        latency_s = time.perf_counter() - t0
+        if resp.status != 200:
+            raise EndpointRecusou(url, resp.status, resp.headers.get("Retry-After"))
+        return pois_from_json(await resp.json(content_type=None)), latency_s
+
+async def _race_endpoints(q, urls: Sequence[str], deadline_s: float, hedge_delay_s: float = 0.0,
+                          session=None) -> Optional[List[ClinicRecord]]:
+    """
+    Raw POIs from the first endpoint that answers correctly, or None if all
+    fail or time runs out. session is an aiohttp ClientSession (None: urllib
+    in worker threads); it is left open.
+    """
+    sched = scheduler()
+    urls = sched.order(urls)
+    if not urls:
+        print("Aviso Overpass: nenhum endpoint disponível (circuit breaker aberto ou Retry-After pendente)")
+        return None
+    loop = asyncio.get_running_loop()
+    end = loop.time() + deadline_s
+
+    async def attempt(i, url):
+        if i and hedge_delay_s:
+            await asyncio.sleep(i * hedge_delay_s)
+        if not sched.allow(url):
+            raise RuntimeError(f"endpoint {url} indisponível")
+        try:
+            pois, latency_s = await _post_overpass(session, url, q, max(end - loop.time(), 0.1))
+        except asyncio.CancelledError:
+            sched.release(url)
+            raise
+        except Exception as e:
+            sched.failure(url, e)
+            raise
+        sched.success(url, latency_s)
+        return pois
+
+    pending = {asyncio.ensure_future(attempt(i, url)) for i, url in enumerate(urls)}
+    last_exc = None
+    try:
+        while pending:
+            remaining = end - loop.time()
+            if remaining <= 0:
+                last_exc = last_exc or asyncio.TimeoutError(f"prazo de {deadline_s}s esgotado")
+                break
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                if t.exception() is None:
+                    return t.result()
+                last_exc = t.exception()
+        if last_exc:
+            print("Aviso Overpass:", last_exc)
+        return None
+    finally:
+        for t in pending:
+            t.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+async def buscar_clinicas_veterinarias_async(lat, lon, raio=5000, especialidade=None, use_overpass=True, max_results=50,
+                                             overpass_urls=None, cache_ttl_hours=12, fuzzy_threshold=70,
+                                             deadline_s=15.0, hedge_delay_s=0.0, local_index=None, re_rank=True,
+                                             rank_budget_ms=RANK_BUDGET_MS):
+    """
+    Same results as buscar_clinicas_veterinarias (tile cache, offline index), but
+    Overpass endpoints are raced instead of tried one after the other.
+    """
+    t0 = time.perf_counter()
+    with telemetry.trace("busca_async", raio=raio, especialidade=especialidade, max_results=max_results):
+        pool = max_results * RANK_POOL_FACTOR if re_rank else max_results
+        index = local_index if local_index is not None else _busca._local_index
+        with telemetry.stage("offline"):
+            results = _offline_hits(index, lat, lon, raio, especialidade, pool, fuzzy_threshold)
+
+        if use_overpass and (index is None or len(results) < max_results):
+            # cache calls block on SQLite (up to its busy timeout): off the loop, keeping the trace context
+            await asyncio.to_thread(_busca._init_cache)
+            tiles = covering_geohashes(lat, lon, raio, _tile_precision(raio))
+            pois, missing, _ = await asyncio.to_thread(_lookup_tiles, tiles, int(cache_ttl_hours * 3600))
+            if missing:
+                wanted = _tiles_to_fetch(missing)
+                by_tile = None
+                if wanted:
+                    with telemetry.stage("overpass_race"):
+                        fetched = await _race_endpoints(_tiles_query(wanted), _endpoint_urls(overpass_urls),
+                                                        deadline_s, hedge_delay_s, _session())
+                    if fetched is None:
+                        telemetry.incr("overpass_failures")
+                    else:
+                        by_tile = _split_by_tile(fetched, wanted)
+                pois.extend(await asyncio.to_thread(_absorb_tiles, missing, wanted, by_tile))
+            results.extend(_filter_pois(pois, lat, lon, raio, especialidade, pool, fuzzy_threshold))
+
+        with telemetry.stage("merge"):
+            merged = _merge_results(results, pool)
+        out = [r.to_dict() for r in _rank(merged, max_results, re_rank, especialidade,
+                                           fuzzy_threshold, raio, rank_budget_ms)]
+    search_log.registrar_busca(lat, lon, raio, especialidade, len(out), time.perf_counter() - t0, origem="async")
+    return out
+
+async def aiter_clinicas(lat, lon, raio=5000, especialidade=None, use_overpass=True, max_results=50,
+                         overpass_urls=None, cache_ttl_hours=12, fuzzy_threshold=70, deadline_s=15.0,
+                         hedge_delay_s=0.0, local_index=None, ordem_estrita=True):
+    """
+    Async iterator version of new_buscar_clinicas.iter_clinicas: clinic dicts
+    nearest first as soon as they are known, each ring's missing tiles raced
+    across the endpoints. deadline_s bounds all the fetches together; tiles
+    not fetched by then fall back to their expired copies.
+    """
+    t0 = time.perf_counter()
+    index = local_index if local_index is not None else _busca._local_index
+    prog = _Progressao(lat, lon, raio, especialidade, max_results, fuzzy_threshold, ordem_estrita)
+    try:
+        with telemetry.stage("offline"):
+            local = _offline_hits(index, lat, lon, raio, especialidade, max_results, fuzzy_threshold)
+        prog.adicionar(local)
+        if use_overpass and (index is None or len(local) < max_results):
+            # SQLite off the loop, as in buscar_clinicas_veterinarias_async
+            await asyncio.to_thread(_busca._init_cache)
+            await asyncio.to_thread(prog.consultar_cache, int(cache_ttl_hours * 3600))
+            for c in prog.prontos():
+                yield c
+            end = time.monotonic() + deadline_s
+            for lote in prog.lotes():
+                remaining = end - time.monotonic()
+                wanted = _tiles_to_fetch(lote) if remaining > 0 else []
+                by_tile = None
+                if wanted:
+                    with telemetry.stage("overpass_race"):
+                        fetched = await _race_endpoints(_tiles_query(wanted), _endpoint_urls(overpass_urls),
+                                                        remaining, hedge_delay_s, _session())
+                    if fetched is None:
+                        telemetry.incr("overpass_failures")
+                    else:
+                        by_tile = _split_by_tile(fetched, wanted)
+                await asyncio.to_thread(prog.absorver, lote, wanted, by_tile)
+                for c in prog.prontos():
+                    yield c
+        for c in prog.prontos():
+            yield c
+    finally:
+        search_log.registrar_busca(lat, lon, raio, especialidade, prog.emitidos, time.perf_counter() - t0,
+                                   origem="async_stream")
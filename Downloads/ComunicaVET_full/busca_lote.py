@@ -0,0 +1,132 @@
+"""
+Batch entry point for back-office jobs.
+
+    buscar_clinicas_em_lote([(lat, lon, raio, especialidade), ...])
+
+All tiles missing from the cache are gathered first and fetched with a few
+bbox queries (one per group of neighbouring tiles), then every request is
+answered from the warm cache in a thread pool. Identical requests are run
+once and their result shared.
+"""
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Sequence
+
+import new_buscar_clinicas as _busca
+from geo import covering_geohashes
+from new_buscar_clinicas import (_diff_tiles, _fetch_tiles, _make_tile_key, _record_fetch, _tile_precision,
+                                 _tiles_to_fetch, buscar_clinicas_veterinarias)
+
+# one pool per (prefix, size), shared by every call instead of new threads per batch
+_executors: Dict[tuple, ThreadPoolExecutor] = {}
+_executors_lock = threading.Lock()
+
+def _executor(prefix: str, max_workers: int) -> ThreadPoolExecutor:
+    with _executors_lock:
+        pool = _executors.get((prefix, max_workers))
+        if pool is None:
+            pool = _executors[(prefix, max_workers)] = ThreadPoolExecutor(max_workers=max_workers,
+                                                                          thread_name_prefix=prefix)
+        return pool
+
+def _normalize_pedido(p) -> tuple:
+    if isinstance(p, dict):
+        return (float(p["lat"]), float(p["lon"]), int(p.get("raio", 5000)), p.get("especialidade"))
+    lat, lon = float(p[0]), float(p[1])
+    raio = int(p[2]) if len(p) > 2 and p[2] is not None else 5000
+    esp = p[3] if len(p) > 3 else None
+    return (lat, lon, raio, esp)
+
+def _group_tiles(tiles: Iterable[str], group_precision: int, max_tiles_per_query: int) -> List[List[str]]:
+    """Groups tiles sharing a coarser geohash prefix, split into chunks of at most max_tiles_per_query."""
+    groups = defaultdict(list)
+    for gh in sorted(set(tiles)):
+        groups[(len(gh), gh[:group_precision])].append(gh)
+    out = []
+    for tiles_in_group in groups.values():
+        for i in range(0, len(tiles_in_group), max_tiles_per_query):
+            out.append(tiles_in_group[i:i + max_tiles_per_query])
+    return out
+
+def aquecer_geohashes(tiles: Iterable[str], overpass_url=None, max_age_s=12 * 3600, max_workers=4,
+                      group_precision=4, max_tiles_per_query=64, limiter=None) -> Dict[str, int]:
+    """
+    Fetches the tiles missing from the cache or older than max_age_s; cached
+    copies are brought up to date with a diff query when
+    new_buscar_clinicas.DIFF_REFRESH. The cache is only peeked at, so warming
+    neither counts as hits nor fills the in-memory LRU, and tiles that failed
+    recently wait out their backoff like in a search. limiter, when given, has
+    its acquire() called before every upstream query (e.g. a
+    geocoding.TokenBucket). Returns counts of tiles, renewed tiles (por_diff of
+    them by a diff), queries and failed queries.
+    """
+    _busca._init_cache()
+    cache = _busca._get_cache()
+    tiles = sorted(set(tiles))
+    missing = [gh for gh in tiles if not cache.fresh(_make_tile_key(gh), int(max_age_s))]
+    groups = _group_tiles(missing, group_precision, max_tiles_per_query)
+    report = {"tiles": len(tiles), "renovados": 0, "por_diff": 0, "consultas": 0, "falhas": 0}
+    if not groups:
+        return report
+
+    def fetch(g):
+        """(tiles renewed by diff, tiles fetched in full, their POIs or None on failure, queries, failed queries)."""
+        by_diff, rest, queries, failed = {}, g, 0, 0
+        if _busca.DIFF_REFRESH:
+            if limiter is not None:
+                limiter.acquire()
+            by_diff, rest = _diff_tiles(g, overpass_url)
+            # {} when no tile had a copy to diff: nothing was sent
+            queries += by_diff != {}
+            failed += by_diff is None
+            by_diff = by_diff or {}
+        # a failed diff has just put its tiles in backoff too
+        wanted = _tiles_to_fetch(rest)
+        if not wanted:
+            return by_diff, [], {}, queries, failed
+        if limiter is not None:
+            limiter.acquire()
+        fetched = _fetch_tiles(wanted, overpass_url)
+        return by_diff, wanted, fetched, queries + 1, failed + (fetched is None)
+
+    for by_diff, wanted, fetched, queries, failed in _executor("overpass-lote", max_workers).map(fetch, groups):
+        report["consultas"] += queries
+        report["falhas"] += failed
+        report["renovados"] += len(by_diff) + len(fetched or {})
+        report["por_diff"] += len(by_diff)
+        _record_fetch(wanted, fetched)
+    return report
+
+def aquecer_tiles(pedidos: Sequence[tuple], overpass_url=None, cache_ttl_hours=12, max_workers=4,
+                  group_precision=4, max_tiles_per_query=64, limiter=None) -> int:
+    """Fetches every tile missing for these requests; returns how many upstream queries were made."""
+    wanted = set()
+    for lat, lon, raio, _ in pedidos:
+        wanted.update(covering_geohashes(lat, lon, raio, _tile_precision(raio)))
+    return aquecer_geohashes(wanted, overpass_url, int(cache_ttl_hours * 3600), max_workers, group_precision,
+                             max_tiles_per_query, limiter)["consultas"]
+
+def buscar_clinicas_em_lote(pedidos: Iterable, max_workers=8, max_results=50, overpass_url=None, cache_ttl_hours=12,
+                            fuzzy_threshold=70, use_overpass=True, group_precision=4, max_tiles_per_query=64,
+                            **kwargs) -> List[List[Dict]]:
+    """
+    pedidos: (lat, lon[, raio[, especialidade]]) tuples or dicts with the same keys.
+    Returns one result list per request, in the same order.
+    """
+    normalized = [_normalize_pedido(p) for p in pedidos]
+    if use_overpass:
+        aquecer_tiles(normalized, overpass_url, cache_ttl_hours, max_workers=min(max_workers, 4),
+                      group_precision=group_precision, max_tiles_per_query=max_tiles_per_query)
+
+    unique = list(dict.fromkeys(normalized))
+
+    def run(p):
+        lat, lon, raio, esp = p
+        return buscar_clinicas_veterinarias(lat, lon, raio=raio, especialidade=esp, use_overpass=use_overpass,
+                                            max_results=max_results, overpass_url=overpass_url,
+                                            cache_ttl_hours=cache_ttl_hours, fuzzy_threshold=fuzzy_threshold,
+                                            **kwargs)
+
+    answers = dict(zip(unique, _executor("busca-lote", max_workers).map(run, unique)))
+    return [list(answers[p]) for p in normalized]
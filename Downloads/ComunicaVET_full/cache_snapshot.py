@@ -0,0 +1,200 @@
+"""
+Read-only, memory-mapped snapshot of the Overpass cache, shared by worker
+processes.
+
+    python cache_snapshot.py --db overpass_cache.db --out overpass_cache.snap
+
+exportar_snapshot() compacts the SQLite cache into one immutable file; every
+worker maps it (new_buscar_clinicas.CACHE_SNAPSHOT) so its pages live once in
+the OS page cache instead of once per process, and a lookup is a binary
+search over the mapped hash column plus a slice of the mapping: no SQL, no
+JSON, no copy before decode. Misses and entries too old for the caller go to
+the live SQLite cache (TieredCache). A new export replaces the file
+atomically; open snapshots notice within RECARREGAR_S and remap it.
+
+Layout (little-endian):
+    header   magic "CVS1", count n, creation time
+    hashes   n x u64, sorted: first 8 bytes of blake2b(key)
+    entries  n x (ts f64, offset u64, length u32), in hash order
+    records  per entry: key length u16, kind u8, key, payload
+kind 0 is a raw payload (packed ClinicRecords), 1 is JSON text.
+"""
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+SNAPSHOT_PATH = "overpass_cache.snap"
+# how often an open snapshot checks whether the file was replaced
+RECARREGAR_S = 30.0
+# rows older than this are left out of the export (TieredCache's stale_ttl_s)
+EXPORTAR_MAX_IDADE_S = 7 * 86400
+
+_MAGIC = b"CVS1"
+_HEADER = struct.Struct("<4sId")
+_ENTRY = struct.Struct("<dQI")
+_RECORD = struct.Struct("<HB")
+_RAW, _JSON = 0, 1
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+def exportar_snapshot(db_path: str, out_path: str = SNAPSHOT_PATH,
+                      max_idade_s: Optional[float] = EXPORTAR_MAX_IDADE_S) -> Dict[str, float]:
+    """Writes the rows of the SQLite cache at db_path to out_path; returns counts and size."""
+    t0 = time.perf_counter()
+    conn = sqlite3.connect(db_path)
+    try:
+        sql, args = "SELECT k, ts, payload FROM cache", ()
+        if max_idade_s is not None:
+            sql, args = sql + " WHERE ts >= ?", (int(time.time() - max_idade_s),)
+        rows = conn.execute(sql, args).fetchall()
+    finally:
+        conn.close()
+
+    items = []
+    for k, ts, payload in rows:
+        if isinstance(payload, bytes):
+            kind, data = _RAW, payload
+        else:
+            kind, data = _JSON, str(payload).encode("utf-8")
+        items.append((_hash(k), k.encode("utf-8"), ts, kind, data))
+    items.sort(key=lambda it: it[0])
+
+    n = len(items)
+    records_off = _HEADER.size + n * 8 + n * _ENTRY.size
+    hashes, entries, records = [], [], []
+    off = records_off
+    for h, kb, ts, kind, data in items:
+        rec = _RECORD.pack(len(kb), kind) + kb + data
+        hashes.append(h)
+        entries.append(_ENTRY.pack(float(ts), off, len(rec)))
+        records.append(rec)
+        off += len(rec)
+
+    tmp = f"{out_path}.tmp{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, n, time.time()))
+        f.write(struct.pack(f"<{n}Q", *hashes))
+        f.write(b"".join(entries))
+        f.write(b"".join(records))
+    os.replace(tmp, out_path)
+    return {"entradas": n, "bytes": off, "segundos": time.perf_counter() - t0}
+
+
+class _Mapa:
+    """One mapped snapshot file."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            self.ident = (st.st_ino, st.st_mtime_ns, st.st_size)
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.n, self.criado = _HEADER.unpack_from(self.mm, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"{path} não é um snapshot do cache")
+        view = memoryview(self.mm)
+        self.hashes = view[_HEADER.size:_HEADER.size + self.n * 8].cast("Q")
+        self.entries_off = _HEADER.size + self.n * 8
+
+    def get_entry(self, key: str) -> Optional[Tuple[float, Any]]:
+        h = _hash(key)
+        hashes = self.hashes
+        i = bisect.bisect_left(hashes, h)
+        kb = None
+        while i < self.n and hashes[i] == h:
+            ts, off, length = _ENTRY.unpack_from(self.mm, self.entries_off + i * _ENTRY.size)
+            klen, kind = _RECORD.unpack_from(self.mm, off)
+            start = off + _RECORD.size
+            kb = kb or key.encode("utf-8")
+            if self.mm[start:start + klen] == kb:
+                payload = memoryview(self.mm)[start + klen:off + length]
+                return ts, (payload if kind == _RAW else json.loads(bytes(payload)))
+            i += 1
+        return None
+
+
+class CacheSnapshot:
+    """
+    Lookups in the snapshot at path, mapped on first use. A missing or broken
+    file reads as empty until a good one appears; a replaced file is remapped.
+    """
+
+    def __init__(self, path: str = SNAPSHOT_PATH, recarregar_s: float = RECARREGAR_S):
+        self.path = path
+        self.recarregar_s = recarregar_s
+        self._mapa: Optional[_Mapa] = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.errors = 0
+
+    def _atual(self) -> Optional[_Mapa]:
+        now = time.monotonic()
+        if now - self._checked < self.recarregar_s:
+            return self._mapa
+        with self._lock:
+            if now - self._checked < self.recarregar_s:
+                return self._mapa
+            self._checked = now
+            try:
+                st = os.stat(self.path)
+            except OSError:
+                self._mapa = None
+                return None
+            mapa = self._mapa
+            if mapa is None or mapa.ident != (st.st_ino, st.st_mtime_ns, st.st_size):
+                try:
+                    # the old mapping is released with its last view, not closed here
+                    self._mapa = _Mapa(self.path)
+                    self.reloads += 1
+                except (OSError, ValueError) as e:
+                    self.errors += 1
+                    print("Aviso snapshot:", e)
+                    self._mapa = None
+            return self._mapa
+
+    def get_entry(self, key: str) -> Optional[Tuple[float, Any]]:
+        """(ts, payload) regardless of age, or None; raw payloads are memoryviews into the mapping."""
+        mapa = self._atual()
+        entry = mapa.get_entry(key) if mapa is not None else None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+
+    def stats(self) -> Dict[str, float]:
+        mapa = self._mapa
+        with self._lock:
+            return {"snapshot_entries": mapa.n if mapa is not None else 0,
+                    "snapshot_hits": self.hits, "snapshot_misses": self.misses,
+                    "snapshot_reloads": self.reloads, "snapshot_errors": self.errors}
+
+    def close(self):
+        with self._lock:
+            self._mapa = None
+            self._checked = 0.0
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Exporta o cache do Overpass para um snapshot mapeado em memória")
+    parser.add_argument("--db", default="overpass_cache.db")
+    parser.add_argument("--out", default=SNAPSHOT_PATH)
+    parser.add_argument("--max-idade-horas", type=float, default=EXPORTAR_MAX_IDADE_S / 3600,
+                        help="deixa de fora entradas mais antigas (0 = todas)")
+    args = parser.parse_args()
+    r = exportar_snapshot(args.db, args.out, args.max_idade_horas * 3600 or None)
+    print(f"{r['entradas']} entradas, {r['bytes'] / 1024:.0f} KiB em {r['segundos']:.2f} s -> {args.out}")
@@ -0,0 +1,137 @@
+"""
+ClinicRecord: the one in-memory shape of a clinic, from parsing to ranking.
+Dicts are only produced by to_dict() when results leave
+buscar_clinicas_veterinarias. Lists of records are stored in the cache with
+pack_records(), a fixed struct layout that is smaller and faster to read
+than JSON.
+"""
+import math
+import struct
+from typing import Any, Dict, Iterable, List, Optional
+
+from especialidade import normalizar
+
+_OSM_TYPES = (None, "node", "way", "relation")
+_SOURCES = (None, "overpass", "local", "offline")
+
+# layout: header, count fixed-size blocks, then one UTF-8 blob with the 4 text
+# fields of every record joined by NUL (a lone \x01 stands for None)
+_MAGIC = b"CR2"
+_HEADER = struct.Struct("<3sI")
+# type code, source code, osm_id (-1 = none), lat, lon, distancia_m (NaN = none)
+_FIXED = struct.Struct("<BBqddd")
+_SEP = "\x00"
+_NONE = "\x01"
+
+
+class ClinicRecord:
+    __slots__ = ("osm_type", "osm_id", "nome", "endereco", "lat", "lon", "telefone", "especialidade",
+                 "distancia_m", "source")
+
+    def __init__(self, osm_type=None, osm_id=None, nome=None, endereco="", lat=0.0, lon=0.0, telefone=None,
+                 especialidade=None, distancia_m=None, source=None):
+        self.osm_type = osm_type
+        self.osm_id = osm_id
+        self.nome = nome
+        self.endereco = endereco
+        self.lat = lat
+        self.lon = lon
+        self.telefone = telefone
+        self.especialidade = especialidade
+        self.distancia_m = distancia_m
+        self.source = source
+
+    @property
+    def clinic_id(self) -> str:
+        """Stable identity: OSM type/id when known, else normalized name and position (~1 m)."""
+        if self.osm_type and self.osm_id is not None:
+            return f"{self.osm_type}/{self.osm_id}"
+        return f"{normalizar(self.nome)}@{self.lat:.5f},{self.lon:.5f}"
+
+    def located(self, distancia_m: float, source: str) -> "ClinicRecord":
+        """Copy carrying a distance and source; cached records are shared and never modified."""
+        return ClinicRecord(self.osm_type, self.osm_id, self.nome, self.endereco, self.lat, self.lon,
+                            self.telefone, self.especialidade, distancia_m, source)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Result dict as returned by buscar_clinicas_veterinarias."""
+        return {
+            "nome": self.nome or "Clínica Veterinária",
+            "endereco": self.endereco or "",
+            "lat": self.lat,
+            "lon": self.lon,
+            "telefone": self.telefone,
+            "especialidade": self.especialidade,
+            "distancia_m": self.distancia_m,
+            "source": self.source,
+        }
+
+    def to_poi_dict(self) -> Dict[str, Any]:
+        return {k: getattr(self, k) for k in self.__slots__ if getattr(self, k) is not None}
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "ClinicRecord":
+        return cls(d.get("osm_type"), d.get("osm_id"), d.get("nome"), d.get("endereco") or "",
+                   float(d["lat"]), float(d["lon"]), d.get("telefone"), d.get("especialidade"),
+                   d.get("distancia_m"), d.get("source"))
+
+    def __eq__(self, other):
+        if not isinstance(other, ClinicRecord):
+            return NotImplemented
+        return all(getattr(self, k) == getattr(other, k) for k in self.__slots__)
+
+    def __repr__(self):
+        return f"ClinicRecord({self.osm_type}/{self.osm_id} {self.nome!r} {self.lat:.6f},{self.lon:.6f})"
+
+
+def _code(table, value) -> int:
+    try:
+        return table.index(value)
+    except ValueError:
+        return 0
+
+def _text(s: Optional[str]) -> str:
+    return _NONE if s is None else str(s).replace(_SEP, " ")
+
+def pack_records(records: Iterable[ClinicRecord]) -> bytes:
+    records = list(records)
+    out = [_HEADER.pack(_MAGIC, len(records))]
+    texts = []
+    for r in records:
+        out.append(_FIXED.pack(_code(_OSM_TYPES, r.osm_type), _code(_SOURCES, r.source),
+                               -1 if r.osm_id is None else int(r.osm_id), float(r.lat), float(r.lon),
+                               math.nan if r.distancia_m is None else float(r.distancia_m)))
+        texts.extend((_text(r.nome), _text(r.endereco), _text(r.telefone), _text(r.especialidade)))
+    out.append(_SEP.join(texts).encode("utf-8"))
+    return b"".join(out)
+
+def unpack_records(data: bytes) -> List[ClinicRecord]:
+    magic, count = _HEADER.unpack_from(data, 0)
+    if magic != _MAGIC:
+        raise ValueError("payload não é um pacote de ClinicRecord")
+    start = _HEADER.size
+    end = start + count * _FIXED.size
+    if not count:
+        return []
+    texts = [None if t == _NONE else t for t in bytes(data[end:]).decode("utf-8").split(_SEP)]
+    out = []
+    for i, (t, src, osm_id, lat, lon, dist) in enumerate(_FIXED.iter_unpack(data[start:end])):
+        j = 4 * i
+        out.append(ClinicRecord(_OSM_TYPES[t], None if osm_id == -1 else osm_id, texts[j], texts[j + 1] or "",
+                                lat, lon, texts[j + 2], texts[j + 3], None if dist != dist else dist,
+                                _SOURCES[src]))
+    return out
+
+def encode_cache_value(value):
+    """Lists of records are packed; anything else is left for the JSON path."""
+    if isinstance(value, list) and (not value or isinstance(value[0], ClinicRecord)):
+        return pack_records(value)
+    return value
+
+def decode_cache_value(raw):
+    if isinstance(raw, (bytes, bytearray, memoryview)):
+        return unpack_records(raw)
+    # rows written before records were packed hold JSON lists of dicts
+    if isinstance(raw, list) and raw and isinstance(raw[0], dict) and "lat" in raw[0]:
+        return [ClinicRecord.from_dict(d) for d in raw]
+    return raw
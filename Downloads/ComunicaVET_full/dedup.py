@@ -0,0 +1,124 @@
+"""
+Merging of the same clinic reported more than once: as an OSM node and as
+a way centre, or by the offline index and by Overpass.
+
+Two records are the same clinic when they share clinic_id (OSM type/id), or
+when they lie within DEDUP_RAIO_M of each other and their names are alike
+once generic words ("clínica", "veterinária", ...) are dropped. Unnamed or
+generic-only names merge only within DEDUP_SEM_NOME_M. Neighbours are found
+through a grid of DEDUP_RAIO_M cells, so a pass is linear in the number of
+records and needs no sort.
+"""
+import math
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from clinic_record import ClinicRecord
+from especialidade import normalizar
+from geo import haversine_m
+from optional_deps import OptionalModule
+
+_fuzz = OptionalModule("rapidfuzz.fuzz")
+
+DEDUP_RAIO_M = 60.0
+DEDUP_SEM_NOME_M = 10.0
+DEDUP_NOME_MIN = 0.85
+
+_M_PER_DEG = 111320.0
+_GENERICAS = frozenset((
+    "clinica", "clinicas", "veterinaria", "veterinario", "veterinarias", "vet", "hospital", "pet", "pets",
+    "shop", "petshop", "centro", "medico", "consultorio", "animal", "animais", "e", "de", "da", "do", "dos",
+    "das", "clinic", "veterinary", "the",
+))
+
+def _nome_chave(nome) -> str:
+    """Normalized name without generic words; "" when nothing distinctive is left."""
+    return " ".join(t for t in normalizar(nome).split() if t not in _GENERICAS)
+
+def nomes_parecidos(a: str, b: str) -> bool:
+    """
+    a and b are _nome_chave() results, both non-empty. One name inside the
+    other counts only as whole words ("ana" is not in "mariana").
+    """
+    if a == b:
+        return True
+    ta, tb = set(a.split()), set(b.split())
+    if ta <= tb or tb <= ta:
+        return True
+    fuzz = _fuzz.get()
+    if fuzz is not None:
+        return fuzz.token_sort_ratio(a, b) >= DEDUP_NOME_MIN * 100
+    return len(ta & tb) / len(ta | tb) >= DEDUP_NOME_MIN
+
+def _mesma_clinica(a: ClinicRecord, ka: str, b: ClinicRecord, kb: str) -> bool:
+    if not ka or not kb:
+        return haversine_m(a.lat, a.lon, b.lat, b.lon) <= DEDUP_SEM_NOME_M
+    return nomes_parecidos(ka, kb)
+
+def _completar(keep: ClinicRecord, other: ClinicRecord) -> ClinicRecord:
+    """keep with its missing fields taken from other (a copy; records may be shared)."""
+    if all(getattr(keep, f) or not getattr(other, f) for f in ("nome", "endereco", "telefone", "especialidade")):
+        return keep
+    return ClinicRecord(keep.osm_type, keep.osm_id, keep.nome or other.nome, keep.endereco or other.endereco,
+                        keep.lat, keep.lon, keep.telefone or other.telefone,
+                        keep.especialidade or other.especialidade, keep.distancia_m, keep.source)
+
+class Deduplicador:
+    """
+    deduplicar() one record at a time, for results that arrive in batches.
+    registros holds the merged records, first occurrences in arrival order.
+    """
+
+    def __init__(self):
+        self.registros: List[ClinicRecord] = []
+        self._cell_lon = None
+        self._by_id: Dict[str, int] = {}
+        self._grid: Dict[Tuple[int, int], List[int]] = {}
+        # name keys are only computed for records that have a neighbour to compare with
+        self._chaves: List[Optional[str]] = []
+
+    def adicionar(self, r: ClinicRecord) -> Optional[int]:
+        """Position of r in registros when it is new; None when it was merged into an earlier record."""
+        out, chaves, grid = self.registros, self._chaves, self._grid
+        cell_lat = DEDUP_RAIO_M / _M_PER_DEG
+        if self._cell_lon is None:
+            self._cell_lon = cell_lat / max(math.cos(math.radians(r.lat)), 1e-6)
+        pos = self._by_id.get(r.clinic_id)
+        row, col = int(math.floor(r.lat / cell_lat)), int(math.floor(r.lon / self._cell_lon))
+        k = None
+        if pos is None:
+            for dr in (-1, 0, 1):
+                for dc in (-1, 0, 1):
+                    for j in grid.get((row + dr, col + dc), ()):
+                        o = out[j]
+                        if haversine_m(o.lat, o.lon, r.lat, r.lon) > DEDUP_RAIO_M:
+                            continue
+                        if k is None:
+                            k = _nome_chave(r.nome)
+                        if chaves[j] is None:
+                            chaves[j] = _nome_chave(o.nome)
+                        if _mesma_clinica(o, chaves[j], r, k):
+                            pos = j
+                            break
+                    if pos is not None:
+                        break
+                if pos is not None:
+                    break
+        if pos is not None:
+            out[pos] = _completar(out[pos], r)
+            self._by_id.setdefault(r.clinic_id, pos)
+            return None
+        self._by_id[r.clinic_id] = len(out)
+        grid.setdefault((row, col), []).append(len(out))
+        out.append(r)
+        chaves.append(k)
+        return len(out) - 1
+
+def deduplicar(records: Sequence[ClinicRecord]) -> List[ClinicRecord]:
+    """
+    records with duplicates merged into their first occurrence (which keeps its
+    position, distance and source, and gains the fields it was missing).
+    """
+    d = Deduplicador()
+    for r in records:
+        d.adicionar(r)
+    return d.registros
@@ -0,0 +1,215 @@
+"""
+Health tracking and ordering of the Overpass mirrors, shared by every search
+(sync, batch and async) in the process.
+
+Per mirror it keeps a rolling (EWMA) response time and error rate, and
+orders mirrors by expected cost: latency + error_rate * PENALIDADE_FALHA_S.
+Mirrors without a measurement yet go first, so each is sampled once. A circuit
+breaker opens after BREAKER_FAILURES consecutive failures; while open the
+mirror is skipped, and once BREAKER_OPEN_S has passed a single request is let
+through as a half-open probe. A good probe closes the breaker, a bad one
+reopens it for twice as long (up to BREAKER_MAX_OPEN_S). HTTP 429 and 503
+answers are rate-limit signals rather than failures: the mirror is skipped
+for its Retry-After (RETRY_AFTER_DEFAULT_S when absent).
+"""
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+EWMA_ALPHA = 0.3
+# what a failed attempt costs on top of the next mirror's answer
+PENALIDADE_FALHA_S = 5.0
+BREAKER_FAILURES = 3
+BREAKER_OPEN_S = 60.0
+BREAKER_MAX_OPEN_S = 900.0
+RETRY_AFTER_DEFAULT_S = 30.0
+RETRY_AFTER_MAX_S = 600.0
+# a half-open probe that never reported back frees its slot after this long
+PROBE_TIMEOUT_S = 120.0
+
+_RATE_LIMIT_STATUS = (429, 503)
+
+
+class EndpointRecusou(RuntimeError):
+    """Non-200 answer of a mirror, for clients that do not raise urllib's HTTPError (aiohttp)."""
+
+    def __init__(self, url: str, status: int, retry_after: Optional[str] = None):
+        super().__init__(f"HTTP {status} em {url}")
+        self.status = status
+        self.retry_after = retry_after
+
+def _status(exc) -> Optional[int]:
+    return getattr(exc, "status", None) or getattr(exc, "code", None)
+
+def retry_after_s(exc) -> Optional[float]:
+    """Seconds to stay away from a mirror when exc is a 429/503 answer, else None."""
+    if _status(exc) not in _RATE_LIMIT_STATUS:
+        return None
+    raw = getattr(exc, "retry_after", None)
+    headers = getattr(exc, "headers", None)
+    if raw is None and headers is not None:
+        raw = headers.get("Retry-After")
+    if raw is None:
+        return RETRY_AFTER_DEFAULT_S
+    raw = str(raw).strip()
+    try:
+        wait = float(raw)
+    except ValueError:
+        # imported here: only an HTTP-date Retry-After needs email, which is slow to import
+        import email.utils
+        try:
+            wait = email.utils.parsedate_to_datetime(raw).timestamp() - time.time()
+        except (TypeError, ValueError):
+            wait = RETRY_AFTER_DEFAULT_S
+    return min(max(wait, 0.0), RETRY_AFTER_MAX_S)
+
+
+class EndpointState:
+    __slots__ = ("url", "latency_s", "error_rate", "failures_seguidas", "open_s", "open_until",
+                 "probe_since", "blocked_until", "requests", "failures", "rate_limited", "last_error")
+
+    def __init__(self, url: str):
+        self.url = url
+        self.latency_s = None
+        self.error_rate = 0.0
+        self.failures_seguidas = 0
+        self.open_s = BREAKER_OPEN_S
+        # breaker is open while open_until is set; half-open once it has passed
+        self.open_until = None
+        self.probe_since = None
+        # Retry-After
+        self.blocked_until = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.rate_limited = 0
+        self.last_error = None
+
+    def expected_s(self) -> float:
+        return (self.latency_s or 0.0) + self.error_rate * PENALIDADE_FALHA_S
+
+    def estado(self, now: float) -> str:
+        if self.open_until is None:
+            return "fechado"
+        return "aberto" if now < self.open_until else "meio-aberto"
+
+    def to_dict(self, now: float) -> Dict:
+        return {"url": self.url, "estado": self.estado(now),
+                "latency_ms": None if self.latency_s is None else self.latency_s * 1e3,
+                "error_rate": self.error_rate, "expected_ms": self.expected_s() * 1e3,
+                "requests": self.requests, "failures": self.failures, "rate_limited": self.rate_limited,
+                "blocked_s": max(self.blocked_until - now, 0.0), "last_error": self.last_error}
+
+
+class EndpointScheduler:
+    """
+    Thread-safe. Callers take order() once per request, ask allow(url) right
+    before each attempt and report it with success()/failure(), or release()
+    when the attempt was abandoned (a cancelled race loser).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states: Dict[str, EndpointState] = {}
+
+    def _state(self, url: str) -> EndpointState:
+        st = self._states.get(url)
+        if st is None:
+            st = self._states[url] = EndpointState(url)
+        return st
+
+    def _available(self, st: EndpointState, now: float) -> bool:
+        if now < st.blocked_until:
+            return False
+        if st.open_until is None:
+            return True
+        if now < st.open_until:
+            return False
+        return st.probe_since is None or now - st.probe_since > PROBE_TIMEOUT_S
+
+    def order(self, urls: Sequence[str], pinned: Optional[str] = None) -> List[str]:
+        """
+        urls that may be tried now, fastest expected first (ties keep the given
+        order); pinned, when available, stays first.
+        """
+        now = time.monotonic()
+        with self._lock:
+            ranked = sorted((st.expected_s(), i, st.url) for i, st in enumerate(self._state(u) for u in urls)
+                            if self._available(st, now))
+        out = [u for _, _, u in ranked]
+        if pinned in out:
+            out.remove(pinned)
+            out.insert(0, pinned)
+        return out
+
+    def allow(self, url: str) -> bool:
+        """Whether url may be tried now; claims the half-open probe when it is due."""
+        now = time.monotonic()
+        with self._lock:
+            st = self._state(url)
+            if not self._available(st, now):
+                return False
+            if st.open_until is not None:
+                st.probe_since = now
+            return True
+
+    def success(self, url: str, latency_s: float):
+        with self._lock:
+            st = self._state(url)
+            st.requests += 1
+            if st.latency_s is None:
+                st.latency_s = latency_s
+            else:
+                st.latency_s += EWMA_ALPHA * (latency_s - st.latency_s)
+            st.error_rate -= EWMA_ALPHA * st.error_rate
+            st.failures_seguidas = 0
+            st.open_s = BREAKER_OPEN_S
+            st.open_until = st.probe_since = None
+
+    def failure(self, url: str, exc: BaseException):
+        now = time.monotonic()
+        wait = retry_after_s(exc)
+        with self._lock:
+            st = self._state(url)
+            st.requests += 1
+            st.last_error = str(exc)[:200]
+            if wait is not None:
+                # the mirror is up but busy: not a health failure
+                st.rate_limited += 1
+                st.blocked_until = max(st.blocked_until, now + wait)
+                st.probe_since = None
+                return
+            st.failures += 1
+            st.error_rate += EWMA_ALPHA * (1.0 - st.error_rate)
+            st.failures_seguidas += 1
+            if st.probe_since is not None:
+                # failed half-open probe
+                st.open_s = min(st.open_s * 2, BREAKER_MAX_OPEN_S)
+                st.open_until = now + st.open_s
+            elif st.open_until is None and st.failures_seguidas >= BREAKER_FAILURES:
+                st.open_until = now + st.open_s
+            st.probe_since = None
+
+    def release(self, url: str):
+        with self._lock:
+            st = self._states.get(url)
+            if st is not None:
+                st.probe_since = None
+
+    def stats(self) -> List[Dict]:
+        now = time.monotonic()
+        with self._lock:
+            return [st.to_dict(now) for st in self._states.values()]
+
+    def reset(self):
+        with self._lock:
+            self._states.clear()
+
+
+_scheduler = EndpointScheduler()
+
+def scheduler() -> EndpointScheduler:
+    return _scheduler
+
+def endpoint_stats() -> List[Dict]:
+    """Per-mirror latency, error rate, breaker state and counters."""
+    return _scheduler.stats()
@@ -0,0 +1,253 @@
+"""
+Specialty matching for clinic searches.
+
+A query is compiled once per search (compilar_especialidade): it is
+normalized (case, accents, punctuation) and widened with its synonyms, e.g.
+"gatos" also looks for "felino". Candidate POIs are found through an inverted
+index over the tokens of their names and vet:speciality tags (TextIndex), so
+substring and fuzzy checks run on the distinct tokens instead of on every
+record. Fuzzy scoring, when rapidfuzz is installed, is done in bulk on the
+survivors only.
+"""
+import re
+import unicodedata
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Set, Tuple
+
+from optional_deps import OptionalModule
+
+# rapidfuzz optional for fuzzy matching, imported on the first fuzzy check
+_fuzz = OptionalModule("rapidfuzz.fuzz")
+_process = OptionalModule("rapidfuzz.process")
+
+# each group is one specialty; any member finds clinics tagged with any other
+SINONIMOS = (
+    ("felino", "felinos", "felina", "felinas", "gato", "gatos", "gata", "gatas", "feline", "cat", "cats"),
+    ("canino", "caninos", "canina", "caninas", "cao", "caes", "cachorro", "cachorros", "dog", "dogs"),
+    ("exotico", "exoticos", "exoticas", "silvestre", "silvestres", "pet exotico", "exotic", "exotics"),
+    ("ave", "aves", "passaros", "ornitologia", "birds", "avian"),
+    ("equino", "equinos", "cavalo", "cavalos", "equine", "horse", "horses"),
+    ("ortopedia", "ortopedico", "ortopedista", "orthopedics", "orthopaedics"),
+    ("dermatologia", "dermatologico", "dermato", "pele", "dermatology"),
+    ("oftalmologia", "oftalmologico", "oftalmo", "olhos", "ophthalmology"),
+    ("cardiologia", "cardiologico", "cardio", "coracao", "cardiology"),
+    ("oncologia", "oncologico", "cancer", "tumor", "oncology"),
+    ("odontologia", "odontologico", "dentista", "dentes", "dentistry", "dental"),
+    ("emergencia", "emergencias", "urgencia", "plantao", "24h", "24 horas", "emergency"),
+    ("cirurgia", "cirurgico", "cirurgica", "surgery"),
+)
+
+_PUNCT = re.compile(r"[^\w]+")
+
+# tags casa()/filtrar() look at (see poi_index.poi_from_tags)
+TAGS_OVERPASS = ("name", "vet:speciality", "speciality", "service")
+_ACENTOS = {"a": "aáàâãä", "e": "eéèêë", "i": "iíìîï", "o": "oóòôõö", "u": "uúùûü", "c": "cç", "n": "nñ"}
+
+@lru_cache(maxsize=65536)
+def _normalizar(s: str) -> str:
+    s = unicodedata.normalize("NFKD", s)
+    s = "".join(c for c in s if not unicodedata.combining(c)).casefold()
+    return " ".join(_PUNCT.sub(" ", s).split())
+
+def normalizar(s) -> str:
+    """Lowercase, accent-free, punctuation collapsed to single spaces; "" for None."""
+    if not s:
+        return ""
+    return _normalizar(str(s))
+
+@lru_cache(maxsize=65536)
+def _campos(nome, espec) -> Tuple[str, str, Tuple[str, ...]]:
+    """Normalized name, normalized specialty and their distinct tokens."""
+    nome = normalizar(nome)
+    espec = normalizar(espec)
+    return nome, espec, tuple(set((nome + " " + espec).split()))
+
+_SINONIMOS: Dict[str, FrozenSet[str]] = {}
+for _grupo in SINONIMOS:
+    _membros = frozenset(normalizar(t) for t in _grupo)
+    for _t in _membros:
+        _SINONIMOS[_t] = _SINONIMOS.get(_t, frozenset()) | _membros
+
+
+class TextIndex:
+    """
+    Normalized names and specialties of a POI list, plus a token -> positions
+    inverted index over both. Positions are indexes into the list given.
+    """
+
+    def __init__(self, pois: Iterable):
+        self.nomes: List[str] = []
+        self.especs: List[str] = []
+        postings: Dict[str, List[int]] = {}
+        for i, p in enumerate(pois):
+            nome, espec, tokens = _campos(p.nome, p.especialidade)
+            self.nomes.append(nome)
+            self.especs.append(espec)
+            for tok in tokens:
+                postings.setdefault(tok, []).append(i)
+        self.postings = postings
+        self.vocab = list(postings)
+
+    def __len__(self):
+        return len(self.nomes)
+
+    def positions(self, tokens: Iterable[str]) -> Set[int]:
+        out = set()
+        for tok in tokens:
+            out.update(self.postings.get(tok, ()))
+        return out
+
+def _bulk_match(queries: Sequence[str], choices: Sequence[str], scorer, cutoff: float) -> Set[int]:
+    """Indexes of the choices scoring at least cutoff against any of the queries."""
+    if not queries or not choices:
+        return set()
+    process = _process.get()
+    try:
+        scores = process.cdist(queries, choices, scorer=scorer, score_cutoff=cutoff, workers=1)
+    except ImportError:
+        # cdist needs numpy; extract gives the same answer one query at a time
+        out = set()
+        for q in queries:
+            out.update(i for _, _, i in process.extract(q, choices, scorer=scorer, score_cutoff=cutoff, limit=None))
+        return out
+    return set((scores >= cutoff).any(axis=0).nonzero()[0].tolist())
+
+
+class EspecialidadeQuery:
+    """A compiled specialty query; get one with compilar_especialidade()."""
+
+    def __init__(self, query: str, fuzzy_threshold: float = 70):
+        q = normalizar(query)
+        self.query = q
+        self.fuzzy_threshold = fuzzy_threshold
+        # the query itself matches anywhere in the text or fuzzily (as before); its
+        # synonyms only as whole words, so "cat" finds neither "Santa Catarina" nor "caes"
+        self.sinonimos = sorted(_SINONIMOS.get(q, frozenset()) - {q})
+        self.termos = ([q] if q else []) + self.sinonimos
+        self.palavras = sorted(set(q.split()))
+        # the token prefilter is looser than the final score so it does not drop
+        # what token_set_ratio on the whole field would still accept
+        self._token_cutoff = max(fuzzy_threshold - 15, 0)
+        self._token_memo: Dict[str, bool] = {}
+
+    def _exato(self, nome: str, espec: str) -> bool:
+        q = self.query
+        if q in nome or q in espec:
+            return True
+        nome, espec = f" {nome} ", f" {espec} "
+        return any(f" {t} " in nome or f" {t} " in espec for t in self.sinonimos)
+
+    def _token_perto(self, tok: str) -> bool:
+        ok = self._token_memo.get(tok)
+        if ok is None:
+            fuzz = _fuzz.get()
+            ok = any(w in tok for w in self.palavras) or (
+                fuzz is not None and any(fuzz.ratio(w, tok) >= self._token_cutoff for w in self.palavras))
+            self._token_memo[tok] = ok
+        return ok
+
+    def casa(self, p) -> bool:
+        """Single-record check, for filtering a stream as it is read."""
+        if not self.termos:
+            return True
+        nome, espec, tokens = _campos(p.nome, p.especialidade)
+        if self._exato(nome, espec):
+            return True
+        fuzz = _fuzz.get()
+        if fuzz is None or not any(self._token_perto(t) for t in tokens):
+            return False
+        thr = self.fuzzy_threshold
+        return bool((nome and fuzz.token_set_ratio(self.query, nome) >= thr)
+                    or (espec and fuzz.token_set_ratio(self.query, espec) >= thr))
+
+    def forca(self, p) -> float:
+        """Match strength in 0..1: tagged specialty > name > synonym > fuzzy; 1.0 for an empty query."""
+        if not self.termos:
+            return 1.0
+        nome, espec, _ = _campos(p.nome, p.especialidade)
+        q = self.query
+        if q in espec:
+            return 1.0
+        if self.sinonimos:
+            pe = f" {espec} "
+            if any(f" {t} " in pe for t in self.sinonimos):
+                return 0.9
+        if q in nome:
+            return 0.85
+        if self.sinonimos:
+            pn = f" {nome} "
+            if any(f" {t} " in pn for t in self.sinonimos):
+                return 0.75
+        fuzz = _fuzz.get()
+        if fuzz is None:
+            return 0.0
+        best = max(fuzz.token_set_ratio(q, nome) if nome else 0.0, fuzz.token_set_ratio(q, espec) if espec else 0.0)
+        return 0.6 * best / 100.0 if best >= self.fuzzy_threshold else 0.0
+
+    def regex_overpass(self) -> str:
+        """
+        POSIX regex finding any term in raw (accented, any case with the i flag)
+        tag values; a superset of the exact matches, without the fuzzy ones.
+        """
+        def termo(t):
+            out = []
+            for c in t:
+                if c == " ":
+                    # normalizar() collapsed punctuation and spaces, e.g. "cao & gato"
+                    out.append(".{0,3}")
+                elif c in _ACENTOS:
+                    v = _ACENTOS[c]
+                    out.append(f"[{v}{v.upper()}]")
+                else:
+                    out.append(c)
+            return "".join(out)
+
+        # a term containing another one adds nothing to a substring search
+        termos = [t for t in self.termos if not any(u != t and u in t for u in self.termos)]
+        return "|".join(termo(t) for t in termos)
+
+    def filtro_overpass(self) -> str:
+        """Overpass tag filter keeping elements whose name or specialty tags contain a term ("" for an empty query)."""
+        if not self.termos:
+            return ""
+        return f'[~"^({"|".join(TAGS_OVERPASS)})$"~"{self.regex_overpass()}",i]'
+
+    def filtrar(self, texto: TextIndex, posicoes: Optional[Iterable[int]] = None) -> Set[int]:
+        """Positions of texto (restricted to posicoes when given) whose name or specialty matches."""
+        allowed = None if posicoes is None else set(posicoes)
+        if not self.termos:
+            return set(range(len(texto))) if allowed is None else allowed
+
+        def restrict(s):
+            return s if allowed is None else s & allowed
+
+        # exact matches: every word of a term must be in some token of the record
+        # (inside it for the query, equal to it for synonyms), then the whole term is checked
+        found = set()
+        for termo in self.termos:
+            cand = None
+            for w in termo.split():
+                if termo == self.query:
+                    hit = texto.positions(tok for tok in texto.vocab if w in tok)
+                else:
+                    hit = set(texto.postings.get(w, ()))
+                cand = restrict(hit) if cand is None else cand & hit
+                if not cand:
+                    break
+            found.update(i for i in (cand or ()) if self._exato(texto.nomes[i], texto.especs[i]))
+        fuzz = _fuzz.get()
+        if fuzz is None or _process.get() is None:
+            return found
+
+        perto = _bulk_match(self.palavras, texto.vocab, fuzz.ratio, self._token_cutoff)
+        cand = sorted(restrict(texto.positions(texto.vocab[j] for j in perto)) - found)
+        if cand:
+            thr = self.fuzzy_threshold
+            for campo in (texto.nomes, texto.especs):
+                hits = _bulk_match([self.query], [campo[i] for i in cand], fuzz.token_set_ratio, thr)
+                found.update(cand[j] for j in hits if campo[cand[j]])
+        return found
+
+@lru_cache(maxsize=256)
+def compilar_especialidade(query: str, fuzzy_threshold: float = 70) -> EspecialidadeQuery:
+    return EspecialidadeQuery(query, fuzzy_threshold)
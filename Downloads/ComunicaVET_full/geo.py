@@ -0,0 +1,190 @@
+import heapq
+import math
+from typing import List, Optional, Sequence, Tuple
+
+from optional_deps import OptionalModule
+
+# numpy — optional, batch distances fall back to pure Python; only imported
+# for batches of at least _NUMPY_MIN points, below that the loop is as fast
+_numpy = OptionalModule("numpy")
+_NUMPY_MIN = 64
+
+_GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_GEOHASH_INDEX = {c: i for i, c in enumerate(_GEOHASH_BASE32)}
+
+# metres per degree of latitude (and of longitude at the equator)
+_M_PER_DEG = 111320.0
+_EARTH_R = 6371000.0
+
+# up to this radius the equirectangular approximation stays well under 0.1% off
+EQUIRECT_MAX_M = 20000
+
+def geohash_encode(lat: float, lon: float, precision: int = 5) -> str:
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    out = []
+    bit, ch, even = 0, 0, True
+    while len(out) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            if lon >= mid:
+                ch = (ch << 1) | 1
+                lon_lo = mid
+            else:
+                ch <<= 1
+                lon_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                ch = (ch << 1) | 1
+                lat_lo = mid
+            else:
+                ch <<= 1
+                lat_hi = mid
+        even = not even
+        bit += 1
+        if bit == 5:
+            out.append(_GEOHASH_BASE32[ch])
+            bit, ch = 0, 0
+    return "".join(out)
+
+def geohash_bbox(gh: str) -> Tuple[float, float, float, float]:
+    """Returns (south, west, north, east) of a geohash cell."""
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    even = True
+    for c in gh:
+        v = _GEOHASH_INDEX[c]
+        for shift in range(4, -1, -1):
+            b = (v >> shift) & 1
+            if even:
+                mid = (lon_lo + lon_hi) / 2
+                if b:
+                    lon_lo = mid
+                else:
+                    lon_hi = mid
+            else:
+                mid = (lat_lo + lat_hi) / 2
+                if b:
+                    lat_lo = mid
+                else:
+                    lat_hi = mid
+            even = not even
+    return lat_lo, lon_lo, lat_hi, lon_hi
+
+def geohash_cell_size(precision: int) -> Tuple[float, float]:
+    """Returns (lat_degrees, lon_degrees) of a cell at this precision."""
+    bits = 5 * precision
+    lon_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    R = _EARTH_R
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = math.radians(lat2 - lat1)
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2)**2
+    return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+def distances_m(lat: float, lon: float, lats: Sequence[float], lons: Sequence[float], fast: bool = False):
+    """
+    Distances in metres from lat/lon to every candidate, in one pass.
+    fast=True uses the equirectangular approximation (fine below EQUIRECT_MAX_M).
+    Returns a numpy array for large batches when numpy is available, a list otherwise.
+    """
+    np = _numpy.get() if len(lats) >= _NUMPY_MIN else None
+    if np is not None:
+        la = np.radians(np.asarray(lats, dtype=np.float64))
+        lo = np.radians(np.asarray(lons, dtype=np.float64))
+        phi = math.radians(lat)
+        dphi = la - phi
+        dlambda = lo - math.radians(lon)
+        if fast:
+            x = dlambda * np.cos((la + phi) * 0.5)
+            return _EARTH_R * np.sqrt(x * x + dphi * dphi)
+        a = np.sin(dphi * 0.5) ** 2 + math.cos(phi) * np.cos(la) * np.sin(dlambda * 0.5) ** 2
+        return _EARTH_R * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    if fast:
+        phi = math.radians(lat)
+        rlon = math.radians(lon)
+        out = []
+        for la, lo in zip(lats, lons):
+            la = math.radians(la)
+            x = (math.radians(lo) - rlon) * math.cos((la + phi) * 0.5)
+            y = la - phi
+            out.append(_EARTH_R * math.sqrt(x * x + y * y))
+        return out
+    return [haversine_m(lat, lon, la, lo) for la, lo in zip(lats, lons)]
+
+def nearest_indices(dists, k: int, candidates: Optional[Sequence[int]] = None) -> List[int]:
+    """
+    Indices of the k smallest dists (restricted to candidates if given), nearest first.
+    Uses argpartition, so only the selected k get sorted.
+    """
+    if candidates is None:
+        candidates = range(len(dists))
+    n = len(candidates)
+    if k <= 0 or n == 0:
+        return []
+    np = _numpy.get() if n >= _NUMPY_MIN else None
+    if np is not None:
+        idx = np.asarray(candidates, dtype=np.intp)
+        d = np.asarray(dists, dtype=np.float64)[idx]
+        if k < n:
+            part = np.argpartition(d, k - 1)[:k]
+            idx, d = idx[part], d[part]
+        return idx[np.argsort(d, kind="stable")].tolist()
+    return heapq.nsmallest(k, candidates, key=dists.__getitem__)
+
+def radius_bbox(lat: float, lon: float, raio_m: float) -> Tuple[float, float, float, float]:
+    """(south, west, north, east) box that contains the circle of raio_m around lat/lon."""
+    dlat = raio_m / _M_PER_DEG
+    dlon = raio_m / (_M_PER_DEG * max(math.cos(math.radians(lat)), 1e-6))
+    return max(lat - dlat, -90.0), lon - dlon, min(lat + dlat, 90.0), lon + dlon
+
+def bbox_distance_m(lat: float, lon: float, bbox: Tuple[float, float, float, float]) -> float:
+    """Distance from lat/lon to the nearest point of a (south, west, north, east) box; 0 inside it."""
+    s, w, n, e = bbox
+    return haversine_m(lat, lon, min(max(lat, s), n), min(max(lon, w), e))
+
+def covering_geohashes(lat: float, lon: float, raio_m: float, precision: int = 5) -> List[str]:
+    """Geohash cells of the given precision that intersect the circle of raio_m around lat/lon."""
+    s, w, n, e = radius_bbox(lat, lon, raio_m)
+    dlat, dlon = geohash_cell_size(precision)
+    lat0 = math.floor((s + 90.0) / dlat) * dlat - 90.0
+    lon0 = math.floor((w + 180.0) / dlon) * dlon - 180.0
+    cells = []
+    seen = set()
+    clat = lat0
+    while clat < n:
+        clon = lon0
+        while clon < e:
+            # nearest point of the cell to the centre; skip cells the circle does not reach
+            plat = min(max(lat, clat), clat + dlat)
+            plon = min(max(lon, clon), clon + dlon)
+            if haversine_m(lat, lon, plat, plon) <= raio_m:
+                wrapped = ((clon + dlon / 2 + 180.0) % 360.0) - 180.0
+                gh = geohash_encode(min(clat + dlat / 2, 90.0), wrapped, precision)
+                if gh not in seen:
+                    seen.add(gh)
+                    cells.append(gh)
+            clon += dlon
+        clat += dlat
+    return cells
+
+def bbox_geohashes(s: float, w: float, n: float, e: float, precision: int = 5) -> List[str]:
+    """Geohash cells of the given precision that intersect the (south, west, north, east) box."""
+    dlat, dlon = geohash_cell_size(precision)
+    lat0 = math.floor((s + 90.0) / dlat) * dlat - 90.0
+    lon0 = math.floor((w + 180.0) / dlon) * dlon - 180.0
+    cells = []
+    clat = lat0
+    while clat < n:
+        clon = lon0
+        while clon < e:
+            cells.append(geohash_encode(min(clat + dlat / 2, 90.0), ((clon + dlon / 2 + 180.0) % 360.0) - 180.0,
+                                        precision))
+            clon += dlon
+        clat += dlat
+    return list(dict.fromkeys(cells))
@@ -0,0 +1,224 @@
+"""
+Geocoding with a local cache and a rate limiter for Nominatim.
+
+Addresses are normalized (case, accents, punctuation, whitespace and common
+abbreviations) before the cache lookup, so "Av. Paulista, 1000" and
+"avenida paulista 1000" share one entry. Nominatim allows 1 request/s; the
+token bucket only sleeps when requests actually come faster than that.
+Requests reuse http_pool's keep-alive connections (geopy 2 adapter).
+"""
+import json
+import re
+import socket
+import threading
+import time
+import unicodedata
+from typing import Iterable, Iterator, Optional, Tuple
+
+from http_pool import HTTPStatusError, pool
+from optional_deps import OptionalModule
+from overpass_cache import SQLiteCache
+import telemetry
+
+# geopy — optional, only imported on the first cache miss
+_geocoders = OptionalModule("geopy.geocoders")
+_geopy_exc = OptionalModule("geopy.exc")
+_geopy_adapters = OptionalModule("geopy.adapters")
+
+USER_AGENT = "ComunicaVET/1.0 (contato@example.com)"
+GEOCODE_DB = "geocode_cache.db"
+GEOCODE_TTL_S = 30 * 86400
+# "not found" answers are kept for less time, the address may be fixed in OSM
+GEOCODE_NOT_FOUND_TTL_S = 86400
+
+_ABREVIACOES = {
+    "r": "rua",
+    "av": "avenida",
+    "al": "alameda",
+    "tv": "travessa",
+    "pc": "praca",
+    "pca": "praca",
+    "rod": "rodovia",
+    "estr": "estrada",
+    "n": "numero",
+}
+# "nº", "n°", "n.", "n.º": matched before NFKD turns "º" into "o"; a bare "no" is the word ("no Centro")
+_NUMERO = re.compile(r"\bn(?:\s*[º°]\.?|\.\s*[º°]?)", re.IGNORECASE)
+
+def normalizar_endereco(endereco: str) -> str:
+    s = _NUMERO.sub(" numero ", str(endereco))
+    s = unicodedata.normalize("NFKD", s)
+    s = "".join(c for c in s if not unicodedata.combining(c)).casefold()
+    s = re.sub(r"[^\w]+", " ", s)
+    return " ".join(_ABREVIACOES.get(t, t) for t in s.split())
+
+
+class TokenBucket:
+    """rate tokens per second, up to capacity; acquire() sleeps only when the bucket is empty."""
+
+    def __init__(self, rate: float = 1.0, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited_s = 0.0
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            wait = 0.0 if self._tokens >= 1.0 else (1.0 - self._tokens) / self.rate
+            # reserve the token now so concurrent callers queue up behind us
+            self._tokens -= 1.0
+            self.waited_s += wait
+        if wait > 0:
+            time.sleep(wait)
+
+
+_limiter = TokenBucket(rate=1.0, capacity=1.0)
+_cache = None
+_geolocator = None
+_init_lock = threading.Lock()
+_counts = {"hits": 0, "misses": 0}
+
+def _get_cache() -> SQLiteCache:
+    global _cache
+    if _cache is None or _cache.path != GEOCODE_DB:
+        with _init_lock:
+            if _cache is None or _cache.path != GEOCODE_DB:
+                _cache = SQLiteCache(GEOCODE_DB)
+    return _cache
+
+_pooled_adapter = None
+
+def _pooled_adapter_class():
+    """geopy adapter sending Nominatim requests through the shared keep-alive pool (http_pool)."""
+    global _pooled_adapter
+    if _pooled_adapter is not None:
+        return _pooled_adapter
+    adapters = _geopy_adapters.get()
+    exc = _geopy_exc.get()
+
+    class PooledAdapter(adapters.BaseSyncAdapter):
+        def get_json(self, url, *, timeout, headers):
+            text = self.get_text(url, timeout=timeout, headers=headers)
+            try:
+                return json.loads(text)
+            except ValueError:
+                raise exc.GeocoderParseError(f"resposta inválida: {text[:200]}")
+
+        def get_text(self, url, *, timeout, headers):
+            try:
+                with pool().request("GET", url, headers=headers, timeout=timeout) as resp:
+                    return resp.read().decode(resp.headers.get_content_charset() or "utf-8")
+            except HTTPStatusError as e:
+                raise adapters.AdapterHTTPError(str(e), status_code=e.status,
+                                                headers={k.lower(): v for k, v in e.headers.items()},
+                                                text=e.body.decode("utf-8", "replace"))
+            except socket.timeout:
+                raise exc.GeocoderTimedOut("Service timed out")
+            except OSError as e:
+                raise exc.GeocoderUnavailable(str(e))
+
+    _pooled_adapter = PooledAdapter
+    return _pooled_adapter
+
+def _adapter_factory(proxies, ssl_context):
+    # the pool speaks neither proxies nor custom TLS settings; geopy's urllib adapter does
+    from urllib.request import getproxies
+    if ssl_context is not None or (getproxies() if proxies is None else proxies):
+        return _geopy_adapters.get().URLLibAdapter(proxies=proxies, ssl_context=ssl_context)
+    return _pooled_adapter_class()(proxies=proxies, ssl_context=ssl_context)
+
+def _get_geolocator():
+    global _geolocator
+    if _geolocator is None:
+        geocoders = _geocoders.get()
+        if geocoders is None:
+            raise RuntimeError("geopy não instalado: pip install geopy")
+        with _init_lock:
+            if _geolocator is None:
+                # geopy 1.x has no adapters and keeps its urllib client
+                extra = {"adapter_factory": _adapter_factory} if _geopy_adapters.available else {}
+                _geolocator = geocoders.Nominatim(user_agent=USER_AGENT, **extra)
+    return _geolocator
+
+def _cached(key: str):
+    """(hit, coords): coords is None for a cached "not found"."""
+    entry = _get_cache().get_entry(key)
+    if entry is not None:
+        ts, value = entry
+        found = value.get("lat") is not None
+        ttl = GEOCODE_TTL_S if found else GEOCODE_NOT_FOUND_TTL_S
+        if time.time() - ts <= ttl:
+            _counts["hits"] += 1
+            telemetry.incr("geocode_cache_hits")
+            return True, ((value["lat"], value["lon"]) if found else None)
+    _counts["misses"] += 1
+    telemetry.incr("geocode_cache_misses")
+    return False, None
+
+def _lookup_remote(endereco: str) -> Optional[Tuple[float, float]]:
+    geolocator = _get_geolocator()
+    with telemetry.stage("geocode_rate_limit"):
+        _limiter.acquire()
+    try:
+        with telemetry.stage("geocode"):
+            loc = geolocator.geocode(endereco, timeout=10)
+    except _geopy_exc.get().GeocoderTimedOut:
+        with telemetry.stage("geocode_rate_limit"):
+            _limiter.acquire()
+        with telemetry.stage("geocode"):
+            loc = geolocator.geocode(endereco, timeout=15)
+    return (loc.latitude, loc.longitude) if loc else None
+
+def geocode(endereco: str) -> Optional[Tuple[float, float]]:
+    """(lat, lon) or None when the address is unknown."""
+    key = normalizar_endereco(endereco)
+    hit, coords = _cached(key)
+    if hit:
+        return coords
+    return _resolve(key, endereco)
+
+def _resolve(key: str, endereco: str) -> Optional[Tuple[float, float]]:
+    coords = _lookup_remote(endereco)
+    _get_cache().set(key, {"lat": coords[0], "lon": coords[1]} if coords else {"lat": None, "lon": None})
+    return coords
+
+def obter_coordenadas(endereco: str) -> Tuple[float, float]:
+    coords = geocode(endereco)
+    if not coords:
+        raise ValueError("Endereço não encontrado.")
+    return coords
+
+def geocode_many(enderecos: Iterable[str]) -> Iterator[Tuple[str, Optional[Tuple[float, float]]]]:
+    """
+    Yields (endereco, coords) for every input address. Cached addresses come out
+    first, then each distinct uncached address is looked up once and yielded
+    for all of its duplicates.
+    """
+    pending = {}
+    for endereco in enderecos:
+        key = normalizar_endereco(endereco)
+        if key in pending:
+            pending[key].append(endereco)
+            continue
+        hit, coords = _cached(key)
+        if hit:
+            yield endereco, coords
+        else:
+            pending[key] = [endereco]
+    for key, originals in pending.items():
+        coords = _resolve(key, originals[0])
+        for endereco in originals:
+            yield endereco, coords
+
+def geocode_stats():
+    out = _get_cache().stats()
+    out.update(_counts)
+    gets = _counts["hits"] + _counts["misses"]
+    out["hit_ratio"] = (_counts["hits"] / gets) if gets else 0.0
+    out["rate_limit_wait_s"] = _limiter.waited_s
+    return out
@@ -0,0 +1,239 @@
+"""
+Keep-alive HTTP(S) connections shared by the Overpass and Nominatim clients.
+
+Idle connections are kept per (scheme, host, port), at most max_por_host of
+them and for at most ociosa_max_s, so steady-state searches skip the TCP and
+TLS handshakes. Requests ask for gzip and responses are inflated as they are
+read, so streamed parsing (overpass_stream) works unchanged. A connection
+goes back to the pool only once its response was read to the end; a pooled
+connection the server already dropped is retried once on a new one.
+
+    with pool().request("POST", url, body, headers) as resp:
+        data = resp.read()
+"""
+import threading
+import time
+import zlib
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+
+POOL_MAX_POR_HOST = 4
+# servers close idle keep-alive connections after a while (nginx: 75 s)
+POOL_OCIOSA_MAX_S = 50.0
+HTTP_TIMEOUT = 60
+_MAX_REDIRECTS = 3
+_REDIRECTS = (301, 302, 303, 307, 308)
+_CHUNK = 1 << 16
+
+
+class HTTPStatusError(OSError):
+    """Non-2xx answer; code/headers as in urllib's HTTPError, so endpoints.retry_after_s reads either."""
+
+    def __init__(self, url: str, status: int, reason: str, headers, body: bytes = b""):
+        super().__init__(f"HTTP Error {status}: {reason}")
+        self.url = url
+        self.status = self.code = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+
+class PooledResponse:
+    """Body of one response as a binary file object, gzip already inflated."""
+
+    def __init__(self, pool: "HTTPPool", key, conn, resp):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._resp = resp
+        self.status = resp.status
+        self.headers = resp.headers
+        gz = (resp.getheader("Content-Encoding") or "").lower() == "gzip"
+        self._inflate = zlib.decompressobj(16 + zlib.MAX_WBITS) if gz else None
+        self._buf = b""
+
+    def read(self, n: int = -1) -> bytes:
+        if self._resp is None:
+            return b""
+        if self._inflate is None:
+            return self._resp.read() if n is None or n < 0 else self._resp.read(n)
+        if n is None or n < 0:
+            data = self._buf + self._inflate.decompress(self._resp.read()) + self._inflate.flush()
+            self._buf = b""
+            return data
+        while len(self._buf) < n:
+            chunk = self._resp.read(_CHUNK)
+            if not chunk:
+                self._buf += self._inflate.flush()
+                break
+            self._buf += self._inflate.decompress(chunk)
+        out, self._buf = self._buf[:n], self._buf[n:]
+        return out
+
+    def close(self):
+        resp, conn = self._resp, self._conn
+        if resp is None:
+            return
+        self._resp = self._conn = None
+        # http.client closes the response once the whole body was read
+        if resp.isclosed() and not resp.will_close:
+            self._pool._put(self._key, conn)
+        else:
+            resp.close()
+            conn.close()
+            self._pool._count("descartadas")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class HTTPPool:
+    def __init__(self, max_por_host: int = POOL_MAX_POR_HOST, timeout: float = HTTP_TIMEOUT,
+                 ociosa_max_s: float = POOL_OCIOSA_MAX_S):
+        self.max_por_host = max_por_host
+        self.timeout = timeout
+        self.ociosa_max_s = ociosa_max_s
+        self._lock = threading.Lock()
+        self._idle: Dict[Tuple[str, str, int], Deque] = {}
+        self._counts = {"requests": 0, "conexoes": 0, "reusos": 0, "descartadas": 0, "gzip": 0}
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            self._counts[name] += n
+
+    def _new(self, key, timeout):
+        # imported here: http.client pulls in email and ssl, which cache hits never need
+        import http.client
+        scheme, host, port = key
+        cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        self._count("conexoes")
+        return cls(host, port, timeout=timeout)
+
+    def _get(self, key, timeout):
+        """(connection, reused)."""
+        now = time.monotonic()
+        stale = []
+        conn = None
+        with self._lock:
+            idle = self._idle.get(key)
+            while idle:
+                c, since = idle.pop()
+                if now - since <= self.ociosa_max_s:
+                    conn = c
+                    self._counts["reusos"] += 1
+                    break
+                stale.append(c)
+        for c in stale:
+            c.close()
+        if conn is None:
+            return self._new(key, timeout), False
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn, True
+
+    def _put(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, deque())
+            if len(idle) < self.max_por_host:
+                idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def _send(self, key, method, path, body, headers, timeout):
+        import http.client
+        conn, reused = self._get(key, timeout)
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            return conn, conn.getresponse()
+        except (ConnectionError, http.client.BadStatusLine):
+            conn.close()
+            if not reused:
+                raise
+        except BaseException:
+            conn.close()
+            raise
+        # the server had dropped the pooled connection: once more on a new one
+        self._count("descartadas")
+        conn = self._new(key, timeout)
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            return conn, conn.getresponse()
+        except BaseException:
+            conn.close()
+            raise
+
+    def request(self, method: str, url: str, body: Optional[bytes] = None, headers: Optional[Dict[str, str]] = None,
+                timeout: Optional[float] = None) -> PooledResponse:
+        """Open response for a 2xx answer (redirects followed); HTTPStatusError otherwise."""
+        timeout = self.timeout if timeout is None else timeout
+        self._count("requests")
+        for _ in range(_MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            scheme = parts.scheme or "http"
+            key = (scheme, parts.hostname, parts.port or (443 if scheme == "https" else 80))
+            path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+            hdrs = {"Accept-Encoding": "gzip"}
+            hdrs.update(headers or {})
+            if body is not None:
+                hdrs.setdefault("Content-Type", "application/x-www-form-urlencoded")
+            conn, resp = self._send(key, method, path, body, hdrs, timeout)
+            out = PooledResponse(self, key, conn, resp)
+            location = resp.getheader("Location")
+            if resp.status in _REDIRECTS and location:
+                out.read()
+                out.close()
+                url = urljoin(url, location)
+                if resp.status in (301, 302, 303) and method == "POST":
+                    method, body = "GET", None
+                continue
+            if out._inflate is not None:
+                self._count("gzip")
+            if resp.status >= 300:
+                data = out.read()
+                out.close()
+                raise HTTPStatusError(url, resp.status, resp.reason, resp.headers, data)
+            return out
+        raise HTTPStatusError(url, resp.status, "redirecionamentos demais", resp.headers)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            out = dict(self._counts)
+            out["ociosas"] = sum(len(q) for q in self._idle.values())
+        return out
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for q in idle.values():
+            for conn, _ in q:
+                conn.close()
+
+
+_pool: Optional[HTTPPool] = None
+_pool_lock = threading.Lock()
+
+def pool() -> HTTPPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = HTTPPool()
+    return _pool
+
+def configurar(max_por_host: int = POOL_MAX_POR_HOST, timeout: float = HTTP_TIMEOUT,
+               ociosa_max_s: float = POOL_OCIOSA_MAX_S):
+    """Replaces the shared pool (its idle connections are closed)."""
+    global _pool
+    with _pool_lock:
+        old, _pool = _pool, HTTPPool(max_por_host, timeout, ociosa_max_s)
+    if old is not None:
+        old.close()
+
+def pool_stats() -> Dict[str, int]:
+    return pool().stats()
@@ -1,237 +1,659 @@
-import math
-import json
-import sqlite3
+import threading
 import time
 import hashlib
-from typing import List, Dict, Optional
-
-# overpy (Overpass) — optional
-try:
-    import overpy
-    _HAS_OVERPY = True
-except Exception:
-    _HAS_OVERPY = False
-
-# rapidfuzz optional for fuzzy matching
-try:
-    from rapidfuzz import fuzz
-    _HAS_FUZZY = True
-except Exception:
-    fuzz = None
-    _HAS_FUZZY = False
+import heapq
+from typing import List, Dict, Optional, Tuple
+
+from cache_snapshot import CacheSnapshot
+from clinic_record import ClinicRecord, decode_cache_value, encode_cache_value
+from dedup import Deduplicador, deduplicar
+from endpoints import scheduler
+from especialidade import TextIndex, compilar_especialidade
+from geo import (EQUIRECT_MAX_M, bbox_distance_m, covering_geohashes, distances_m, geohash_bbox,
+                 geohash_encode, haversine_m as _haversine_m, nearest_indices)
+from overpass_cache import FailureMemory, SingleFlight, SQLiteCache, TieredCache
+from overpass_stream import (OVERPASS_DEFAULT_URL, OverpassRemark, iter_elements, iter_hits, iter_pois,
+                             open_overpass, poi_from_json_element)
+from poi_index import GridIndex, build_index
+from ranking import RANK_BUDGET_MS, RANK_POOL_FACTOR, ranquear
+import search_log
+import telemetry
 
 CACHE_DB = "overpass_cache.db"
+# read-only snapshot shared by worker processes (cache_snapshot.exportar_snapshot), None = off
+CACHE_SNAPSHOT = None
+# empty answers (no clinic in the area, or none of the specialty) expire sooner,
+# so a clinic added to OSM shows up within hours. Only complete answers get
+# here: one with a remark (aborted query) is a failure, see _fetch_guarded
+CACHE_VAZIO_TTL_S = 3 * 3600
+# after the n-th failed fetch in a row of a cache key, that key is not fetched
+# again for FALHA_BACKOFF_S * 2**(n-1) s (at most FALHA_BACKOFF_MAX_S)
+FALHA_BACKOFF_S = 30
+FALHA_BACKOFF_MAX_S = 900
+# expired tiles are brought up to date with a diff query (_diff_tiles) instead of
+# being fetched again; the diff starts DIFF_MARGEM_S before the old copy was
+# stored, as mirrors replicate minutes behind the main database
+DIFF_REFRESH = True
+DIFF_MARGEM_S = 3600
+
+_cache_backend = None
+_cache_lock = threading.Lock()
+
+def _get_cache() -> TieredCache:
+    global _cache_backend
+    backend = _cache_backend
+    if backend is None or _outdated(backend):
+        with _cache_lock:
+            if _cache_backend is None or _outdated(_cache_backend):
+                if _cache_backend is not None:
+                    _cache_backend.close()
+                snapshot = CacheSnapshot(CACHE_SNAPSHOT) if CACHE_SNAPSHOT else None
+                _cache_backend = TieredCache(SQLiteCache(CACHE_DB), encode=encode_cache_value,
+                                             decode=decode_cache_value, max_age_fn=_max_age, snapshot=snapshot)
+            backend = _cache_backend
+    return backend
+
+def _outdated(backend: TieredCache) -> bool:
+    snapshot = backend.snapshot.path if backend.snapshot is not None else None
+    return backend.path != CACHE_DB or snapshot != (CACHE_SNAPSHOT or None)
+
+def _max_age(value, max_age_s):
+    return max_age_s if value else min(max_age_s, CACHE_VAZIO_TTL_S)
+
+def cache_stats() -> Dict[str, float]:
+    """Hit/miss/latency counters of the Overpass cache, and of the failure memory."""
+    out = _get_cache().stats()
+    out.update(_falhas.stats())
+    return out
 
 def _init_cache():
-    conn = sqlite3.connect(CACHE_DB)
-    cur = conn.cursor()
-    cur.execute(
-        "CREATE TABLE IF NOT EXISTS cache (k TEXT PRIMARY KEY, ts INTEGER, payload TEXT)"
-    )
-    conn.commit()
-    conn.close()
+    with telemetry.stage("cache_init"):
+        _get_cache().init()
 
-def _cache_get(key: str, max_age_s: int) -> Optional[List[Dict]]:
-    try:
-        conn = sqlite3.connect(CACHE_DB)
-        cur = conn.cursor()
-        cur.execute("SELECT ts, payload FROM cache WHERE k = ?", (key,))
-        row = cur.fetchone()
-        conn.close()
-        if not row:
-            return None
-        ts, payload = row
-        if time.time() - ts > max_age_s:
-            return None
-        return json.loads(payload)
-    except Exception:
+def _cache_get(key: str, max_age_s: int) -> Optional[List[ClinicRecord]]:
+    return _get_cache().get(key, max_age_s)
+
+def _cache_set(key: str, value: List[ClinicRecord]):
+    _get_cache().set(key, value)
+
+def _stale_value(key: str) -> Optional[List[ClinicRecord]]:
+    """Cached value of key however old (up to the cache's stale TTL), or None."""
+    return _get_cache().lookup(key, 0, allow_stale=True)[0]
+
+_falhas = FailureMemory(FALHA_BACKOFF_S, FALHA_BACKOFF_MAX_S)
+
+def _bloqueado(key: str) -> bool:
+    if _falhas.blocked(key):
+        telemetry.incr("failure_cache_hits")
+        return True
+    return False
+
+def _fetch_guarded(key: str, fetch):
+    """
+    fetch() unless key failed recently; None when skipped or failed (the failure
+    is remembered). fetch returns None for answers that carried a remark
+    (overpass_stream.OverpassRemark), so an aborted query is never stored as empty.
+    """
+    if _bloqueado(key):
         return None
+    value = fetch()
+    if value is None:
+        _falhas.failed(key)
+    else:
+        _falhas.succeeded(key)
+    return value
 
-def _cache_set(key: str, value: List[Dict]):
-    try:
-        conn = sqlite3.connect(CACHE_DB)
-        cur = conn.cursor()
-        cur.execute("REPLACE INTO cache (k, ts, payload) VALUES (?, ?, ?)",
-                    (key, int(time.time()), json.dumps(value, ensure_ascii=False)))
-        conn.commit()
-        conn.close()
-    except Exception:
-        pass
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+def _refresh_in_background(cache_key, refresh):
+    """Runs refresh() in a daemon thread; at most one refresh per key at a time."""
+    with _refreshing_lock:
+        if cache_key in _refreshing:
+            return
+        _refreshing.add(cache_key)
+
+    def run():
+        try:
+            refresh()
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(cache_key)
+
+    threading.Thread(target=run, name="overpass-refresh", daemon=True).start()
 
 def _make_cache_key(lat: float, lon: float, raio: int, especialidade: Optional[str], max_results: int) -> str:
     s = f"{lat:.6f}:{lon:.6f}:{raio}:{(especialidade or '').lower()}:{max_results}"
     return hashlib.sha1(s.encode("utf-8")).hexdigest()
 
-def _haversine_m(lat1, lon1, lat2, lon2):
-    R = 6371000.0
-    phi1, phi2 = math.radians(lat1), math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dlambda = math.radians(lon2 - lon1)
-    a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2)**2
-    return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-
 def _to_float(v):
     try:
         return float(v)
     except Exception:
         return None
 
-def _match_especialidade(nome, espec_field, query, fuzzy_threshold=70):
-    if not query:
-        return True
-    q = str(query).strip().lower()
-    if nome and q in str(nome).lower():
-        return True
-    if espec_field and q in str(espec_field).lower():
-        return True
-    if _HAS_FUZZY:
-        try:
-            if nome and fuzz.token_set_ratio(q, str(nome).lower()) >= fuzzy_threshold:
-                return True
-            if espec_field and fuzz.token_set_ratio(q, str(espec_field).lower()) >= fuzzy_threshold:
-                return True
-        except Exception:
-            pass
-    return False
+# offline POI index (see poi_index.py); None means only the demo clinics are offline
+_local_index = None
+
+def carregar_indice_local(path, cell_deg: float = 0.02) -> GridIndex:
+    """Loads an OSM extract or a saved index file as the default offline source."""
+    global _local_index
+    _local_index = build_index(path, cell_deg)
+    return _local_index
+
+def definir_indice_local(index: Optional[GridIndex]):
+    global _local_index
+    _local_index = index
 
-# sensible public endpoints to try when overpy default fails
+def _local_hits(index, lat, lon, raio, especialidade, max_results, fuzzy_threshold=70) -> List[ClinicRecord]:
+    keep = index.matching(compilar_especialidade(especialidade, fuzzy_threshold)) if especialidade else None
+    return [p.located(dist, "local") for dist, p in index.radius(lat, lon, raio, keep, max_results)]
+
+# sensible public endpoints to try when the default fails
 _DEFAULT_OVERPASS_ENDPOINTS = [
-    None,  # None lets overpy use its default
+    None,  # None is overpass_stream.OVERPASS_DEFAULT_URL
     "https://overpass-api.de/api/interpreter",
     "https://overpass.openstreetmap.fr/api/interpreter",
     "https://overpass.kumi.systems/api/interpreter"
 ]
 
-def _query_overpass(lat, lon, raio, especialidade, max_results, overpass_url=None, cache_ttl_hours=12):
+# passes over the mirrors before giving up; OVERPASS_BACKOFF_S[i] is slept before pass i + 1
+OVERPASS_PASSES = 2
+OVERPASS_BACKOFF_S = (1.0,)
+
+def _endpoint_urls(overpass_url=None) -> List[str]:
+    """overpass_url and the default mirrors, without repeats (None is the default url)."""
+    urls = []
+    for u in ([overpass_url] if overpass_url else []) + _DEFAULT_OVERPASS_ENDPOINTS:
+        u = u or OVERPASS_DEFAULT_URL
+        if u not in urls:
+            urls.append(u)
+    return urls
+
+# geohash precision of the tile cache: 5 ~ 4.9 x 4.9 km, 4 ~ 39 x 19.5 km cells
+TILE_PRECISION = 5
+TILE_PRECISION_WIDE = 4
+_WIDE_RADIUS_M = 15000
+
+# incremental searches start at this radius and grow by INCREMENTAL_FATOR
+# until max_results clinics are found or raio is reached
+INCREMENTAL_RAIO_INICIAL_M = 1000
+INCREMENTAL_FATOR = 2
+
+def _tile_precision(raio):
+    return TILE_PRECISION if raio <= _WIDE_RADIUS_M else TILE_PRECISION_WIDE
+
+def _make_tile_key(gh: str) -> str:
+    return "tile:" + gh
+
+def _filter_pois(pois, lat, lon, raio, especialidade, max_results, fuzzy_threshold=70) -> List[ClinicRecord]:
+    """Applies radius and specialty locally; returns the nearest max_results, nearest first."""
+    if not pois:
+        return []
+    with telemetry.stage("filter"):
+        dists = distances_m(lat, lon, [p.lat for p in pois], [p.lon for p in pois], fast=raio <= EQUIRECT_MAX_M)
+        inside = [i for i in range(len(pois)) if dists[i] <= raio]
+    telemetry.incr("candidates_in_radius", len(inside))
+    if especialidade:
+        with telemetry.stage("especialidade"):
+            matched = compilar_especialidade(especialidade, fuzzy_threshold).filtrar(TextIndex(pois[i] for i in inside))
+        telemetry.incr("candidates_filtered", len(inside) - len(matched))
+        inside = [inside[j] for j in sorted(matched)]
+    return [pois[i].located(float(dists[i]), "overpass") for i in nearest_indices(dists, max_results, inside)]
+
+def _run_overpass(q, overpass_url=None, consume=lambda fp: list(iter_pois(fp))):
+    """
+    Runs q against the Overpass mirrors, fastest expected first (see endpoints.py;
+    overpass_url, when given and healthy, goes first); consume(fp) reads the
+    streamed response (raw POI list by default). Mirrors with an open breaker or
+    a pending Retry-After are skipped. Returns consume's result, or None when
+    every mirror fails.
+    """
+    sched = scheduler()
+    urls = _endpoint_urls(overpass_url)
+    pinned = overpass_url or None
+    last_exc = None
+    tried = 0
+    for p in range(OVERPASS_PASSES):
+        order = sched.order(urls, pinned)
+        if not order:
+            break
+        if p:
+            with telemetry.stage("overpass_backoff"):
+                time.sleep(OVERPASS_BACKOFF_S[min(p - 1, len(OVERPASS_BACKOFF_S) - 1)])
+        for endpoint in order:
+            if not sched.allow(endpoint):
+                continue
+            if tried:
+                telemetry.incr("overpass_retries")
+            tried += 1
+            t0 = time.perf_counter()
+            try:
+                with telemetry.stage("overpass_fetch"), open_overpass(endpoint, q) as fp:
+                    # latency is time to the response headers, independent of the answer's size
+                    latency_s = time.perf_counter() - t0
+                    result = consume(fp)
+            except Exception as e:
+                last_exc = e
+                telemetry.incr("overpass_endpoint_failures")
+                if isinstance(e, OverpassRemark):
+                    telemetry.incr("overpass_remarks")
+                sched.failure(endpoint, e)
+                continue
+            sched.success(endpoint, latency_s)
+            return result
+    telemetry.incr("overpass_failures")
+    if last_exc:
+        print("Aviso Overpass:", last_exc)
+    elif not tried:
+        print("Aviso Overpass: nenhum endpoint disponível (circuit breaker aberto ou Retry-After pendente)")
+    return None
+
+def _query_overpass(lat, lon, raio, especialidade, max_results, overpass_url=None, cache_ttl_hours=12,
+                    stale_while_revalidate=False, use_tiles=True, fuzzy_threshold=70, incremental=False):
     """
     Attempts to query Overpass, with multiple endpoints and caching.
-    Returns a list of simple dicts (JSON-serializable).
+    Returns a list of ClinicRecord with distancia_m and source set; the caller
+    turns them into dicts with to_dict().
+    With use_tiles the cache holds raw POIs per geohash tile, so nearby searches
+    and different specialties share the same upstream data; otherwise the
+    cache is keyed on the exact query.
+    With stale_while_revalidate an expired cache entry is returned at once and
+    refreshed in a background thread.
+    With incremental the search grows ring by ring (see _aneis) and stops once
+    max_results clinics are found; without tiles each ring is its own cached
+    query, with the specialty pushed to the server as a tag regex.
     """
     _init_cache()
+    max_age_s = int(cache_ttl_hours * 3600)
+    if use_tiles:
+        if incremental:
+            return _tile_hits_incremental(lat, lon, raio, especialidade, max_results, overpass_url, max_age_s,
+                                          stale_while_revalidate, fuzzy_threshold)
+        pois = _tile_pois(lat, lon, raio, overpass_url, max_age_s, stale_while_revalidate)
+        return _filter_pois(pois, lat, lon, raio, especialidade, max_results, fuzzy_threshold)
+    if incremental:
+        return _ring_hits(lat, lon, raio, especialidade, max_results, overpass_url, max_age_s, fuzzy_threshold)
+
     cache_key = _make_cache_key(lat, lon, raio, especialidade, max_results)
-    cached = _cache_get(cache_key, int(cache_ttl_hours * 3600))
+    with telemetry.stage("cache_lookup"):
+        cached, fresh = _get_cache().lookup(cache_key, max_age_s, allow_stale=stale_while_revalidate)
+    telemetry.incr("cache_hits" if cached is not None else "cache_misses")
+    def fetch():
+        return _fetch_guarded(cache_key, lambda: _fetch_overpass(lat, lon, raio, especialidade, max_results,
+                                                                 overpass_url, fuzzy_threshold))
+
     if cached is not None:
+        if not fresh:
+            _refresh_in_background(cache_key, lambda: _store_results(cache_key, fetch()))
         return cached
 
-    endpoints = [overpass_url] if overpass_url else []
-    endpoints.extend([e for e in _DEFAULT_OVERPASS_ENDPOINTS if e not in endpoints])
+    results = fetch()
+    if results is None:
+        # outage, or it failed moments ago: an expired answer beats none
+        return _stale_value(cache_key) or []
+    _store_results(cache_key, results)
+    return results
+
+def _store_results(cache_key, results):
+    # empty answers are stored too, with their shorter TTL (CACHE_VAZIO_TTL_S)
+    if results is not None:
+        _cache_set(cache_key, results)
 
-    q = (
+def _around_query(lat, lon, raio, limit=None) -> str:
+    """around: query for the vets within raio of lat/lon, at most limit of them when given."""
+    return (
         "[out:json];\n"
         "(\n"
         f"  node(around:{int(raio)},{lat},{lon})[amenity=veterinary];\n"
         f"  way(around:{int(raio)},{lat},{lon})[amenity=veterinary];\n"
         f"  relation(around:{int(raio)},{lat},{lon})[amenity=veterinary];\n"
         ");\n"
-        f"out center {max_results};\n"
+        f"out center{f' {limit}' if limit else ''};\n"
     )
 
-    last_exc = None
-    results = []
-    for endpoint in endpoints:
-        # try up to 3 attempts per endpoint with backoff
-        for attempt in range(3):
-            try:
-                api = overpy.Overpass(url=endpoint) if endpoint else overpy.Overpass()
-                res = api.query(q)  # compatible with common overpy versions
-                # parse nodes
-                for n in getattr(res, "nodes", []):
-                    nlat = _to_float(getattr(n, "lat", None)); nlon = _to_float(getattr(n, "lon", None))
-                    if nlat is None or nlon is None: continue
-                    tags = getattr(n, "tags", {}) or {}
-                    nome = tags.get("name")
-                    endereco = tags.get("addr:street") or tags.get("addr:full") or ""
-                    telefone = tags.get("phone") or tags.get("contact:phone")
-                    spec = tags.get("vet:speciality") or tags.get("speciality") or tags.get("service")
-                    if not _match_especialidade(nome, spec, especialidade):
-                        continue
-                    dist = _haversine_m(lat, lon, nlat, nlon)
-                    results.append({
-                        "nome": nome or "Clínica Veterinária",
-                        "endereco": endereco or "",
-                        "lat": nlat,
-                        "lon": nlon,
-                        "telefone": telefone,
-                        "especialidade": spec,
-                        "distancia_m": dist,
-                        "source": "overpass"
-                    })
-                # parse ways
-                for w in getattr(res, "ways", []):
-                    if not (hasattr(w, "center_lat") and hasattr(w, "center_lon")): continue
-                    wlat = _to_float(getattr(w, "center_lat", None)); wlon = _to_float(getattr(w, "center_lon", None))
-                    if wlat is None or wlon is None: continue
-                    tags = getattr(w, "tags", {}) or {}
-                    nome = tags.get("name")
-                    endereco = tags.get("addr:street") or tags.get("addr:full") or ""
-                    telefone = tags.get("phone") or tags.get("contact:phone")
-                    spec = tags.get("vet:speciality") or tags.get("speciality")
-                    if not _match_especialidade(nome, spec, especialidade):
-                        continue
-                    dist = _haversine_m(lat, lon, wlat, wlon)
-                    results.append({
-                        "nome": nome or "Clínica Veterinária",
-                        "endereco": endereco or "",
-                        "lat": wlat,
-                        "lon": wlon,
-                        "telefone": telefone,
-                        "especialidade": spec,
-                        "distancia_m": dist,
-                        "source": "overpass"
-                    })
-                # parse relations
-                for r in getattr(res, "relations", []):
-                    if not (hasattr(r, "center_lat") and hasattr(r, "center_lon")): continue
-                    rlat = _to_float(getattr(r, "center_lat", None)); rlon = _to_float(getattr(r, "center_lon", None))
-                    if rlat is None or rlon is None: continue
-                    tags = getattr(r, "tags", {}) or {}
-                    nome = tags.get("name")
-                    endereco = tags.get("addr:street") or tags.get("addr:full") or ""
-                    telefone = tags.get("phone") or tags.get("contact:phone")
-                    spec = tags.get("vet:speciality") or tags.get("speciality")
-                    if not _match_especialidade(nome, spec, especialidade):
-                        continue
-                    dist = _haversine_m(lat, lon, rlat, rlon)
-                    results.append({
-                        "nome": nome or "Clínica Veterinária",
-                        "endereco": endereco or "",
-                        "lat": rlat,
-                        "lon": rlon,
-                        "telefone": telefone,
-                        "especialidade": spec,
-                        "distancia_m": dist,
-                        "source": "overpass"
-                    })
-                # success: cache and return
-                if results:
-                    payload = []
-                    for it in results:
-                        payload.append({
-                            "nome": it.get("nome"),
-                            "endereco": it.get("endereco"),
-                            "lat": float(it.get("lat")),
-                            "lon": float(it.get("lon")),
-                            "telefone": it.get("telefone"),
-                            "especialidade": it.get("especialidade"),
-                            "distancia_m": float(it.get("distancia_m")),
-                            "source": it.get("source")
-                        })
-                    _cache_set(cache_key, payload)
-                    return payload
-                else:
-                    return []
-            except Exception as e:
-                last_exc = e
-                time.sleep( (2 ** attempt) )
+def _fetch_overpass(lat, lon, raio, especialidade, max_results, overpass_url=None, fuzzy_threshold=70):
+    """
+    Single around: query for one search (no cache). The response is streamed and
+    filtered as it arrives, stopping after max_results matches. Returns None when
+    all endpoints fail.
+    """
+    # with a specialty the server-side limit would cut before our filter; the stream stops early instead
+    q = _around_query(lat, lon, raio, None if especialidade else max_results)
+
+    match = compilar_especialidade(especialidade, fuzzy_threshold).casa if especialidade else None
+    hits = _run_overpass(q, overpass_url, lambda fp: list(iter_hits(fp, lat, lon, raio, max_results, match)))
+    if hits is None:
+        return None
+    hits.sort(key=lambda r: r.distancia_m)
+    return hits
+
+def _aneis(raio) -> List[Tuple[float, float]]:
+    """(inner, outer) radii of an incremental search, the first ring starting at 0 and the last ending at raio."""
+    out = []
+    inner, outer = 0, min(INCREMENTAL_RAIO_INICIAL_M, raio)
+    while True:
+        out.append((inner, outer))
+        if outer >= raio:
+            return out
+        inner, outer = outer, min(outer * INCREMENTAL_FATOR, raio)
+
+def _make_ring_key(lat, lon, inner, outer, filtro) -> str:
+    s = f"ring:{lat:.6f}:{lon:.6f}:{inner}:{outer}:{filtro}"
+    return hashlib.sha1(s.encode("utf-8")).hexdigest()
+
+def _ring_query(lat, lon, inner, outer, filtro="") -> str:
+    """Clinics within outer of lat/lon but not within inner (matching filtro, an Overpass tag filter)."""
+    def conjunto(r, nome):
+        return (
+            "(\n"
+            f"  node(around:{r},{lat},{lon})[amenity=veterinary]{filtro};\n"
+            f"  way(around:{r},{lat},{lon})[amenity=veterinary]{filtro};\n"
+            f"  relation(around:{r},{lat},{lon})[amenity=veterinary]{filtro};\n"
+            f")->.{nome};\n"
+        )
+
+    if not inner:
+        return "[out:json];\n" + conjunto(outer, "fora") + ".fora out center;\n"
+    return ("[out:json];\n" + conjunto(outer, "fora") + conjunto(inner, "dentro")
+            + "(.fora; - .dentro;);\n"
+            "out center;\n")
+
+def _ring_hits(lat, lon, raio, especialidade, max_results, overpass_url, max_age_s,
+               fuzzy_threshold=70) -> List[ClinicRecord]:
+    """
+    Incremental search without tiles. Rings are cached raw (only the pushed-down
+    specialty filter applied), so a later search at the same place with a larger
+    raio only asks for the new outer rings. Stops at the first ring where the
+    nearest max_results are known: everything farther lies outside it.
+    """
+    filtro = compilar_especialidade(especialidade, fuzzy_threshold).filtro_overpass() if especialidade else ""
+    # ways and relations are matched by geometry but ranked by their centre, so
+    # a clinic's centre may lie in a later ring than the one returning it
+    found: Dict[str, ClinicRecord] = {}
+    hits: List[ClinicRecord] = []
+    for inner, outer in _aneis(raio):
+        key = _make_ring_key(lat, lon, inner, outer, filtro)
+        ring = _cache_get(key, max_age_s)
+        if ring is None:
+            q = _ring_query(lat, lon, inner, outer, filtro)
+            ring = _inflight.do(f"{overpass_url}|{q}",
+                                lambda: _fetch_guarded(key, lambda: _run_overpass(q, overpass_url)))
+            if ring is None:
+                ring = _stale_value(key)
+                if ring is None:
+                    break
+            else:
+                _cache_set(key, ring)
+        for p in ring:
+            found.setdefault(p.clinic_id, p)
+        hits = _filter_pois(list(found.values()), lat, lon, outer, especialidade, max_results, fuzzy_threshold)
+        if len(hits) >= max_results:
+            break
+    return hits
+
+def _tile_hits_incremental(lat, lon, raio, especialidade, max_results, overpass_url, max_age_s,
+                           stale_while_revalidate=False, fuzzy_threshold=70) -> List[ClinicRecord]:
+    """Incremental search over the tile cache: inner rings' tiles are reused as the circle grows."""
+    precision = _tile_precision(raio)
+    hits: List[ClinicRecord] = []
+    for _, outer in _aneis(raio):
+        pois = _tile_pois(lat, lon, outer, overpass_url, max_age_s, stale_while_revalidate, precision)
+        hits = _filter_pois(pois, lat, lon, outer, especialidade, max_results, fuzzy_threshold)
+        if len(hits) >= max_results:
+            break
+    return hits
+
+def _tile_pois(lat, lon, raio, overpass_url, max_age_s, stale_while_revalidate=False,
+               precision=None) -> List[ClinicRecord]:
+    """Raw POIs of every tile covering the search circle; missing tiles are fetched in one bbox query."""
+    tiles = covering_geohashes(lat, lon, raio, precision or _tile_precision(raio))
+    pois, missing, stale = _lookup_tiles(tiles, max_age_s, stale_while_revalidate)
+    if stale:
+        _refresh_in_background(_make_tile_key(",".join(sorted(stale))), lambda: _refresh_tiles(stale, overpass_url))
+    if missing and DIFF_REFRESH:
+        by_tile, missing = _diff_tiles(missing, overpass_url)
+        for tile_pois in (by_tile or {}).values():
+            pois.extend(tile_pois)
+    if missing:
+        wanted = _tiles_to_fetch(missing)
+        fetched = _fetch_tiles(wanted, overpass_url) if wanted else None
+        pois.extend(_absorb_tiles(missing, wanted, fetched))
+    return pois
+
+def _tiles_to_fetch(missing) -> List[str]:
+    """The missing tiles that did not fail recently."""
+    return [gh for gh in missing if not _bloqueado(_make_tile_key(gh))]
+
+def _record_fetch(wanted, fetched):
+    """Stores fetched ({tile: POIs}, or None when the fetch of wanted failed) and notes the outcome per tile."""
+    for gh in wanted:
+        if fetched is None:
+            _falhas.failed(_make_tile_key(gh))
+        else:
+            _falhas.succeeded(_make_tile_key(gh))
+    _store_tiles(fetched)
+
+def _absorb_tiles(missing, wanted, fetched) -> List[ClinicRecord]:
+    """
+    Stores fetched ({tile: POIs}, or None when the fetch of wanted failed) and
+    returns the POIs of all missing tiles; tiles skipped or not fetched fall
+    back to their expired copies.
+    """
+    _record_fetch(wanted, fetched)
+    pois = []
+    for gh in missing:
+        tile = (fetched or {}).get(gh)
+        if tile is None:
+            tile = _stale_value(_make_tile_key(gh)) or []
+        pois.extend(tile)
+    return pois
+
+def _lookup_tiles(tiles, max_age_s, allow_stale=False):
+    """Returns (cached POIs, missing tiles, stale tiles)."""
+    cache = _get_cache()
+    pois = []
+    missing = []
+    stale = []
+    with telemetry.stage("cache_lookup"):
+        for gh in tiles:
+            cached, fresh = cache.lookup(_make_tile_key(gh), max_age_s, allow_stale=allow_stale)
+            if cached is None:
+                missing.append(gh)
                 continue
-    if last_exc:
-        print("Aviso Overpass:", last_exc)
-    return []
+            pois.extend(cached)
+            if not fresh:
+                stale.append(gh)
+    telemetry.incr("tile_hits", len(tiles) - len(missing))
+    telemetry.incr("tile_misses", len(missing))
+    telemetry.incr("tile_stale", len(stale))
+    return pois, missing, stale
+
+def _tiles_bbox(tiles) -> str:
+    boxes = [geohash_bbox(gh) for gh in tiles]
+    s = min(b[0] for b in boxes); w = min(b[1] for b in boxes)
+    n = max(b[2] for b in boxes); e = max(b[3] for b in boxes)
+    return f"{s},{w},{n},{e}"
+
+def _tiles_query(tiles) -> str:
+    """One bbox query covering all the given tiles."""
+    bbox = _tiles_bbox(tiles)
+    return (
+        "[out:json];\n"
+        "(\n"
+        f"  node[amenity=veterinary]({bbox});\n"
+        f"  way[amenity=veterinary]({bbox});\n"
+        f"  relation[amenity=veterinary]({bbox});\n"
+        ");\n"
+        "out center;\n"
+    )
+
+def _split_by_tile(pois, tiles) -> Dict[str, List[ClinicRecord]]:
+    precision = len(tiles[0])
+    by_tile = {gh: [] for gh in tiles}
+    for p in pois:
+        gh = geohash_encode(p.lat, p.lon, precision)
+        if gh in by_tile:
+            by_tile[gh].append(p)
+    return by_tile
 
-def buscar_clinicas_veterinarias(lat, lon, raio=5000, especialidade=None, use_overpass=True, re_rank=True, max_results=50, overpass_url=None, cache_ttl_hours=12, fuzzy_threshold=70):
+# identical upstream queries running at the same time are sent only once
+_inflight = SingleFlight()
+
+def _fetch_tiles(tiles, overpass_url=None) -> Optional[Dict[str, List[ClinicRecord]]]:
+    """Fetches the given tiles with a single bbox query and splits the POIs back per tile."""
+    q = _tiles_query(tiles)
+    pois = _inflight.do(f"{overpass_url}|{q}", lambda: _run_overpass(q, overpass_url))
+    if pois is None:
+        return None
+    return _split_by_tile(pois, tiles)
+
+def _refresh_tiles(tiles, overpass_url=None):
+    """Background refresh of expired tiles: a diff when DIFF_REFRESH, a full fetch for the rest."""
+    if DIFF_REFRESH:
+        _, tiles = _diff_tiles(tiles, overpass_url)
+    tiles = _tiles_to_fetch(tiles)
+    if tiles:
+        _store_tiles(_fetch_tiles(tiles, overpass_url))
+
+def _diff_query(tiles, desde_ts: float) -> str:
+    """
+    Ids of every clinic now in the tiles' bbox (deletions are the cached ones
+    missing from it) and their count, to tell a complete id list from a cut
+    one, then the full elements modified since desde_ts.
+    """
+    bbox = _tiles_bbox(tiles)
+    desde = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(desde_ts))
+    return (
+        "[out:json];\n"
+        "(\n"
+        f"  node[amenity=veterinary]({bbox});\n"
+        f"  way[amenity=veterinary]({bbox});\n"
+        f"  relation[amenity=veterinary]({bbox});\n"
+        ")->.atual;\n"
+        ".atual out ids;\n"
+        ".atual out count;\n"
+        f'nwr.atual(newer:"{desde}");\n'
+        "out center;\n"
+    )
+
+def _read_diff(fp) -> Tuple[set, List[ClinicRecord]]:
+    """
+    (clinic_ids of the "out ids" part, records of the changed elements) of a
+    _diff_query answer. Raises ValueError when the id list does not match its
+    count or misses a changed element, and OverpassRemark (iter_elements) for
+    an aborted query: cached tiles are never pruned against a partial list.
+    """
+    ids, changed = set(), []
+    total = None
+    for el in iter_elements(fp):
+        if el.get("type") == "count":
+            total = int((el.get("tags") or {}).get("total", -1))
+        elif "tags" in el:
+            p = poi_from_json_element(el)
+            if p is not None:
+                changed.append(p)
+        else:
+            ids.add(f"{el.get('type')}/{el.get('id')}")
+    if total != len(ids) or any(p.clinic_id not in ids for p in changed):
+        raise ValueError(f"diff Overpass incompleto: {len(ids)} ids, contagem {total}")
+    return ids, changed
+
+def _diff_tiles(tiles, overpass_url=None) -> Tuple[Optional[Dict[str, List[ClinicRecord]]], List[str]]:
+    """
+    Brings the cached copies of tiles up to date with one _diff_query and
+    stores them. Returns ({tile: POIs} of the tiles refreshed, the other
+    tiles), the latter being tiles without a copy, or that failed recently,
+    left for a full fetch; no query is sent when no tile has a copy. When the
+    query fails or its answer is incomplete (see _read_diff), (None, tiles)
+    and the cached copies are left as they are.
+    Elements whose geometry changed without a new version of their own (a
+    way's nodes moved) are only picked up by a full fetch.
+    """
+    cache = _get_cache()
+    old = {}
+    for gh in _tiles_to_fetch(tiles):
+        entry = cache.entry(_make_tile_key(gh))
+        if entry is not None:
+            old[gh] = entry
+    rest = [gh for gh in tiles if gh not in old]
+    if not old:
+        return {}, rest
+    q = _diff_query(list(old), min(ts for ts, _ in old.values()) - DIFF_MARGEM_S)
+    diff = _inflight.do(f"{overpass_url}|{q}", lambda: _run_overpass(q, overpass_url, _read_diff))
+    if diff is None:
+        for gh in old:
+            _falhas.failed(_make_tile_key(gh))
+        return None, list(tiles)
+    ids, changed = diff
+    changed_ids = {p.clinic_id for p in changed}
+    by_tile = {}
+    removed = 0
+    for gh, (_, tile_pois) in old.items():
+        by_tile[gh] = [p for p in tile_pois if p.clinic_id in ids and p.clinic_id not in changed_ids]
+        removed += sum(1 for p in tile_pois if p.clinic_id not in ids)
+        _falhas.succeeded(_make_tile_key(gh))
+    precision = len(next(iter(old)))
+    for p in changed:
+        gh = geohash_encode(p.lat, p.lon, precision)
+        if gh in by_tile:
+            by_tile[gh].append(p)
+    _store_tiles(by_tile)
+    telemetry.incr("tile_diff_refreshes", len(by_tile))
+    telemetry.incr("tile_diff_changed", len(changed))
+    telemetry.incr("tile_diff_removed", removed)
+    return by_tile, rest
+
+def _store_tiles(by_tile):
+    # empty tiles are stored too, so areas without clinics are not queried again
+    for gh, tile_pois in (by_tile or {}).items():
+        _cache_set(_make_tile_key(gh), tile_pois)
+
+def buscar_clinicas_veterinarias(lat, lon, raio=5000, especialidade=None, use_overpass=True, re_rank=True, max_results=50, overpass_url=None, cache_ttl_hours=12, fuzzy_threshold=70, stale_while_revalidate=False, use_tiles=True, local_index=None, rank_budget_ms=RANK_BUDGET_MS, incremental=False):
     """
     Interface principal.
+    With an offline index (local_index or carregar_indice_local) Overpass is only
+    used to top up when the index has fewer than max_results matches.
+    re_rank orders by distance, feedback and specialty match (see ranking.py)
+    instead of distance alone, choosing among RANK_POOL_FACTOR * max_results candidates.
+    incremental searches from INCREMENTAL_RAIO_INICIAL_M outwards and stops as
+    soon as enough clinics are found (see _query_overpass).
+    Searches are logged write-behind when search_log is enabled.
     """
+    t0 = time.perf_counter()
+    with telemetry.trace("busca", raio=raio, especialidade=especialidade, max_results=max_results):
+        pool = max_results * RANK_POOL_FACTOR if re_rank else max_results
+        index = local_index if local_index is not None else _local_index
+        with telemetry.stage("offline"):
+            results = _offline_hits(index, lat, lon, raio, especialidade, pool, fuzzy_threshold)
+
+        need_top_up = index is None or len(results) < max_results
+        if use_overpass and need_top_up:
+            with telemetry.stage("overpass"):
+                overpass_hits = _query_overpass(lat, lon, raio, especialidade, pool, overpass_url, cache_ttl_hours,
+                                                stale_while_revalidate, use_tiles, fuzzy_threshold, incremental)
+            for it in overpass_hits:
+                results.append(it)
+
+        with telemetry.stage("merge"):
+            merged = _merge_results(results, pool)
+        out = [r.to_dict() for r in _rank(merged, max_results, re_rank, especialidade,
+                                           fuzzy_threshold, raio, rank_budget_ms)]
+    search_log.registrar_busca(lat, lon, raio, especialidade, len(out), time.perf_counter() - t0)
+    return out
+
+def _rank(merged, max_results, re_rank, especialidade, fuzzy_threshold, raio, rank_budget_ms) -> List[ClinicRecord]:
+    if not re_rank:
+        return merged[:max_results]
+    # distance score halves roughly every 0.35 * raio
+    with telemetry.stage("rank"):
+        return ranquear(merged, max_results, especialidade, fuzzy_threshold, decay_m=raio / 2,
+                        budget_ms=rank_budget_ms)
+
+def _offline_hits(index, lat, lon, raio, especialidade, max_results, fuzzy_threshold=70) -> List[ClinicRecord]:
+    """Offline index matches, or the demo clinics when no index is loaded."""
+    if index is not None:
+        return _local_hits(index, lat, lon, raio, especialidade, max_results, fuzzy_threshold)
     results = []
     demo = [
         {"nome": "Clínica Vet Demo 1", "lat": lat, "lon": lon},
@@ -241,31 +663,117 @@ def buscar_clinicas_veterinarias(lat, lon, raio=5000, especialidade=None, use_ov
     for d in demo:
         dlat = _to_float(d["lat"]); dlon = _to_float(d["lon"])
         if dlat is None or dlon is None: continue
-        results.append({
-            "nome": d["nome"],
-            "endereco": "",
-            "lat": dlat,
-            "lon": dlon,
-            "telefone": None,
-            "especialidade": None,
-            "distancia_m": _haversine_m(lat, lon, dlat, dlon),
-            "source": "offline"
-        })
-
-    if use_overpass and _HAS_OVERPY:
-        overpass_hits = _query_overpass(lat, lon, raio, especialidade, max_results, overpass_url, cache_ttl_hours)
-        for it in overpass_hits:
-            results.append(it)
-
-    seen = set()
-    unique = []
-    for it in sorted(results, key=lambda x: x.get("distancia_m", float("inf"))):
-        key = (round(it.get("lat", 0), 6), round(it.get("lon", 0), 6))
-        if key in seen: continue
-        seen.add(key)
-        unique.append(it)
-
-    if re_rank:
-        unique.sort(key=lambda x: x.get("distancia_m", float("inf")))
-
-    return unique[:max_results]
+        results.append(ClinicRecord(nome=d["nome"], lat=dlat, lon=dlon,
+                                    distancia_m=_haversine_m(lat, lon, dlat, dlon), source="offline"))
+    return results
+
+def _merge_results(results, max_results) -> List[ClinicRecord]:
+    """Duplicates merged across sources (dedup.py), then the nearest max_results, nearest first."""
+    unique = deduplicar(results)
+    dists = [r.distancia_m if r.distancia_m is not None else float("inf") for r in unique]
+    return [unique[i] for i in nearest_indices(dists, max_results)]
+
+
+class _Progressao:
+    """
+    State of one progressive search, shared by iter_clinicas and
+    busca_async.aiter_clinicas. Known clinics wait in a heap by distance and
+    are released once no tile still to be fetched can hold a nearer one
+    (everything known at once when not ordem_estrita); the tiles are fetched
+    ring by ring (see _aneis), nearest first.
+    """
+
+    def __init__(self, lat, lon, raio, especialidade, max_results, fuzzy_threshold=70, ordem_estrita=True):
+        self.lat, self.lon, self.raio = lat, lon, raio
+        self.especialidade = especialidade
+        self.max_results = max_results
+        self.fuzzy_threshold = fuzzy_threshold
+        self.ordem_estrita = ordem_estrita
+        self.emitidos = 0
+        self._dedup = Deduplicador()
+        # (distance, position in _dedup.registros)
+        self._heap: List[Tuple[float, int]] = []
+        # tile -> distance from the centre to its nearest point
+        self._faltando: Dict[str, float] = {}
+
+    def adicionar(self, records):
+        for r in records:
+            pos = self._dedup.adicionar(r)
+            if pos is not None:
+                heapq.heappush(self._heap, (r.distancia_m if r.distancia_m is not None else float("inf"), pos))
+
+    def consultar_cache(self, max_age_s):
+        """Adds the clinics of cached tiles; the others are left to fetch."""
+        tiles = covering_geohashes(self.lat, self.lon, self.raio, _tile_precision(self.raio))
+        pois, missing, _ = _lookup_tiles(tiles, max_age_s)
+        self._faltando = {gh: bbox_distance_m(self.lat, self.lon, geohash_bbox(gh)) for gh in missing}
+        self.adicionar(self._filtrar(pois))
+
+    def _filtrar(self, pois):
+        return _filter_pois(pois, self.lat, self.lon, self.raio, self.especialidade, self.max_results,
+                            self.fuzzy_threshold)
+
+    def completo(self) -> bool:
+        return self.emitidos >= self.max_results
+
+    def lotes(self):
+        """Missing tiles to fetch, one list per ring; stops early once max_results were released."""
+        for _, outer in _aneis(self.raio):
+            if self.completo():
+                return
+            lote = [gh for gh, d in self._faltando.items() if d <= outer]
+            if lote:
+                yield lote
+
+    def absorver(self, lote, wanted, fetched):
+        """Stores a fetched batch (see _absorb_tiles) and adds its clinics."""
+        pois = _absorb_tiles(lote, wanted, fetched)
+        for gh in lote:
+            del self._faltando[gh]
+        self.adicionar(self._filtrar(pois))
+
+    def prontos(self) -> List[Dict]:
+        """Clinics that can be released now, nearest first, as dicts."""
+        limite = float("inf")
+        if self.ordem_estrita and self._faltando:
+            limite = min(self._faltando.values())
+        out = []
+        while self._heap and self._heap[0][0] <= limite and not self.completo():
+            _, pos = heapq.heappop(self._heap)
+            out.append(self._dedup.registros[pos].to_dict())
+            self.emitidos += 1
+        return out
+
+
+def iter_clinicas(lat, lon, raio=5000, especialidade=None, use_overpass=True, max_results=50, overpass_url=None,
+                  cache_ttl_hours=12, fuzzy_threshold=70, local_index=None, ordem_estrita=True):
+    """
+    Generator version of buscar_clinicas_veterinarias: yields clinic dicts
+    nearest first as soon as they are known. Offline index and cached tiles
+    come first; missing tiles are fetched ring by ring only while more results
+    are wanted, so a caller that stops after the first N does not pay for the
+    rest. Ordered by distance (no re_rank). With ordem_estrita=False
+    everything already known is yielded at once and Overpass top-ups follow,
+    each batch nearest first.
+    """
+    t0 = time.perf_counter()
+    index = local_index if local_index is not None else _local_index
+    prog = _Progressao(lat, lon, raio, especialidade, max_results, fuzzy_threshold, ordem_estrita)
+    try:
+        with telemetry.stage("offline"):
+            local = _offline_hits(index, lat, lon, raio, especialidade, max_results, fuzzy_threshold)
+        prog.adicionar(local)
+        if use_overpass and (index is None or len(local) < max_results):
+            _init_cache()
+            prog.consultar_cache(int(cache_ttl_hours * 3600))
+            yield from prog.prontos()
+            for lote in prog.lotes():
+                wanted = _tiles_to_fetch(lote)
+                with telemetry.stage("overpass"):
+                    fetched = _fetch_tiles(wanted, overpass_url) if wanted else None
+                prog.absorver(lote, wanted, fetched)
+                yield from prog.prontos()
+        yield from prog.prontos()
+    finally:
+        search_log.registrar_busca(lat, lon, raio, especialidade, prog.emitidos, time.perf_counter() - t0,
+                                   origem="stream")
@@ -0,0 +1,34 @@
+"""
+Optional dependencies that are located at import time but only imported on
+first use, so a worker that never needs numpy/rapidfuzz/aiohttp/geopy does
+not pay for loading them.
+
+    _numpy = OptionalModule("numpy")
+    np = _numpy.get()      # None when numpy is missing or broken
+"""
+import importlib
+import importlib.util
+import threading
+
+
+class OptionalModule:
+    def __init__(self, name: str):
+        self.name = name
+        self._module = None
+        self._lock = threading.Lock()
+        try:
+            # probe the top-level package only: find_spec on a submodule imports its parents
+            self.available = importlib.util.find_spec(name.partition(".")[0]) is not None
+        except Exception:
+            self.available = False
+
+    def get(self):
+        """The imported module, or None when it is not installed or fails to import."""
+        if self._module is None and self.available:
+            with self._lock:
+                if self._module is None and self.available:
+                    try:
+                        self._module = importlib.import_module(self.name)
+                    except Exception:
+                        self.available = False
+        return self._module
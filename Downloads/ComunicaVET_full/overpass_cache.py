@@ -0,0 +1,441 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Tuple
+
+_SQL_SCHEMA = "CREATE TABLE IF NOT EXISTS cache (k TEXT PRIMARY KEY, ts INTEGER, payload TEXT)"
+_SQL_TS_INDEX = "CREATE INDEX IF NOT EXISTS cache_ts ON cache (ts)"
+_SQL_GET = "SELECT ts, payload FROM cache WHERE k = ?"
+_SQL_SET = "REPLACE INTO cache (k, ts, payload) VALUES (?, ?, ?)"
+_SQL_PURGE = "DELETE FROM cache WHERE ts < ?"
+
+
+class SQLiteCache:
+    """
+    Overpass result cache on SQLite.
+    Schema is created once; connections (WAL journal, synchronous=NORMAL) come
+    from a small pool, so a short-lived thread borrows one instead of leaving
+    its own behind, and at most max_idle stay open between calls. The fixed
+    SQL strings above are compiled once per connection by sqlite3's statement
+    cache.
+    """
+
+    def __init__(self, path: str, synchronous: str = "NORMAL", timeout: float = 5.0, max_idle: int = 8):
+        self.path = path
+        self.synchronous = synchronous
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = []
+        self._open = 0
+        # bumped by close(): connections borrowed before it are closed on release
+        self._generation = 0
+        self._schema_ready = False
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.sets = 0
+        # every get_entry(), including TieredCache's reads that bypass get()
+        self.reads = 0
+        self.get_time_s = 0.0
+        self.set_time_s = 0.0
+
+    def _acquire(self) -> Tuple[sqlite3.Connection, int]:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), self._generation
+            generation = self._generation
+        # autocommit: every REPLACE is its own short transaction, no explicit commit()
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                               check_same_thread=False, cached_statements=32)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={self.synchronous}")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            with self._lock:
+                if not self._schema_ready:
+                    conn.execute(_SQL_SCHEMA)
+                    conn.execute(_SQL_TS_INDEX)
+                    self._schema_ready = True
+                if generation == self._generation:
+                    self._open += 1
+        except Exception:
+            conn.close()
+            raise
+        return conn, generation
+
+    def _release(self, conn: sqlite3.Connection, generation: int):
+        with self._lock:
+            if generation == self._generation and len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+            if generation == self._generation:
+                self._open -= 1
+        conn.close()
+
+    @contextmanager
+    def _borrow(self):
+        conn, generation = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn, generation)
+
+    def init(self):
+        self._release(*self._acquire())
+
+    def get_entry(self, key: str) -> Optional[Tuple[int, Any]]:
+        """Returns (ts, value) regardless of age, or None."""
+        t0 = time.perf_counter()
+        entry = None
+        try:
+            with self._borrow() as conn:
+                row = conn.execute(_SQL_GET, (key,)).fetchone()
+            if row:
+                payload = row[1]
+                # BLOB payloads are returned as-is for the caller to decode
+                entry = (row[0], payload if isinstance(payload, bytes) else json.loads(payload))
+        except Exception:
+            with self._lock:
+                self.errors += 1
+        with self._lock:
+            self.reads += 1
+            self.get_time_s += time.perf_counter() - t0
+        return entry
+
+    def get(self, key: str, max_age_s: int) -> Optional[Any]:
+        entry = self.get_entry(key)
+        fresh = entry is not None and time.time() - entry[0] <= max_age_s
+        with self._lock:
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return entry[1] if fresh else None
+
+    def set(self, key: str, value: Any, ts: Optional[int] = None):
+        t0 = time.perf_counter()
+        ts = int(time.time()) if ts is None else int(ts)
+        try:
+            payload = value if isinstance(value, bytes) else json.dumps(value, ensure_ascii=False)
+            with self._borrow() as conn:
+                conn.execute(_SQL_SET, (key, ts, payload))
+        except Exception:
+            with self._lock:
+                self.errors += 1
+        with self._lock:
+            self.sets += 1
+            self.set_time_s += time.perf_counter() - t0
+
+    def purge(self, older_than_s: int) -> int:
+        """Deletes rows older than older_than_s; returns how many were removed."""
+        try:
+            with self._borrow() as conn:
+                return conn.execute(_SQL_PURGE, (int(time.time() - older_than_s),)).rowcount
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            return 0
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            gets = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / gets) if gets else 0.0,
+                "sets": self.sets,
+                "errors": self.errors,
+                "reads": self.reads,
+                "avg_get_ms": (self.get_time_s * 1000.0 / self.reads) if self.reads else 0.0,
+                "avg_set_ms": (self.set_time_s * 1000.0 / self.sets) if self.sets else 0.0,
+                "connections": self._open,
+            }
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._open = 0
+            self._generation += 1
+            self._schema_ready = False
+        for conn in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+class LRUCache:
+    """Bounded in-memory map of key -> (ts, value) with size and age eviction."""
+
+    def __init__(self, max_items: int = 1024, max_age_s: int = 7 * 86400):
+        self.max_items = max_items
+        self.max_age_s = max_age_s
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[float, Any]]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry[0] > self.max_age_s:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry
+
+    def set(self, key: str, value: Any, ts: Optional[float] = None):
+        with self._lock:
+            self._data[key] = (time.time() if ts is None else ts, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TieredCache:
+    """
+    In-process LRU in front of a SQLiteCache.
+    lookup() can hand back expired entries (stale-while-revalidate); anything
+    older than stale_ttl_s is dropped from memory and purged from SQLite at
+    most once every purge_interval_s.
+    encode/decode convert between the in-memory value and what SQLite stores.
+    max_age_fn(value, max_age_s), when given, returns the max age that applies
+    to one value (e.g. a shorter one for empty results).
+    snapshot (cache_snapshot.CacheSnapshot), when given, is read between the
+    LRU and SQLite. A tier below is only asked when the copies above it are
+    missing or not fresh; the newest copy wins and goes back into the LRU, so
+    rows renewed by another process replace an expired copy in memory.
+    """
+
+    def __init__(self, backend: SQLiteCache, max_items: int = 1024,
+                 stale_ttl_s: int = 7 * 86400, purge_interval_s: int = 3600,
+                 encode=None, decode=None, max_age_fn=None, snapshot=None):
+        self.backend = backend
+        self.snapshot = snapshot
+        self.encode = encode or (lambda v: v)
+        self.decode = decode or (lambda v: v)
+        self.max_age_fn = max_age_fn
+        self.memory = LRUCache(max_items, stale_ttl_s)
+        self.stale_ttl_s = stale_ttl_s
+        self.purge_interval_s = purge_interval_s
+        self._last_purge = 0.0
+        self._lock = threading.Lock()
+        self.mem_hits = 0
+        self.db_hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.purged = 0
+
+    @property
+    def path(self) -> str:
+        return self.backend.path
+
+    def init(self):
+        self.backend.init()
+
+    def _read(self, store, key: str) -> Optional[Tuple[float, Any]]:
+        """Decoded (ts, value) from the snapshot or SQLite, None when missing or past stale_ttl_s."""
+        entry = store.get_entry(key)
+        try:
+            if entry is not None and time.time() - entry[0] <= self.stale_ttl_s:
+                return entry[0], self.decode(entry[1])
+        except Exception:
+            pass
+        return None
+
+    def _fresh(self, entry, max_age_s) -> bool:
+        if entry is None:
+            return False
+        if self.max_age_fn is not None:
+            max_age_s = self.max_age_fn(entry[1], max_age_s)
+        return time.time() - entry[0] <= max_age_s
+
+    @staticmethod
+    def _newer(a, b):
+        return b if b is not None and (a is None or b[0] > a[0]) else a
+
+    def lookup(self, key: str, max_age_s: int, allow_stale: bool = False) -> Tuple[Optional[Any], bool]:
+        """Returns (value, fresh). value is None on a miss."""
+        entry = self.memory.get(key)
+        from_memory = self._fresh(entry, max_age_s)
+        if not from_memory:
+            # another process (aquecimento.py, a new snapshot export) may have renewed the key
+            newest = entry
+            if self.snapshot is not None:
+                newest = self._newer(newest, self._read(self.snapshot, key))
+            if not self._fresh(newest, max_age_s):
+                newest = self._newer(newest, self._read(self.backend, key))
+            if newest is not entry:
+                self.memory.set(key, newest[1], newest[0])
+            entry = newest
+        fresh = self._fresh(entry, max_age_s)
+        with self._lock:
+            if fresh:
+                if from_memory:
+                    self.mem_hits += 1
+                else:
+                    self.db_hits += 1
+            elif entry is not None and allow_stale:
+                self.stale_hits += 1
+            else:
+                self.misses += 1
+        if fresh or (entry is not None and allow_stale):
+            return entry[1], fresh
+        return None, False
+
+    def get(self, key: str, max_age_s: int) -> Optional[Any]:
+        return self.lookup(key, max_age_s)[0]
+
+    def entry(self, key: str) -> Optional[Tuple[float, Any]]:
+        """
+        Newest (ts, value) of key in any tier however old (up to stale_ttl_s);
+        hit counters are left alone and nothing is added to the LRU.
+        """
+        entry = self.memory.get(key)
+        if self.snapshot is not None:
+            entry = self._newer(entry, self._read(self.snapshot, key))
+        return self._newer(entry, self._read(self.backend, key))
+
+    def fresh(self, key: str, max_age_s: int) -> bool:
+        """Whether key has a fresh entry, read through entry(): no counters, nothing promoted to the LRU."""
+        return self._fresh(self.memory.get(key), max_age_s) or self._fresh(self.entry(key), max_age_s)
+
+    def set(self, key: str, value: Any):
+        ts = time.time()
+        self.memory.set(key, value, ts)
+        self.backend.set(key, self.encode(value), ts)
+        self.maybe_purge()
+
+    def maybe_purge(self):
+        with self._lock:
+            if time.time() - self._last_purge < self.purge_interval_s:
+                return
+            self._last_purge = time.time()
+        removed = self.backend.purge(self.stale_ttl_s)
+        with self._lock:
+            self.purged += removed
+
+    def stats(self) -> Dict[str, float]:
+        out = self.backend.stats()
+        if self.snapshot is not None:
+            out.update(self.snapshot.stats())
+        with self._lock:
+            gets = self.mem_hits + self.db_hits + self.stale_hits + self.misses
+            out.update({
+                "hits": self.mem_hits + self.db_hits,
+                "misses": self.misses,
+                "hit_ratio": ((self.mem_hits + self.db_hits) / gets) if gets else 0.0,
+                "mem_hits": self.mem_hits,
+                "db_hits": self.db_hits,
+                "stale_hits": self.stale_hits,
+                "purged": self.purged,
+                "mem_items": len(self.memory),
+            })
+        return out
+
+    def close(self):
+        self.memory.clear()
+        self.backend.close()
+        if self.snapshot is not None:
+            self.snapshot.close()
+
+
+class _Call:
+    __slots__ = ("event", "result", "exc")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.exc = None
+
+
+class SingleFlight:
+    """Concurrent do() calls with the same key share one execution of fn."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def do(self, key: str, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.event.wait()
+            if call.exc is not None:
+                raise call.exc
+            return call.result
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.exc = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+
+class FailureMemory:
+    """
+    Recent upstream failures per key. After the n-th failure in a row the key
+    is blocked for base_s * 2**(n-1) seconds (at most max_s), so callers can
+    answer at once instead of running the whole retry loop again.
+    """
+
+    def __init__(self, base_s: float = 30.0, max_s: float = 900.0, max_keys: int = 4096):
+        self.base_s = base_s
+        self.max_s = max_s
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        # key -> (consecutive failures, monotonic time it is blocked until), oldest first
+        self._keys = OrderedDict()
+        self.blocked_hits = 0
+
+    def blocked(self, key: str) -> bool:
+        with self._lock:
+            entry = self._keys.get(key)
+            if entry is None or time.monotonic() >= entry[1]:
+                return False
+            self.blocked_hits += 1
+            return True
+
+    def failed(self, key: str):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._keys.get(key)
+            if entry is not None and now < entry[1]:
+                # concurrent callers failing on the same fetch count once
+                return
+            n = self._keys.pop(key, (0, 0.0))[0] + 1
+            self._keys[key] = (n, now + min(self.base_s * 2 ** (n - 1), self.max_s))
+            while len(self._keys) > self.max_keys:
+                self._keys.popitem(last=False)
+
+    def succeeded(self, key: str):
+        with self._lock:
+            self._keys.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        now = time.monotonic()
+        with self._lock:
+            return {"failure_keys": len(self._keys),
+                    "failure_blocked_keys": sum(1 for _, until in self._keys.values() if until > now),
+                    "failure_blocked_hits": self.blocked_hits}
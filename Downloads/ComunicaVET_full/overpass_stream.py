@@ -0,0 +1,190 @@
+"""
+Streaming reader for Overpass [out:json] responses.
+
+Elements are decoded one at a time straight from the HTTP response (ijson
+when installed, otherwise an incremental json.JSONDecoder scan), turned into
+POI records and, for direct searches, filtered by distance and specialty as
+they arrive so reading can stop once max_results clinics are found.
+An answer carrying a top-level "remark" (runtime error: timeout or out of
+memory) has an incomplete element list; reading it to the end raises
+OverpassRemark, as overpy did, so callers treat it as a failed request.
+"""
+import codecs
+import json
+import re
+import urllib.parse
+from typing import Callable, Dict, Iterator, List, Optional
+
+from clinic_record import ClinicRecord
+from geo import haversine_m
+from http_pool import pool
+from optional_deps import OptionalModule
+from poi_index import poi_from_tags
+
+# ijson — optional, faster C-backed streaming parser
+_ijson = OptionalModule("ijson")
+
+USER_AGENT = "ComunicaVET/1.0 (contato@example.com)"
+# what overpy used when no url was given
+OVERPASS_DEFAULT_URL = "https://overpass-api.de/api/interpreter"
+OVERPASS_HTTP_TIMEOUT = 60
+# the top-level remark is written after the elements, so only the end of the answer is kept
+_CAUDA_BYTES = 8192
+# "remark" as the last key of the top-level object (a tag named remark is followed by more brackets)
+_REMARK = re.compile(r'"remark"\s*:\s*("(?:[^"\\]|\\.)*")\s*}\s*$')
+
+
+class OverpassRemark(RuntimeError):
+    """Answer with a "remark": the server aborted the query and its elements are incomplete."""
+
+    def __init__(self, remark: str):
+        super().__init__(f"Overpass: {remark}")
+        self.remark = remark
+
+
+class _Cauda:
+    """File wrapper that remembers the last _CAUDA_BYTES read."""
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.tail = b""
+
+    def read(self, n: int = -1) -> bytes:
+        data = self.fp.read(n)
+        if data:
+            self.tail = (self.tail + data)[-_CAUDA_BYTES:]
+        return data
+
+def _check_remark(tail: bytes):
+    m = _REMARK.search(tail.decode("utf-8", "replace"))
+    if m:
+        raise OverpassRemark(json.loads(m.group(1)))
+
+def open_overpass(url: Optional[str], q: str, timeout: float = OVERPASS_HTTP_TIMEOUT):
+    """
+    POSTs q over a pooled keep-alive connection (http_pool) and returns the open
+    response (a binary file object, gzip inflated). Non-2xx answers raise
+    http_pool.HTTPStatusError.
+    """
+    body = urllib.parse.urlencode({"data": q}).encode("utf-8")
+    return pool().request("POST", url or OVERPASS_DEFAULT_URL, body, {"User-Agent": USER_AGENT}, timeout)
+
+def _iter_array_items(fp, key: str = "elements", chunk_size: int = 1 << 16) -> Iterator[Dict]:
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    pos = 0
+    eof = False
+
+    def more():
+        nonlocal buf, pos, eof
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            eof = True
+            tail = text.decode(b"", final=True)
+        else:
+            tail = text.decode(chunk) if isinstance(chunk, bytes) else chunk
+        buf = buf[pos:] + tail
+        pos = 0
+
+    marker = f'"{key}"'
+    while True:
+        i = buf.find(marker)
+        j = buf.find("[", i + len(marker)) if i >= 0 else -1
+        if j >= 0:
+            pos = j + 1
+            break
+        if eof:
+            return
+        more()
+
+    while True:
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            more()
+        if pos >= len(buf):
+            raise ValueError("resposta Overpass truncada")
+        if buf[pos] == "]":
+            return
+        try:
+            obj, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            more()
+            continue
+        pos = end
+        yield obj
+
+def iter_elements(fp) -> Iterator[Dict]:
+    """
+    Yields the raw dicts of the "elements" array without loading the whole
+    response; raises OverpassRemark after the last one when the answer has a remark.
+    """
+    cauda = _Cauda(fp)
+    ijson = _ijson.get()
+    if ijson is not None:
+        yield from ijson.items(cauda, "elements.item")
+    else:
+        yield from _iter_array_items(cauda)
+    while cauda.read(1 << 16):
+        pass
+    _check_remark(cauda.tail)
+
+def _to_float(v):
+    try:
+        return float(v)
+    except Exception:
+        return None
+
+def poi_from_json_element(el) -> Optional[ClinicRecord]:
+    """POI record of a node, or of a way/relation with "out center"; None when it has no position."""
+    osm_type = el.get("type")
+    pos = el if osm_type == "node" else (el.get("center") or {})
+    elat = _to_float(pos.get("lat")); elon = _to_float(pos.get("lon"))
+    if elat is None or elon is None:
+        return None
+    osm_id = el.get("id")
+    return poi_from_tags(osm_type, int(osm_id) if osm_id is not None else None, el.get("tags"), elat, elon)
+
+def pois_from_json(data) -> List[ClinicRecord]:
+    """Same as iter_pois for an already decoded response."""
+    if (data or {}).get("remark"):
+        raise OverpassRemark(data["remark"])
+    pois = []
+    for el in (data or {}).get("elements", []):
+        p = poi_from_json_element(el)
+        if p is not None:
+            pois.append(p)
+    return pois
+
+def iter_pois(fp) -> Iterator[ClinicRecord]:
+    for el in iter_elements(fp):
+        p = poi_from_json_element(el)
+        if p is not None:
+            yield p
+
+def iter_hits(fp, lat, lon, raio, max_results, match: Optional[Callable[[ClinicRecord], bool]] = None,
+              source: str = "overpass") -> Iterator[ClinicRecord]:
+    """
+    POIs within raio of lat/lon that pass match, with distancia_m and source set.
+    Stops reading after max_results of them.
+    """
+    found = 0
+    if max_results <= 0:
+        return
+    for p in iter_pois(fp):
+        dist = haversine_m(lat, lon, p.lat, p.lon)
+        if dist > raio:
+            continue
+        if match is not None and not match(p):
+            continue
+        p.distancia_m = dist
+        p.source = source
+        yield p
+        found += 1
+        if found >= max_results:
+            return
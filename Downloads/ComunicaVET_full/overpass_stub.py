@@ -0,0 +1,211 @@
+"""
+Local stand-in for an Overpass endpoint, for tests and benchmarks.
+
+    server, url = serve({"elements": [...]}, delay_s=0.5)
+    buscar_clinicas_veterinarias_async(lat, lon, overpass_urls=[url])
+    server.shutdown()
+
+payload may also be a callable receiving the Overpass query text, e.g.
+replay(fixture), which answers each query with only the fixture elements
+inside its bbox/around filters (and matching its tag regex), like the real
+server would. Diff queries (".atual out ids" plus newer:) are answered with
+the ids of the selected elements, their count, then those whose "timestamp"
+is not older than the newer: date; evoluir_fixture() makes the later version of a
+fixture to replay against a cache filled from the earlier one.
+"""
+import gzip
+import json
+import math
+import random
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # keep-alive, like the real servers
+    protocol_version = "HTTP/1.1"
+
+    def _query_text(self) -> str:
+        if self.command == "POST":
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length).decode("utf-8")
+        else:
+            raw = urllib.parse.urlsplit(self.path).query
+        return (urllib.parse.parse_qs(raw).get("data") or [raw])[0]
+
+    def _answer(self):
+        srv = self.server
+        q = self._query_text()
+        with srv.lock:
+            srv.queries.append(q)
+        if srv.delay_s:
+            time.sleep(srv.delay_s)
+        payload = srv.payload(q) if callable(srv.payload) else srv.payload
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+        gz = "gzip" in (self.headers.get("Accept-Encoding") or "")
+        if gz:
+            body = gzip.compress(body, compresslevel=1)
+        self.send_response(srv.status)
+        self.send_header("Content-Type", "application/json")
+        if gz:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _answer
+    do_POST = _answer
+
+    def log_message(self, *args):
+        pass
+
+
+_BBOX = re.compile(r"\((-?[\d.]+),(-?[\d.]+),(-?[\d.]+),(-?[\d.]+)\)")
+_AROUND = re.compile(r"around:([\d.]+),(-?[\d.]+),(-?[\d.]+)")
+_TAG_REGEX = re.compile(r'\[~"([^"]*)"~"([^"]*)",i\]')
+_TAG_EQ = re.compile(r"\[([\w:]+)=([\w:]+)\]")
+_NAMED_SET = re.compile(r"\(\n(.*?)\n\)->\.(\w+);", re.S)
+_NEWER = re.compile(r'newer:"([^"]+)"')
+
+def _element_pos(el):
+    pos = el if el.get("type") == "node" else (el.get("center") or {})
+    return pos.get("lat"), pos.get("lon")
+
+def replay(fixture):
+    """Payload callable answering each query with the fixture elements its filters select."""
+    elements = [(el, *_element_pos(el)) for el in fixture.get("elements", [])]
+    elements = [t for t in elements if t[1] is not None and t[2] is not None]
+    header = {k: v for k, v in fixture.items() if k not in ("elements", "remark")}
+    # a fixture with a remark replays an aborted query; Overpass writes it after the elements
+    remark = {"remark": fixture["remark"]} if fixture.get("remark") else {}
+
+    def select(q):
+        boxes = [tuple(map(float, m)) for m in _BBOX.findall(q)]
+        arounds = [tuple(map(float, m)) for m in _AROUND.findall(q)]
+        tag = _TAG_REGEX.search(q)
+        if tag:
+            keys, vals = re.compile(tag.group(1), re.I), re.compile(tag.group(2), re.I)
+        # [amenity=veterinary]: an element that lost the tag drops out like on the real server
+        required = set(_TAG_EQ.findall(q))
+        out = []
+        for el, lat, lon in elements:
+            hit = any(s <= lat <= n and w <= lon <= e for s, w, n, e in boxes)
+            if not hit:
+                for r, clat, clon in arounds:
+                    dy = math.radians(lat - clat)
+                    dx = math.radians(lon - clon) * math.cos(math.radians(clat))
+                    if 6371000.0 * math.hypot(dx, dy) <= r:
+                        hit = True
+                        break
+            if hit and required:
+                hit = all((el.get("tags") or {}).get(k) == v for k, v in required)
+            if hit and tag:
+                hit = any(keys.search(k) and vals.search(str(v)) for k, v in (el.get("tags") or {}).items())
+            if hit:
+                out.append(el)
+        return out
+
+    def answer(q):
+        # (...)->.fora; (...)->.dentro; (.fora; - .dentro;) as sent by incremental searches
+        sets = dict((nome, corpo) for corpo, nome in _NAMED_SET.findall(q))
+        if "atual" in sets:
+            # diff refresh: ids of everything current, then the elements changed since newer:
+            atual = select(sets["atual"])
+            newer = _NEWER.search(q)
+            desde = newer.group(1) if newer else ""
+            out = [{"type": el["type"], "id": el["id"]} for el in atual]
+            out.append({"type": "count", "id": 0, "tags": {"total": str(len(atual))}})
+            out += [el for el in atual if el.get("timestamp", "") >= desde]
+        elif "fora" in sets:
+            out = select(sets["fora"])
+            if "dentro" in sets:
+                dentro = {id(el) for el in select(sets["dentro"])}
+                out = [el for el in out if id(el) not in dentro]
+        else:
+            out = select(q)
+        return json.dumps(dict(header, elements=out, **remark)).encode("utf-8")
+
+    return answer
+
+_NOMES_A = ("Clínica Veterinária", "Hospital Veterinário", "Pet Shop e Clínica", "Consultório Veterinário",
+            "Centro Médico Veterinário", "Vet")
+_NOMES_B = ("São Francisco", "Santa Catarina", "Amigo Fiel", "Bicho Feliz", "Pata Amiga", "Vida Animal",
+            "Dr. Silva", "Mundo Pet", "4 Patas", "Cão & Gato", "Arca de Noé", "Bem-Estar")
+_ESPECIALIDADES = (None, None, None, "felinos", "ortopedia;cirurgia", "exóticos", "dermatologia", "cães;gatos",
+                   "emergência 24h", "oftalmologia")
+
+def fixture_sintetica(n: int, lat: float = -23.55, lon: float = -46.63, spread_deg: float = 0.3, seed: int = 1):
+    """Deterministic [out:json] response with n clinics around lat/lon (nodes and way centres)."""
+    rnd = random.Random(seed)
+    elements = []
+    for i in range(n):
+        la = lat + rnd.uniform(-spread_deg, spread_deg)
+        lo = lon + rnd.uniform(-spread_deg, spread_deg)
+        tags = {"amenity": "veterinary", "name": f"{rnd.choice(_NOMES_A)} {rnd.choice(_NOMES_B)} {i}"}
+        espec = rnd.choice(_ESPECIALIDADES)
+        if espec:
+            tags["vet:speciality"] = espec
+        if rnd.random() < 0.4:
+            tags["phone"] = f"+55 11 {rnd.randint(20000000, 99999999)}"
+        if rnd.random() < 0.5:
+            tags.update({"addr:street": "Rua " + rnd.choice(_NOMES_B), "addr:housenumber": str(rnd.randint(1, 3000))})
+        if i % 5 == 0:
+            elements.append({"type": "way", "id": 10**9 + i, "center": {"lat": la, "lon": lo}, "tags": tags})
+        else:
+            elements.append({"type": "node", "id": i + 1, "lat": la, "lon": lo, "tags": tags})
+    return {"version": 0.6, "generator": "Overpass API (sintético)", "elements": elements}
+
+def evoluir_fixture(fixture, timestamp: str, alterados: int = 5, novos: int = 5, removidos: int = 5, seed: int = 2):
+    """
+    Later version of fixture: some elements renamed, some removed, some new,
+    the changed and new ones stamped with timestamp ("2026-01-01T00:00:00Z").
+    """
+    rnd = random.Random(seed)
+    elements = [dict(el, tags=dict(el.get("tags") or {})) for el in fixture.get("elements", [])]
+    for el in rnd.sample(elements, min(removidos, len(elements))):
+        elements.remove(el)
+    for el in rnd.sample(elements, min(alterados, len(elements))):
+        el["tags"]["name"] = el["tags"].get("name", "") + " (novo nome)"
+        el["timestamp"] = timestamp
+    for i in range(novos):
+        la, lo = _element_pos(rnd.choice(elements)) if elements else (0.0, 0.0)
+        tags = {"amenity": "veterinary", "name": f"Clínica Nova {i}"}
+        elements.append({"type": "node", "id": 2 * 10**9 + i, "lat": la + rnd.uniform(-0.005, 0.005),
+                         "lon": lo + rnd.uniform(-0.005, 0.005), "tags": tags, "timestamp": timestamp})
+    return dict({k: v for k, v in fixture.items() if k != "elements"}, elements=elements)
+
+def serve(payload, delay_s: float = 0.0, status: int = 200, host: str = "127.0.0.1", port: int = 0):
+    """Starts the stub in a daemon thread; returns (server, interpreter_url)."""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.payload = payload
+    server.delay_s = delay_s
+    server.status = status
+    server.queries = []
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, name="overpass-stub", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/api/interpreter"
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Servidor Overpass falso a partir de um JSON gravado")
+    parser.add_argument("fixture", help="JSON gravado de uma resposta Overpass")
+    parser.add_argument("--replay", action="store_true", help="responder só com os elementos dentro da consulta")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--delay", type=float, default=0.0)
+    parser.add_argument("--status", type=int, default=200)
+    args = parser.parse_args()
+    with open(args.fixture, "rb") as f:
+        data = f.read()
+    srv, url = serve(replay(json.loads(data)) if args.replay else data, args.delay, args.status, port=args.port)
+    print("Overpass stub em", url)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        srv.shutdown()
@@ -0,0 +1,301 @@
+"""
+Offline index of veterinary POIs loaded from an OSM extract.
+
+    python poi_index.py sao-paulo.osm.pbf -o vet_index.json
+
+Supported inputs: .geojson/.json (FeatureCollection), .osm/.xml and, when
+pyosmium is installed, .pbf. Points are kept in flat arrays bucketed on a
+uniform lat/lon grid, so radius and k-nearest queries only look at the
+cells around the query point.
+"""
+import bisect
+import heapq
+import json
+import math
+import xml.etree.ElementTree as ET
+from array import array
+from typing import Container, Iterable, List, Optional, Set, Tuple
+
+from clinic_record import ClinicRecord
+from especialidade import TextIndex
+from geo import distances_m
+from optional_deps import OptionalModule
+
+# pyosmium — optional, only needed for .pbf extracts
+_osmium = OptionalModule("osmium")
+
+_M_PER_DEG = 111320.0
+
+def poi_from_tags(osm_type, osm_id, tags, lat, lon) -> ClinicRecord:
+    """Normalized POI record shared by the Overpass path and the offline index."""
+    tags = tags or {}
+    return ClinicRecord(
+        osm_type=osm_type,
+        osm_id=osm_id,
+        nome=tags.get("name"),
+        endereco=tags.get("addr:street") or tags.get("addr:full") or "",
+        lat=lat,
+        lon=lon,
+        telefone=tags.get("phone") or tags.get("contact:phone"),
+        especialidade=tags.get("vet:speciality") or tags.get("speciality") or tags.get("service"),
+    )
+
+def _is_vet(tags) -> bool:
+    return (tags or {}).get("amenity") == "veterinary"
+
+# ---------------------------------------------------------------- importers
+
+def load_geojson(path) -> List[ClinicRecord]:
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    pois = []
+    for feat in data.get("features", []):
+        props = feat.get("properties") or {}
+        tags = props.get("tags") or props
+        if not _is_vet(tags):
+            continue
+        geom = feat.get("geometry") or {}
+        coords = _geometry_center(geom)
+        if coords is None:
+            continue
+        osm_type, osm_id = _split_osm_id(feat.get("id") or props.get("@id"))
+        pois.append(poi_from_tags(osm_type, osm_id, tags, coords[1], coords[0]))
+    return pois
+
+def _geometry_center(geom) -> Optional[Tuple[float, float]]:
+    """(lon, lat) of a Point, or the mean vertex of any other geometry."""
+    if geom.get("type") == "Point":
+        c = geom.get("coordinates") or []
+        return (float(c[0]), float(c[1])) if len(c) >= 2 else None
+    pts = []
+    def walk(c):
+        if c and isinstance(c[0], (int, float)):
+            pts.append(c)
+        else:
+            for sub in c or []:
+                walk(sub)
+    walk(geom.get("coordinates"))
+    if not pts:
+        return None
+    return sum(p[0] for p in pts) / len(pts), sum(p[1] for p in pts) / len(pts)
+
+def _split_osm_id(raw):
+    # "node/123", "way/45" (osmtogeojson) or a bare number
+    if raw is None:
+        return None, None
+    s = str(raw)
+    if "/" in s:
+        t, i = s.split("/", 1)
+        try:
+            return t, int(i)
+        except ValueError:
+            return t, None
+    try:
+        return "node", int(s)
+    except ValueError:
+        return None, None
+
+def load_osm_xml(path) -> List[ClinicRecord]:
+    """
+    Two streaming passes over the XML: the first keeps vet nodes and the node
+    refs of vet ways, the second resolves those refs to a centre point.
+    """
+    pois = []
+    way_refs = {}
+    way_tags = {}
+    for _, el in ET.iterparse(path, events=("end",)):
+        if el.tag in ("node", "way"):
+            tags = {t.get("k"): t.get("v") for t in el.findall("tag")}
+            if _is_vet(tags):
+                if el.tag == "node":
+                    pois.append(poi_from_tags("node", int(el.get("id")), tags,
+                                              float(el.get("lat")), float(el.get("lon"))))
+                else:
+                    wid = int(el.get("id"))
+                    way_refs[wid] = [int(nd.get("ref")) for nd in el.findall("nd")]
+                    way_tags[wid] = tags
+            el.clear()
+    if not way_refs:
+        return pois
+
+    wanted = {ref for refs in way_refs.values() for ref in refs}
+    coords = {}
+    for _, el in ET.iterparse(path, events=("end",)):
+        if el.tag == "node":
+            nid = int(el.get("id"))
+            if nid in wanted:
+                coords[nid] = (float(el.get("lat")), float(el.get("lon")))
+        el.clear()
+    for wid, refs in way_refs.items():
+        pts = [coords[r] for r in refs if r in coords]
+        if not pts:
+            continue
+        pois.append(poi_from_tags("way", wid, way_tags[wid],
+                                  sum(p[0] for p in pts) / len(pts), sum(p[1] for p in pts) / len(pts)))
+    return pois
+
+def load_osm_pbf(path) -> List[ClinicRecord]:
+    osmium = _osmium.get()
+    if osmium is None:
+        raise RuntimeError("pyosmium não instalado: pip install osmium")
+
+    pois = []
+
+    class _Handler(osmium.SimpleHandler):
+        def node(self, n):
+            if n.tags.get("amenity") == "veterinary" and n.location.valid():
+                pois.append(poi_from_tags("node", n.id, dict(n.tags), n.location.lat, n.location.lon))
+
+        def way(self, w):
+            if w.tags.get("amenity") != "veterinary":
+                return
+            pts = [(nd.lat, nd.lon) for nd in w.nodes if nd.location.valid()]
+            if pts:
+                pois.append(poi_from_tags("way", w.id, dict(w.tags),
+                                          sum(p[0] for p in pts) / len(pts), sum(p[1] for p in pts) / len(pts)))
+
+    _Handler().apply_file(path, locations=True)
+    return pois
+
+def load_pois(path) -> List[ClinicRecord]:
+    p = str(path).lower()
+    if p.endswith(".pbf"):
+        return load_osm_pbf(path)
+    if p.endswith(".osm") or p.endswith(".xml"):
+        return load_osm_xml(path)
+    return load_geojson(path)
+
+# ---------------------------------------------------------------- index
+
+class GridIndex:
+    """
+    Uniform grid over lat/lon. Points are sorted by cell; cell_keys/cell_starts
+    give the slice of lats/lons/pois belonging to each non-empty cell.
+    """
+
+    def __init__(self, pois: Iterable[ClinicRecord], cell_deg: float = 0.02):
+        self.cell_deg = cell_deg
+        keyed = []
+        for p in pois:
+            try:
+                if isinstance(p, dict):
+                    p = ClinicRecord.from_dict(p)
+                lat, lon = float(p.lat), float(p.lon)
+            except Exception:
+                continue
+            keyed.append((self._cell_key(*self._cell(lat, lon)), lat, lon, p))
+        keyed.sort(key=lambda t: t[0])
+        self.lats = array("d", (t[1] for t in keyed))
+        self.lons = array("d", (t[2] for t in keyed))
+        self.pois = [t[3] for t in keyed]
+        self.cell_keys = array("q")
+        self.cell_starts = array("l")
+        for i, t in enumerate(keyed):
+            if not self.cell_keys or self.cell_keys[-1] != t[0]:
+                self.cell_keys.append(t[0])
+                self.cell_starts.append(i)
+        self.cell_starts.append(len(keyed))
+        self._texto = None
+        self._matches = {}
+
+    def __len__(self):
+        return len(self.pois)
+
+    def _cell(self, lat, lon) -> Tuple[int, int]:
+        return int(math.floor((lat + 90.0) / self.cell_deg)), int(math.floor((lon + 180.0) / self.cell_deg))
+
+    @staticmethod
+    def _cell_key(row, col) -> int:
+        return (row << 32) | col
+
+    def _cell_range(self, row, col) -> Tuple[int, int]:
+        key = self._cell_key(row, col)
+        i = bisect.bisect_left(self.cell_keys, key)
+        if i < len(self.cell_keys) and self.cell_keys[i] == key:
+            return self.cell_starts[i], self.cell_starts[i + 1]
+        return 0, 0
+
+    def _scan(self, lat, lon, r0, r1, c0, c1, raio_m, out):
+        for row in range(r0, r1 + 1):
+            for col in range(c0, c1 + 1):
+                a, b = self._cell_range(row, col)
+                if a == b:
+                    continue
+                dists = distances_m(lat, lon, self.lats[a:b], self.lons[a:b])
+                for j in range(b - a):
+                    if dists[j] <= raio_m:
+                        out.append((float(dists[j]), a + j))
+
+    def matching(self, consulta) -> Set[int]:
+        """Positions of self.pois matching a compiled specialty query, remembered per query."""
+        key = (consulta.query, consulta.fuzzy_threshold)
+        found = self._matches.get(key)
+        if found is None:
+            if self._texto is None:
+                self._texto = TextIndex(self.pois)
+            if len(self._matches) >= 256:
+                self._matches.clear()
+            found = self._matches[key] = consulta.filtrar(self._texto)
+        return found
+
+    def radius(self, lat: float, lon: float, raio_m: float, keep: Optional[Container[int]] = None,
+               limit: Optional[int] = None) -> List[Tuple[float, ClinicRecord]]:
+        """
+        (distance_m, poi) pairs within raio_m, nearest first; keep limits it to
+        those positions of self.pois, limit to the nearest limit pairs (selected
+        with a heap instead of sorting every candidate).
+        """
+        dlat = raio_m / _M_PER_DEG
+        dlon = raio_m / (_M_PER_DEG * max(math.cos(math.radians(lat)), 1e-6))
+        r0, c0 = self._cell(lat - dlat, lon - dlon)
+        r1, c1 = self._cell(lat + dlat, lon + dlon)
+        out = []
+        self._scan(lat, lon, r0, r1, c0, c1, raio_m, out)
+        if keep is not None:
+            out = [t for t in out if t[1] in keep]
+        if limit is not None and limit < len(out):
+            out = heapq.nsmallest(limit, out)
+        else:
+            out.sort()
+        return [(d, self.pois[i]) for d, i in out]
+
+    def nearest(self, lat: float, lon: float, k: int, max_dist_m: float = 50000.0) -> List[Tuple[float, ClinicRecord]]:
+        """k nearest POIs within max_dist_m; the search radius doubles until k are found."""
+        raio = self.cell_deg * _M_PER_DEG
+        while True:
+            found = self.radius(lat, lon, min(raio, max_dist_m), limit=k)
+            if len(found) >= k or raio >= max_dist_m:
+                return found
+            raio *= 2
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"cell_deg": self.cell_deg, "pois": [p.to_poi_dict() for p in self.pois]}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path) -> "GridIndex":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data.get("pois", []), data.get("cell_deg", 0.02))
+
+def build_index(path, cell_deg: float = 0.02) -> GridIndex:
+    """Builds an index straight from an OSM extract or a saved index file."""
+    p = str(path).lower()
+    if p.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            head = f.read(64)
+        if '"cell_deg"' in head:
+            return GridIndex.load(path)
+    return GridIndex(load_pois(path), cell_deg)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Importa clínicas veterinárias de um extrato OSM")
+    parser.add_argument("extract")
+    parser.add_argument("-o", "--output", default="vet_index.json")
+    parser.add_argument("--cell-deg", type=float, default=0.02)
+    args = parser.parse_args()
+    idx = GridIndex(load_pois(args.extract), args.cell_deg)
+    idx.save(args.output)
+    print(f"{len(idx)} clínicas indexadas em {args.output}")
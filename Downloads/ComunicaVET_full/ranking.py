@@ -0,0 +1,170 @@
+"""
+Re-ranking of search results (re_rank=True).
+
+    score = PESO_DISTANCIA * exp(-distancia_m / decay_m)
+          + PESO_FEEDBACK * feedback (0..1, FEEDBACK_NEUTRO when not rated)
+          + PESO_ESPECIALIDADE * match strength (0..1)
+
+Feedback comes from an in-memory table {clinic_id: score} filled by a
+loader function and refreshed in a background thread every
+FEEDBACK_REFRESH_S, so a search never waits on the database. Distance and
+feedback are cheap and computed for every candidate; the match strength only
+for candidates that can still make the top k, and the stage stops scoring
+once budget_ms is spent.
+"""
+import heapq
+import importlib
+import math
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+from clinic_record import ClinicRecord
+from especialidade import compilar_especialidade
+
+PESO_DISTANCIA = 0.6
+PESO_FEEDBACK = 0.25
+PESO_ESPECIALIDADE = 0.15
+FEEDBACK_NEUTRO = 0.5
+FEEDBACK_REFRESH_S = 300
+# default latency budget of the whole ranking stage
+RANK_BUDGET_MS = 5.0
+# sources are asked for this many times max_results so ranking has a choice
+RANK_POOL_FACTOR = 3
+
+def _db_loader() -> Dict[str, float]:
+    """Bulk scores from the application's db module, when it provides get_feedback_scores()."""
+    try:
+        db = importlib.import_module("db")
+    except ImportError:
+        return {}
+    bulk = getattr(db, "get_feedback_scores", None)
+    return dict(bulk()) if bulk is not None else {}
+
+def _normalize(raw: Dict[str, float]) -> Dict[str, float]:
+    vals = [float(v) for v in raw.values() if v is not None]
+    if not vals:
+        return {}
+    lo, hi = min(vals), max(vals)
+    if hi <= lo:
+        return {k: FEEDBACK_NEUTRO for k, v in raw.items() if v is not None}
+    return {k: (float(v) - lo) / (hi - lo) for k, v in raw.items() if v is not None}
+
+
+class FeedbackTable:
+    """
+    Feedback scores keyed by ClinicRecord.clinic_id, scaled to 0..1.
+    The first scores() call loads synchronously; afterwards an old table is
+    still served while a daemon thread reloads it.
+    """
+
+    def __init__(self, loader: Optional[Callable[[], Dict[str, float]]] = _db_loader,
+                 refresh_s: float = FEEDBACK_REFRESH_S):
+        self.loader = loader
+        self.refresh_s = refresh_s
+        self._scores: Dict[str, float] = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self.loads = 0
+        self.errors = 0
+
+    def _load(self):
+        try:
+            scores = _normalize(self.loader() if self.loader else {})
+        except Exception as e:
+            self.errors += 1
+            print("Aviso feedback:", e)
+            scores = None
+        if scores is not None:
+            self._scores = scores
+            self.loads += 1
+        self._loaded_at = time.monotonic()
+        self._refreshing = False
+
+    def scores(self) -> Dict[str, float]:
+        if self._loaded_at is None:
+            with self._lock:
+                if self._loaded_at is None:
+                    self._load()
+        elif time.monotonic() - self._loaded_at > self.refresh_s:
+            with self._lock:
+                if self._refreshing:
+                    return self._scores
+                self._refreshing = True
+            threading.Thread(target=self._load, name="feedback-refresh", daemon=True).start()
+        return self._scores
+
+    def invalidate(self):
+        """Forces a synchronous reload on the next scores() call."""
+        self._loaded_at = None
+
+
+_feedback = FeedbackTable()
+_stats = {"calls": 0, "candidates": 0, "full_scored": 0, "budget_exceeded": 0, "time_s": 0.0}
+
+def definir_fonte_feedback(loader: Optional[Callable[[], Dict[str, float]]], refresh_s: float = FEEDBACK_REFRESH_S):
+    """Replaces the feedback loader; it must return {clinic_id: score} (any scale)."""
+    global _feedback
+    _feedback = FeedbackTable(loader, refresh_s)
+
+def ranking_stats() -> Dict[str, float]:
+    out = dict(_stats)
+    out["avg_ms"] = (_stats["time_s"] / _stats["calls"] * 1e3) if _stats["calls"] else 0.0
+    out["feedback_entries"] = len(_feedback._scores)
+    return out
+
+def ranquear(records: Sequence[ClinicRecord], k: int, especialidade: Optional[str] = None, fuzzy_threshold=70,
+             decay_m: float = 2500.0, budget_ms: float = RANK_BUDGET_MS,
+             feedback: Optional[FeedbackTable] = None) -> List[ClinicRecord]:
+    """
+    Best k records by score, best first. records should come nearest first:
+    ties, and whatever the budget leaves unscored, keep that order.
+    """
+    t0 = time.perf_counter()
+    n = len(records)
+    if n == 0 or k <= 0:
+        return []
+    deadline = t0 + budget_ms / 1000.0
+    table = (feedback or _feedback).scores()
+    decay = max(float(decay_m), 1.0)
+    cheap = []
+    for r in records:
+        d = r.distancia_m
+        s = PESO_DISTANCIA * math.exp(-d / decay) if d is not None else 0.0
+        cheap.append(s + PESO_FEEDBACK * table.get(r.clinic_id, FEEDBACK_NEUTRO))
+
+    order = sorted(range(n), key=lambda i: (-cheap[i], i))
+    consulta = compilar_especialidade(especialidade, fuzzy_threshold) if especialidade else None
+    if consulta is None:
+        chosen = order[:k]
+        scored = 0
+    else:
+        # min-heap of the best (score, -position) so far; a candidate whose cheap
+        # score plus the largest possible match bonus cannot beat the k-th is skipped,
+        # and so is everything after it, as order is by cheap score
+        best = []
+        scored = 0
+        for pos, i in enumerate(order):
+            if len(best) >= k and cheap[i] + PESO_ESPECIALIDADE <= best[0][0]:
+                break
+            if pos and not pos % 16 and time.perf_counter() > deadline:
+                _stats["budget_exceeded"] += 1
+                break
+            item = (cheap[i] + PESO_ESPECIALIDADE * consulta.forca(records[i]), -i)
+            scored += 1
+            if len(best) < k:
+                heapq.heappush(best, item)
+            elif item > best[0]:
+                heapq.heapreplace(best, item)
+        chosen = [-i for _, i in sorted(best, reverse=True)]
+        if len(chosen) < k:
+            taken = set(chosen)
+            chosen.extend(i for i in order if i not in taken)
+            chosen = chosen[:k]
+
+    _stats["calls"] += 1
+    _stats["candidates"] += n
+    _stats["full_scored"] += scored
+    _stats["time_s"] += time.perf_counter() - t0
+    return [records[i] for i in chosen]
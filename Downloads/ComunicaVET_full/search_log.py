@@ -0,0 +1,247 @@
+"""
+Write-behind logging of searches for analytics and feedback.
+
+A search only appends one small dict to a bounded in-memory queue; a daemon
+thread drains it every LOG_INTERVALO_S (or as soon as LOG_LOTE_MAX events
+are waiting) and hands each batch to a sink in one call: one SQLite
+transaction, one append to a rotating JSON-lines file, or the application's
+db module. When the queue is full new events are dropped and counted
+(descartados) instead of making the search wait, unless the logger was
+created with bloquear_s > 0. Whatever is queued is flushed at interpreter
+exit. Disabled by default:
+
+    search_log.habilitar()                                  # SQLite, LOG_DB
+    search_log.habilitar(search_log.RotatingFileSink("buscas.jsonl"))
+    search_log.habilitar(search_log.DbModuleSink())         # db.log_search
+"""
+import atexit
+import importlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+LOG_DB = "search_log.db"
+LOG_FILA_MAX = 10000
+LOG_LOTE_MAX = 500
+LOG_INTERVALO_S = 2.0
+ARQUIVO_MAX_BYTES = 16 << 20
+ARQUIVO_BACKUPS = 5
+
+_CAMPOS = ("ts", "lat", "lon", "raio", "especialidade", "resultados", "duracao_ms", "origem")
+_PARAR = object()
+
+
+class SQLiteLogSink:
+    """
+    Batches into a buscas table, one transaction each. A separate file from
+    the Overpass cache, so log writes never hold the cache database's lock.
+    """
+
+    def __init__(self, path: str = LOG_DB):
+        self.path = path
+        self._conn = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"CREATE TABLE IF NOT EXISTS buscas ({', '.join(_CAMPOS)})")
+        return conn
+
+    def __call__(self, batch: List[Dict]):
+        if self._conn is None:
+            self._conn = self._connect()
+        with self._conn:
+            self._conn.executemany(f"INSERT INTO buscas VALUES ({', '.join('?' * len(_CAMPOS))})",
+                                   [tuple(ev.get(c) for c in _CAMPOS) for ev in batch])
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class RotatingFileSink:
+    """Appends one JSON line per event; past max_bytes the file moves to path.1 (path.2, ...)."""
+
+    def __init__(self, path: str, max_bytes: int = ARQUIVO_MAX_BYTES, backups: int = ARQUIVO_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def __call__(self, batch: List[Dict]):
+        data = "".join(json.dumps(ev, ensure_ascii=False) + "\n" for ev in batch)
+        try:
+            if os.path.getsize(self.path) >= self.max_bytes:
+                self._rotate()
+        except OSError:
+            pass
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(data)
+
+
+class DbModuleSink:
+    """
+    The application's db module: db.log_searches(batch) when it has one,
+    otherwise db.log_search(evento) per event.
+    """
+
+    def __init__(self, module: str = "db"):
+        self.module = module
+        self._fn = None
+        self._bulk = False
+
+    def __call__(self, batch: List[Dict]):
+        if self._fn is None:
+            db = importlib.import_module(self.module)
+            bulk = getattr(db, "log_searches", None)
+            self._bulk = bulk is not None
+            self._fn = bulk if bulk is not None else db.log_search
+        if self._bulk:
+            self._fn(batch)
+        else:
+            for ev in batch:
+                self._fn(ev)
+
+
+class SearchLogger:
+    """
+    Bounded queue plus the writer thread. registrar() never blocks unless
+    bloquear_s > 0; events that do not fit are counted in descartados, and
+    events of a batch the sink failed on in perdidos.
+    """
+
+    def __init__(self, sink: Callable[[List[Dict]], None], fila_max: int = LOG_FILA_MAX,
+                 lote_max: int = LOG_LOTE_MAX, intervalo_s: float = LOG_INTERVALO_S, bloquear_s: float = 0.0):
+        self.sink = sink
+        self.lote_max = lote_max
+        self.intervalo_s = intervalo_s
+        self.bloquear_s = bloquear_s
+        self._fila = queue.Queue(fila_max)
+        self._lock = threading.Lock()
+        self._counts = {"enfileirados": 0, "gravados": 0, "descartados": 0, "perdidos": 0, "lotes": 0, "erros": 0}
+        self._thread = threading.Thread(target=self._run, name="search-log", daemon=True)
+        self._thread.start()
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            self._counts[name] += n
+
+    def registrar(self, evento: Dict) -> bool:
+        """Queues evento; False when it was dropped because the queue is full."""
+        try:
+            if self.bloquear_s > 0:
+                self._fila.put(evento, timeout=self.bloquear_s)
+            else:
+                self._fila.put_nowait(evento)
+        except queue.Full:
+            self._count("descartados")
+            return False
+        self._count("enfileirados")
+        return True
+
+    def _write(self, batch):
+        try:
+            self.sink(batch)
+        except Exception as e:
+            self._count("erros")
+            self._count("perdidos", len(batch))
+            print("Aviso search_log:", e)
+            return
+        with self._lock:
+            self._counts["gravados"] += len(batch)
+            self._counts["lotes"] += 1
+
+    def _run(self):
+        parar = False
+        while not parar:
+            batch = []
+            deadline = time.monotonic() + self.intervalo_s
+            while len(batch) < self.lote_max:
+                try:
+                    ev = self._fila.get(timeout=max(deadline - time.monotonic(), 0.0))
+                except queue.Empty:
+                    break
+                if ev is _PARAR:
+                    parar = True
+                    break
+                batch.append(ev)
+            if parar:
+                # drain what came before the stop marker
+                while True:
+                    try:
+                        ev = self._fila.get_nowait()
+                    except queue.Empty:
+                        break
+                    if ev is not _PARAR:
+                        batch.append(ev)
+            for i in range(0, len(batch), self.lote_max):
+                self._write(batch[i:i + self.lote_max])
+        close = getattr(self.sink, "close", None)
+        if close is not None:
+            close()
+
+    def fechar(self, timeout: float = 10.0):
+        """Flushes the queue and stops the writer (waits at most timeout)."""
+        if not self._thread.is_alive():
+            return
+        try:
+            self._fila.put(_PARAR, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            out = dict(self._counts)
+        out["fila"] = self._fila.qsize()
+        return out
+
+
+_logger: Optional[SearchLogger] = None
+_logger_lock = threading.Lock()
+
+def habilitar(sink: Optional[Callable[[List[Dict]], None]] = None, **kwargs) -> SearchLogger:
+    """Starts logging searches to sink (SQLiteLogSink(LOG_DB) by default); kwargs go to SearchLogger."""
+    global _logger
+    novo = SearchLogger(sink if sink is not None else SQLiteLogSink(LOG_DB), **kwargs)
+    with _logger_lock:
+        old, _logger = _logger, novo
+    if old is not None:
+        old.fechar()
+    return novo
+
+def desabilitar(timeout: float = 10.0):
+    """Stops logging after flushing what is queued."""
+    global _logger
+    with _logger_lock:
+        old, _logger = _logger, None
+    if old is not None:
+        old.fechar(timeout)
+
+def registrar_busca(lat, lon, raio, especialidade, resultados: int, duracao_s: float, origem: str = "sync"):
+    logger = _logger
+    if logger is None:
+        return
+    logger.registrar({"ts": time.time(), "lat": lat, "lon": lon, "raio": raio, "especialidade": especialidade,
+                      "resultados": resultados, "duracao_ms": duracao_s * 1e3, "origem": origem})
+
+def search_log_stats() -> Dict[str, int]:
+    logger = _logger
+    return logger.stats() if logger is not None else {}
+
+atexit.register(desabilitar)
@@ -0,0 +1,239 @@
+"""
+Per-stage timers, counters and per-request traces for the search path.
+
+Disabled by default; while disabled stage() hands back one shared no-op
+context manager and incr() returns at once, so the hooks cost a function
+call each. Turn it on with habilitar():
+
+    telemetry.habilitar(sink=telemetry.JsonLinesSink("traces.jsonl"))
+    buscar_clinicas_veterinarias(...)
+    print(telemetry.prometheus_text())
+
+Stages: busca / busca_async (whole request), geocode (the Nominatim call),
+geocode_rate_limit, cache_init, cache_lookup, offline, overpass,
+overpass_fetch (HTTP + streamed parsing), overpass_backoff, overpass_race,
+filter, especialidade, merge, rank.
+Counters: tile_hits, tile_misses, tile_stale, cache_hits, cache_misses,
+overpass_retries, overpass_endpoint_failures, overpass_failures,
+candidates_in_radius, candidates_filtered, geocode_cache_hits, geocode_cache_misses,
+failure_cache_hits (fetches skipped because the key failed moments ago),
+tile_diff_refreshes, tile_diff_changed, tile_diff_removed,
+overpass_remarks (answers aborted by the server, counted as endpoint failures).
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+PREFIX = "comunicavet"
+
+_enabled = False
+_lock = threading.Lock()
+_counters: Dict[str, float] = {}
+# stage -> [count, total_s, max_s]
+_stages: Dict[str, List[float]] = {}
+_sinks: List[Callable[["Trace"], None]] = []
+_recent: Deque["Trace"] = deque(maxlen=100)
+_current: ContextVar[Optional["Trace"]] = ContextVar("comunicavet_trace", default=None)
+
+
+class Trace:
+    """What one request spent, stage by stage, and what it counted."""
+
+    __slots__ = ("nome", "attrs", "inicio", "duracao_s", "stages", "counters", "_t0")
+
+    def __init__(self, nome: str, attrs: Dict[str, Any]):
+        self.nome = nome
+        self.attrs = attrs
+        self.inicio = time.time()
+        self._t0 = time.perf_counter()
+        self.duracao_s = None
+        self.stages: List[tuple] = []
+        self.counters: Dict[str, float] = {}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "nome": self.nome,
+            "attrs": self.attrs,
+            "inicio": self.inicio,
+            "duracao_ms": None if self.duracao_s is None else self.duracao_s * 1e3,
+            "stages": [{"stage": s, "ms": d * 1e3} for s, d in self.stages],
+            "counters": self.counters,
+        }
+
+
+class _Noop:
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _Noop()
+
+
+class _Stage:
+    __slots__ = ("name", "t0")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        _record_stage(self.name, time.perf_counter() - self.t0)
+        return False
+
+
+class _TraceScope:
+    __slots__ = ("trace", "token")
+
+    def __init__(self, nome, attrs):
+        self.trace = Trace(nome, attrs)
+
+    def __enter__(self):
+        self.token = _current.set(self.trace)
+        return self.trace
+
+    def __exit__(self, *exc):
+        t = self.trace
+        t.duracao_s = time.perf_counter() - t._t0
+        _current.reset(self.token)
+        _record_stage(t.nome, t.duracao_s, into_trace=False)
+        with _lock:
+            _recent.append(t)
+            sinks = list(_sinks)
+        for sink in sinks:
+            try:
+                sink(t)
+            except Exception as e:
+                print("Aviso telemetria:", e)
+        return False
+
+
+def _record_stage(name, dt, into_trace=True):
+    with _lock:
+        st = _stages.get(name)
+        if st is None:
+            _stages[name] = [1, dt, dt]
+        else:
+            st[0] += 1
+            st[1] += dt
+            if dt > st[2]:
+                st[2] = dt
+    if into_trace:
+        t = _current.get()
+        if t is not None:
+            t.stages.append((name, dt))
+
+def stage(name: str):
+    """Context manager timing one stage of the current request."""
+    if not _enabled:
+        return _NOOP
+    return _Stage(name)
+
+def trace(nome: str, **attrs):
+    """Context manager opening a request trace; stages and counters inside it are attached to it."""
+    if not _enabled:
+        return _NOOP
+    return _TraceScope(nome, attrs)
+
+def incr(name: str, value: float = 1):
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+    t = _current.get()
+    if t is not None:
+        t.counters[name] = t.counters.get(name, 0) + value
+
+def habilitar(sink: Optional[Callable[[Trace], None]] = None):
+    """Turns instrumentation on; sink, if given, receives every finished Trace."""
+    global _enabled
+    if sink is not None:
+        add_sink(sink)
+    _enabled = True
+
+def desabilitar():
+    global _enabled
+    _enabled = False
+
+def habilitado() -> bool:
+    return _enabled
+
+def add_sink(sink: Callable[[Trace], None]):
+    with _lock:
+        _sinks.append(sink)
+
+def reset():
+    """Clears counters, stage totals, recent traces and sinks."""
+    with _lock:
+        _counters.clear()
+        _stages.clear()
+        _recent.clear()
+        _sinks.clear()
+
+def recent_traces() -> List[Trace]:
+    with _lock:
+        return list(_recent)
+
+def snapshot() -> Dict[str, Any]:
+    """Counters and per-stage count/total/mean/max, JSON-serializable."""
+    with _lock:
+        counters = dict(_counters)
+        stages = {k: list(v) for k, v in _stages.items()}
+    return {
+        "counters": counters,
+        "stages": {k: {"count": int(c), "total_ms": s * 1e3, "mean_ms": s / c * 1e3, "max_ms": m * 1e3}
+                   for k, (c, s, m) in stages.items()},
+    }
+
+def json_text() -> str:
+    return json.dumps(snapshot(), indent=2, sort_keys=True)
+
+def prometheus_text() -> str:
+    """Prometheus text exposition format (counters and a summary per stage)."""
+    snap = snapshot()
+    lines = []
+    for name, value in sorted(snap["counters"].items()):
+        metric = f"{PREFIX}_{name}_total"
+        lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric} {value}")
+    if snap["stages"]:
+        metric = f"{PREFIX}_stage_seconds"
+        lines.append(f"# TYPE {metric} summary")
+        for name, st in sorted(snap["stages"].items()):
+            lines.append(f'{metric}_sum{{stage="{name}"}} {st["total_ms"] / 1e3}')
+            lines.append(f'{metric}_count{{stage="{name}"}} {st["count"]}')
+        lines.append(f"# TYPE {PREFIX}_stage_max_seconds gauge")
+        for name, st in sorted(snap["stages"].items()):
+            lines.append(f'{PREFIX}_stage_max_seconds{{stage="{name}"}} {st["max_ms"] / 1e3}')
+    return "\n".join(lines) + "\n"
+
+def escrever_prometheus(path: str):
+    """Writes prometheus_text() atomically, for node_exporter's textfile collector."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(prometheus_text())
+    os.replace(tmp, path)
+
+
+class JsonLinesSink:
+    """Appends every finished trace as one JSON line."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, t: Trace):
+        line = json.dumps(t.to_dict(), ensure_ascii=False)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
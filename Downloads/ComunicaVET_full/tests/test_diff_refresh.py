@@ -0,0 +1,128 @@
+import io
+import json
+import time
+
+import pytest
+
+import busca_lote
+import new_buscar_clinicas as busca
+import overpass_stub
+from endpoints import scheduler
+from geo import covering_geohashes, geohash_encode
+from overpass_cache import FailureMemory
+
+LAT, LON, RAIO = -23.55, -46.63, 2000
+
+
+@pytest.fixture
+def stub(tmp_path, monkeypatch):
+    monkeypatch.setattr(busca, "CACHE_DB", str(tmp_path / "cache.db"))
+    monkeypatch.setattr(busca, "CACHE_SNAPSHOT", None)
+    monkeypatch.setattr(busca, "DIFF_REFRESH", True)
+    monkeypatch.setattr(busca, "_falhas", FailureMemory(busca.FALHA_BACKOFF_S, busca.FALHA_BACKOFF_MAX_S))
+    monkeypatch.setattr(busca, "_DEFAULT_OVERPASS_ENDPOINTS", [])
+    scheduler().reset()
+    v1 = overpass_stub.fixture_sintetica(400, LAT, LON, spread_deg=0.03)
+    server, url = overpass_stub.serve(overpass_stub.replay(v1))
+    yield server, url, v1
+    server.shutdown()
+    server.server_close()
+    busca._get_cache().close()
+
+
+def _tiles():
+    return sorted(covering_geohashes(LAT, LON, RAIO, busca._tile_precision(RAIO)))
+
+
+def _cached(tiles):
+    cache = busca._get_cache()
+    return {gh: sorted(cache.entry(busca._make_tile_key(gh))[1], key=lambda p: p.clinic_id) for gh in tiles}
+
+
+def _ids(fixture):
+    return {f"{el['type']}/{el['id']}" for el in fixture["elements"]}
+
+
+def _evolve(v1, tiles):
+    """v1 with clinics renamed, added and deleted, plus one moved to another tile and two with tags removed."""
+    agora = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    v2 = overpass_stub.evoluir_fixture(v1, agora, alterados=8, novos=8, removidos=8)
+    precision = len(tiles[0])
+    inside = [el for el in v2["elements"]
+              if el["type"] == "node" and "timestamp" not in el
+              and geohash_encode(el["lat"], el["lon"], precision) in tiles]
+    moved, untagged, unlisted = inside[0], inside[1], inside[2]
+    target = next(el for el in inside[3:] if geohash_encode(el["lat"], el["lon"], precision)
+                  != geohash_encode(moved["lat"], moved["lon"], precision))
+    moved.update(lat=target["lat"] + 1e-5, lon=target["lon"] + 1e-5, timestamp=agora)
+    untagged["tags"].pop("vet:speciality", None)
+    untagged["tags"].pop("phone", None)
+    untagged["timestamp"] = agora
+    # no longer amenity=veterinary: drops out of the id list like a deletion
+    del unlisted["tags"]["amenity"]
+    unlisted["timestamp"] = agora
+    return v2, moved, untagged, unlisted
+
+
+def test_diff_refresh_matches_full_refetch(stub):
+    server, url, v1 = stub
+    tiles = _tiles()
+    assert busca_lote.aquecer_geohashes(tiles, url)["falhas"] == 0
+
+    v2, moved, untagged, unlisted = _evolve(v1, tiles)
+    server.payload = overpass_stub.replay(v2)
+    q0 = len(server.queries)
+    report = busca_lote.aquecer_geohashes(tiles, url, max_age_s=0)
+
+    assert report["por_diff"] == len(tiles)
+    assert report["falhas"] == 0
+    assert all(".atual out ids" in q for q in server.queries[q0:])
+
+    refreshed = _cached(tiles)
+    full = busca._fetch_tiles(tiles, url)
+    assert refreshed == {gh: sorted(full[gh], key=lambda p: p.clinic_id) for gh in tiles}
+
+    by_id = {p.clinic_id: (gh, p) for gh, pois in refreshed.items() for p in pois}
+    gh, p = by_id[f"node/{moved['id']}"]
+    assert gh == geohash_encode(moved["lat"], moved["lon"], len(gh))
+    assert (p.lat, p.lon) == (moved["lat"], moved["lon"])
+    assert by_id[f"node/{untagged['id']}"][1].especialidade is None
+    assert by_id[f"node/{untagged['id']}"][1].telefone is None
+    assert f"node/{unlisted['id']}" not in by_id
+    deleted = _ids(v1) - _ids(v2)
+    assert deleted and not deleted & set(by_id)
+    assert any(p.nome.startswith("Clínica Nova") for _, p in by_id.values())
+
+
+def test_count_mismatch_leaves_cache_untouched(stub):
+    server, url, v1 = stub
+    tiles = _tiles()
+    busca_lote.aquecer_geohashes(tiles, url)
+    before = _cached(tiles)
+
+    agora = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    good = overpass_stub.replay(overpass_stub.evoluir_fixture(v1, agora))
+
+    def cut(q):
+        data = json.loads(good(q))
+        if ".atual out ids" in q:
+            # an id list cut short, its count still the full one
+            ids = [el for el in data["elements"] if "tags" not in el]
+            data["elements"] = ids[:3] + [el for el in data["elements"] if el["type"] == "count"]
+        return json.dumps(data).encode("utf-8")
+
+    server.payload = cut
+    q0 = len(server.queries)
+    report = busca_lote.aquecer_geohashes(tiles, url, max_age_s=0)
+
+    assert any(".atual out count" in q for q in server.queries[q0:])
+    assert report["por_diff"] == 0
+    assert report["falhas"] >= 1
+    assert _cached(tiles) == before
+
+
+def test_read_diff_raises_on_count_mismatch():
+    answer = {"elements": [{"type": "node", "id": 1}, {"type": "node", "id": 2},
+                           {"type": "count", "id": 0, "tags": {"total": "3"}}]}
+    with pytest.raises(ValueError, match="incompleto"):
+        busca._read_diff(io.BytesIO(json.dumps(answer).encode("utf-8")))
@@ -0,0 +1,69 @@
+import time
+
+from cache_snapshot import CacheSnapshot, exportar_snapshot
+from overpass_cache import SQLiteCache, TieredCache
+
+
+def _age(cache, key, age_s):
+    """Backdates key in the LRU and in SQLite, as if it had been stored age_s ago."""
+    value, ts = cache.memory.get(key)[1], time.time() - age_s
+    cache.memory.set(key, value, ts)
+    cache.backend.set(key, value, ts)
+
+
+def test_lookup_picks_up_row_renewed_by_another_writer(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = TieredCache(SQLiteCache(path))
+    cache.set("k", {"v": 1})
+    _age(cache, "k", 7200)
+    assert cache.lookup("k", 3600) == (None, False)
+
+    # e.g. aquecimento.py running in another process
+    other = SQLiteCache(path)
+    other.set("k", {"v": 2})
+    other.close()
+
+    assert cache.lookup("k", 3600) == ({"v": 2}, True)
+    assert cache.memory.get("k")[1] == {"v": 2}
+    assert cache.entry("k")[1] == {"v": 2}
+    cache.backend.close()
+
+
+def test_stale_memory_copy_kept_when_nothing_newer(tmp_path):
+    cache = TieredCache(SQLiteCache(str(tmp_path / "cache.db")))
+    cache.set("k", {"v": 1})
+    _age(cache, "k", 7200)
+    assert cache.lookup("k", 3600, allow_stale=True) == ({"v": 1}, False)
+    assert cache.stats()["stale_hits"] == 1
+    cache.backend.close()
+
+
+def test_lookup_picks_up_newer_snapshot(tmp_path):
+    exported = str(tmp_path / "export.db")
+    snap_path = str(tmp_path / "cache.snap")
+    cache = TieredCache(SQLiteCache(str(tmp_path / "cache.db")), snapshot=CacheSnapshot(snap_path, recarregar_s=0))
+    cache.set("k", {"v": 1})
+    _age(cache, "k", 7200)
+
+    writer = SQLiteCache(exported)
+    writer.set("k", {"v": 3})
+    writer.close()
+    exportar_snapshot(exported, snap_path)
+
+    assert cache.lookup("k", 3600) == ({"v": 3}, True)
+    assert cache.stats()["snapshot_hits"] == 1
+    # the snapshot copy was fresh: SQLite was not asked
+    assert cache.backend.stats()["reads"] == 0
+    cache.backend.close()
+
+
+def test_backend_read_latency_counted_through_tiered_cache(tmp_path):
+    cache = TieredCache(SQLiteCache(str(tmp_path / "cache.db")))
+    cache.set("k", {"v": 1})
+    cache.memory.clear()
+    cache.lookup("k", 3600)
+    cache.lookup("ausente", 3600)
+    stats = cache.backend.stats()
+    assert stats["reads"] == 2
+    assert stats["avg_get_ms"] > 0.0
+    cache.backend.close()